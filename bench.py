@@ -0,0 +1,651 @@
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from ramemu import FaultInjector, NumpyEngine, PythonEngine, Ram, Scrubber, SharedStorage, VirtualMemory, numpy
+
+# benchmarks for ramemu
+# usage:
+#   python bench.py construct [max_exponent]   construction time, rss and plane bytes against the old lists, sizes 2^9 .. 2^max (default 28)
+#   python bench.py variables [iterations]     variable get/set against the old list based conversions
+#   python bench.py memory [exponent]           whole memory operations per engine on 2^exponent bits (default 20)
+#   python bench.py redundancy [exponent]       plane memory, write and correct cost per redundancy mode (default 20)
+#   python bench.py scrub [exponent] [rate]     scrub interval against lost bits, faults at rate flips/s (default 20, 2000)
+#   python bench.py threads [operations]        concurrent ram ops/s for 1..8 threads on disjoint pages (default 20000)
+#   python bench.py processes [operations]      shared ram ops/s for 1..8 processes on disjoint pages (default 20000)
+#   python bench.py sparse [max_exponent]       sparse ram construction, a few writes and rss, sizes 2^16 .. 2^max (default 40)
+#   python bench.py vm [operations]             virtual memory ops/s and fault rate per policy and resident set (default 50000)
+#   python bench.py transaction [variables]     updating every variable one by one against in one transaction (default 10000)
+#   python bench.py arrays [count]              one array against count separately named variables (default 20000)
+#   python bench.py suite [max_exponent]        the reproducible suite as json on stdout, sizes 2^12 .. 2^max (default 20)
+#   python bench.py compare old.json new.json   speedup per benchmark between two suite runs
+
+
+# the peak rss of the running process in kilobytes. VmHWM where linux has it: ru_maxrss carries the
+# parent's peak over into a child it forks, so every subprocess would start at the size of this one
+PEAK_RSS = (
+    "import resource\n"
+    "try:\n"
+    "    with open('/proc/self/status') as status:\n"
+    "        peak = int(next(line for line in status if line.startswith('VmHWM:')).split()[1])\n"
+    "except (OSError, StopIteration):\n"
+    "    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+)
+
+
+def peak_rss():
+    scope = {}
+    exec(PEAK_RSS, scope)
+    return scope["peak"]
+
+
+def construct(size):
+    start = time.perf_counter()
+    ram = Ram(size)
+    elapsed = time.perf_counter() - start
+    peak = peak_rss()
+    planes = sum(sys.getsizeof(plane.buffer) for plane in (
+        ram.memory, ram.memory_clone_a, ram.memory_clone_b, ram.check_bits, ram.is_used) if plane is not None)
+    print(elapsed, peak, planes)
+
+
+def legacy_plane_bytes(size):
+    # what the list based Ram held per size without building it: memory, the two clones, is_used
+    # and permissions as lists of size entries, plus one entry per 64 bit page. the entries are
+    # shared small ints / tuples, so a list costs its header and one pointer per entry
+    pointer = struct.calcsize("P")
+    return 5 * (sys.getsizeof([]) + size * pointer) + sys.getsizeof([]) + size // 64 * pointer
+
+
+def bare_rss():
+    # peak rss of an interpreter that imports nothing, what the construct numbers are measured against
+    result = subprocess.run(
+        [sys.executable, "-c", PEAK_RSS + "print(peak)"],
+        capture_output=True, text=True, check=True,
+    )
+    return int(result.stdout)
+
+
+def construct_sparse(size):
+    baseline = peak_rss()
+    start = time.perf_counter()
+    ram = Ram(size, sparse=True)
+    built = time.perf_counter() - start
+    # a handful of variables spread over the whole address space
+    start = time.perf_counter()
+    for i in range(16):
+        ram.write_int(size // 16 * i, 64, i)
+    written = time.perf_counter() - start
+    peak = peak_rss()
+    print(built, written, peak - baseline, len(ram.memory.materialized()))
+
+
+def bench_construct(max_exponent=28):
+    # each size runs in a fresh interpreter so the rss numbers don't leak into each other.
+    # rss is over a bare interpreter, so it includes importing ramemu (and numpy), which hides
+    # the small sizes: planes kb (the packed buffers) against lists kb (the old lists) doesn't
+    bare = bare_rss()
+    print("{:>12} {:>12} {:>12} {:>12} {:>12} {:>10}".format(
+        "bits", "seconds", "rss kb", "planes kb", "lists kb", "saving"))
+    for exponent in range(9, max_exponent + 1):
+        size = 2 ** exponent
+        result = subprocess.run(
+            [sys.executable, __file__, "--construct", str(size)],
+            capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            print("{:>12} failed: {}".format(size, result.stderr.strip().splitlines()[-1:]))
+            continue
+        elapsed, peak, planes = result.stdout.split()
+        legacy = legacy_plane_bytes(size)
+        print("{:>12} {:>12.6f} {:>12} {:>12.1f} {:>12.1f} {:>9.1f}x".format(
+            size, float(elapsed), int(peak) - bare, int(planes) / 1024, legacy / 1024, legacy / int(planes)))
+
+
+def bench_sparse(max_exponent=40):
+    # like construct, but for sparse rams: the cost should follow what is touched, not the size
+    print("{:>16} {:>12} {:>12} {:>12} {:>12}".format("bits", "construct s", "16 writes s", "rss kb", "pages"))
+    for exponent in range(16, max_exponent + 1, 4):
+        size = 2 ** exponent
+        result = subprocess.run(
+            [sys.executable, __file__, "--sparse", str(size)],
+            capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            print("{:>16} failed: {}".format(size, result.stderr.strip().splitlines()[-1:]))
+            continue
+        built, written, grown, pages = result.stdout.split()
+        print("{:>16} {:>12.6f} {:>12.6f} {:>12} {:>12}".format(size, float(built), float(written), grown, pages))
+
+
+# the list based conversions Ram used before the int fast path, kept here as the baseline
+def legacy_twos_complement(bin_array, size):
+    bin_array = [0] * (size - len(bin_array)) + bin_array
+    bin_array = [1 - bit for bit in bin_array]
+    carry = 1
+    for i in range(size - 1, -1, -1):
+        if bin_array[i] == 0 and carry == 1:
+            bin_array[i] = 1
+            carry = 0
+        elif bin_array[i] == 1 and carry == 1:
+            bin_array[i] = 0
+            carry = 1
+    return bin_array
+
+
+def legacy_dec_to_bin(dec, size):
+    if dec == 0:
+        return [0] * size
+    bin_array = []
+    is_negative = dec < 0
+    dec = abs(dec)
+    while dec > 0:
+        bin_array.append(dec % 2)
+        dec //= 2
+    bin_array.reverse()
+    bin_array = [0] * (size - len(bin_array)) + bin_array
+    if is_negative:
+        bin_array = legacy_twos_complement(bin_array, size)
+    return bin_array
+
+
+def legacy_bin_to_dec(bin_array):
+    if bin_array[0] == 1:
+        bin_copy = legacy_twos_complement(bin_array[:], len(bin_array))
+        return -sum(bin_copy[i] * (2 ** (len(bin_copy) - i - 1)) for i in range(len(bin_copy)))
+    return sum(bin_array[i] * (2 ** (len(bin_array) - i - 1)) for i in range(len(bin_array)))
+
+
+class LegacyRam:
+    # just the planes the old per bit read/write paths touched
+    def __init__(self, size):
+        self.memory = [0] * size
+        self.memory_clone_a = [0] * size
+        self.memory_clone_b = [0] * size
+        self.is_used = [False] * size
+        self.permissions = [(True, True)] * size
+
+    def check_permissions(self, position, length, for_write):
+        for i in range(length):
+            r, w = self.permissions[position + i]
+            if (for_write and not w) or (not for_write and not r):
+                raise Exception("permission denied at position {}".format(position + i))
+
+    def increment(self, position, size):
+        # ram["a"] += 1 the old way: read bits, convert, convert back, write bits
+        self.check_permissions(position, size, False)
+        value = legacy_bin_to_dec([self.memory[position + i] for i in range(size)])
+        value += 1
+        if value >= 2 ** (size - 1):
+            value = -(2 ** (size - 1))
+        data = legacy_dec_to_bin(value, size)
+        self.check_permissions(position, size, True)
+        for i in range(size):
+            self.memory[position + i] = data[i]
+            self.memory_clone_a[position + i] = data[i]
+            self.memory_clone_b[position + i] = data[i]
+            self.is_used[position + i] = True
+
+
+def bench_variables(iterations=2000):
+    print("{:>6} {:>14} {:>14} {:>10}".format("bits", "legacy us/op", "ramemu us/op", "speedup"))
+    for bits in (8, 16, 32, 64, 1024):
+        legacy_ram = LegacyRam(bits * 2)
+        legacy_ram.memory[:bits] = legacy_dec_to_bin(-12345 % (2 ** (bits - 1)), bits)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            legacy_ram.increment(0, bits)
+        legacy = (time.perf_counter() - start) / iterations * 1e6
+
+        ram = Ram(bits * 2)
+        ram.new_variable_left("a", bits, -12345 % (2 ** (bits - 1)))
+        start = time.perf_counter()
+        for _ in range(iterations):
+            ram["a"] += 1
+        current = (time.perf_counter() - start) / iterations * 1e6
+        print("{:>6} {:>14.2f} {:>14.2f} {:>9.1f}x".format(bits, legacy, current, legacy / current))
+
+
+def legacy_whole_memory(size, rng):
+    # the old per bit loops over lists, for randomize_all / correct / compare_memory
+    memory, clone_a, clone_b = [0] * size, [0] * size, [0] * size
+    timings = {}
+    start = time.perf_counter()
+    for i in range(size):
+        val = rng.randint(0, 1)
+        memory[i] = val
+        clone_a[i] = val
+        clone_b[i] = val
+    timings["randomize_all"] = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(size):
+        if clone_a[i] == clone_b[i]:
+            memory[i] = clone_a[i]
+        else:
+            values = [memory[i], clone_a[i], clone_b[i]]
+            memory[i] = max(set(values), key=values.count)
+    timings["correct"] = time.perf_counter() - start
+    start = time.perf_counter()
+    [i for i in range(size) if memory[i] != clone_a[i] or memory[i] != clone_b[i]]
+    timings["compare_memory"] = time.perf_counter() - start
+    return timings
+
+
+def bench_memory(exponent=20):
+    import random
+    size = 2 ** exponent
+    engines = [PythonEngine()] + ([NumpyEngine()] if numpy is not None else [])
+    operations = ["randomize_all", "randomize", "randomize_unused", "reverse_all",
+                  "correct", "compare_memory", "memory_usage", "defragment"]
+    results = {}
+    for engine in engines:
+        ram = Ram(size, seed=1, engine=engine)
+        # half the memory used, in scattered blocks
+        while ram.memory_usage() < 50:
+            ram.allocate(64)
+        for name in operations:
+            start = time.perf_counter()
+            getattr(ram, name)()
+            results[engine.name, name] = time.perf_counter() - start
+    legacy = legacy_whole_memory(size, random.Random(1))
+    names = [engine.name for engine in engines]
+    print("{} bits".format(size))
+    print("{:>18} {:>12}".format("operation", "legacy s") + "".join("{:>12}".format(name + " s") for name in names))
+    for name in operations:
+        row = "{:>18} {:>12}".format(name, "{:.4f}".format(legacy[name]) if name in legacy else "-")
+        print(row + "".join("{:>12.4f}".format(results[engine, name]) for engine in names))
+
+
+def bench_redundancy(exponent=20, writes=20000):
+    size = 2 ** exponent
+    print("{} bits".format(size))
+    print("{:>10} {:>12} {:>14} {:>12} {:>14}".format("mode", "plane kb", "write us/op", "correct s", "fixed / flips"))
+    for mode in ("tmr", "hamming", "parity", "none"):
+        ram = Ram(size, seed=1, redundancy=mode)
+        kb = sum(len(getattr(ram, name).buffer) for name in ram._plane_names()) / 1024
+        start = time.perf_counter()
+        for i in range(writes):
+            ram.write_int((i * 97) % (size - 32), 32, i)
+        write = (time.perf_counter() - start) / writes * 1e6
+        # one flipped bit in every 16th word
+        flips = 0
+        for word in range(0, size // 64, 16):
+            ram.memory[word * 64 + word % 64] ^= 1
+            flips += 1
+        start = time.perf_counter()
+        fixed = ram.correct()
+        elapsed = time.perf_counter() - start
+        print("{:>10} {:>12.1f} {:>14.2f} {:>12.4f} {:>14}".format(mode, kb, write, elapsed, "{} / {}".format(fixed, flips)))
+
+
+def bench_scrub(exponent=20, rate=2000, seconds=10):
+    # simulated time: faults for one interval, then a full scrub pass, until seconds have passed
+    # lost bits are the main memory bits that differ from the data written at the start
+    size = 2 ** exponent
+    print("{} bits, {} flips/s and {} bursts/s for {} simulated seconds".format(size, rate, rate / 100, seconds))
+    print("{:>8} {:>10} {:>10} {:>12} {:>14} {:>10} {:>12}".format(
+        "mode", "interval", "flipped", "corrected", "uncorrectable", "lost", "scrub Mbit/s"))
+    for mode in ("tmr", "hamming", "parity"):
+        for interval in (0.1, 1.0, 10.0):
+            ram = Ram(size, seed=1, redundancy=mode)
+            ram.randomize_all()
+            truth = int.from_bytes(ram.memory.tobytes(), "big")
+            scrubber = Scrubber(ram)
+            faults = FaultInjector(ram, rate=rate, burst_rate=rate / 100, seed=2)
+            for _ in range(round(seconds / interval)):
+                faults.advance(interval)
+                scrubber.scrub_all()
+            lost = bin(truth ^ int.from_bytes(ram.memory.tobytes(), "big")).count("1")
+            stats = scrubber.stats()
+            print("{:>8} {:>10} {:>10} {:>12} {:>14} {:>10} {:>12.1f}".format(
+                mode, interval, faults.flipped_bits, stats["corrected_bits"], stats["uncorrectable_words"],
+                lost, stats["bits_per_second"] / 1e6))
+
+
+def run_threads(count, work):
+    threads = [threading.Thread(target=work, args=(index,)) for index in range(count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def bench_threads(operations=20000):
+    # each thread writes and reads back 32 bit words in its own 512 bit lock page
+    gil = sys._is_gil_enabled() if hasattr(sys, "_is_gil_enabled") else True
+    print("gil {}".format("enabled" if gil else "disabled"))
+    print("{:>8} {:>12} {:>10}".format("threads", "ops/s", "scaling"))
+    single = None
+    for count in (1, 2, 4, 8):
+        ram = Ram(count * 512 * 4, concurrent=True)
+        per_thread = operations // count
+
+        def work(index):
+            page = index * 512 * 4
+            for i in range(per_thread):
+                position = page + (i % 16) * 32
+                ram.write_int(position, 32, i)
+                ram.read_int(position, 32)
+
+        rate = per_thread * count * 2 / run_threads(count, work)
+        single = single or rate
+        print("{:>8} {:>12.0f} {:>9.2f}x".format(count, rate, rate / single))
+    # every thread bumps the same counter, nothing may get lost
+    ram = Ram(1024, concurrent=True)
+    ram.new_variable_left("counter", 32, 0)
+    adds = operations // 8
+
+    def bump(index):
+        for _ in range(adds):
+            ram.fetch_add("counter", 1)
+
+    run_threads(8, bump)
+    print("fetch_add: {} of {}".format(ram["counter"], adds * 8))
+
+
+def process_work(name, index, operations, results):
+    # one worker process: attach, then write and read back 32 bit words in its own lock pages
+    ram = Ram.attach(name)
+    # the first lock page holds the shared counter
+    page = 512 + index * 512 * 4
+    start = time.perf_counter()
+    for i in range(operations):
+        position = page + (i % 16) * 32
+        ram.write_int(position, 32, i)
+        ram.read_int(position, 32)
+    elapsed = time.perf_counter() - start
+    for _ in range(operations // 10):
+        ram.fetch_add("counter", 1)
+    results.put(elapsed)
+    ram.storage.close()
+
+
+def bench_processes(operations=20000):
+    # total ops/s is measured from the slowest worker, attaching is not counted
+    ram = Ram(8 * 512 * 4)
+    start = time.perf_counter()
+    for i in range(operations):
+        ram.write_int((i % 16) * 32, 32, i)
+        ram.read_int((i % 16) * 32, 32)
+    private = operations * 2 / (time.perf_counter() - start)
+    print("private ram, one process: {:.0f} ops/s".format(private))
+    print("{:>10} {:>12} {:>10}".format("processes", "ops/s", "scaling"))
+    single = None
+    for count in (1, 2, 4, 8):
+        storage = SharedStorage()
+        ram = Ram(512 + count * 512 * 4, storage=storage)
+        ram.new_variable_left("counter", 32, 0)
+        per_process = operations // count
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=process_work, args=(storage.name, index, per_process, results))
+                   for index in range(count)]
+        for worker in workers:
+            worker.start()
+        elapsed = max(results.get() for _ in workers)
+        for worker in workers:
+            worker.join()
+        rate = per_process * count * 2 / elapsed
+        single = single or rate
+        expected = per_process // 10 * count
+        print("{:>10} {:>12.0f} {:>9.2f}x   fetch_add {} of {}".format(
+            count, rate, rate / single, ram["counter"], expected))
+        storage.close()
+        storage.unlink()
+
+
+def bench_vm(operations=50000):
+    # 64 bit writes and reads to a 2^40 bit virtual space: 90% go to a hot set of 64 pages,
+    # the rest anywhere, so the hot set fits in every resident set but the tail keeps evicting
+    print("{:>7} {:>8} {:>12} {:>12} {:>12} {:>12}".format(
+        "policy", "frames", "ops/s", "fault rate", "swap outs", "swap kb"))
+    for policy in ("lru", "clock"):
+        for frames in (16, 64, 256, 1024):
+            ram = Ram(frames * 64 * 2, redundancy="none")
+            vm = VirtualMemory(ram, 1 << 40, frames=frames, policy=policy)
+            rng = random.Random(1)
+            pages = [rng.randrange(64) if rng.random() < 0.9 else rng.randrange(1 << 34) for _ in range(operations)]
+            start = time.perf_counter()
+            for i, page in enumerate(pages):
+                vm.write_int(page * 64, 64, i)
+                vm.read_int(page * 64, 64)
+            elapsed = time.perf_counter() - start
+            stats = vm.stats()
+            print("{:>7} {:>8} {:>12.0f} {:>12.4f} {:>12} {:>12}".format(
+                policy, frames, operations * 2 / elapsed, stats["fault_rate"], stats["swap_outs"],
+                stats["swap_bytes"] // 1024))
+            vm.close()
+
+
+def bench_transaction(count=10000):
+    # the bulk update workload: every variable of a ram gets a new value
+    print("{:>10} {:>12} {:>12} {:>10}".format("redundancy", "plain s", "batched s", "speedup"))
+    for redundancy in ("tmr", "hamming", "none"):
+        ram = Ram(count * 32 * 2, redundancy=redundancy)
+        names = ["v{}".format(index) for index in range(count)]
+        for name in names:
+            ram.new_variable_left(name, 32, 0)
+        start = time.perf_counter()
+        for index, name in enumerate(names):
+            ram[name] = index
+        plain = time.perf_counter() - start
+        start = time.perf_counter()
+        with ram.transaction():
+            for index, name in enumerate(names):
+                ram[name] = index + 1
+        batched = time.perf_counter() - start
+        assert ram[names[-1]] == count
+        print("{:>10} {:>12.4f} {:>12.4f} {:>9.2f}x".format(redundancy, plain, batched, plain / batched))
+
+
+def bench_arrays(count=20000):
+    # the old way to model an array (a variable per element) against new_array and slices
+    ram = Ram(count * 32 * 2)
+    start = time.perf_counter()
+    for index in range(count):
+        ram.new_variable_left("v{}".format(index), 32, 0)
+    create = time.perf_counter() - start
+    start = time.perf_counter()
+    for index in range(count):
+        ram["v{}".format(index)] = index
+    values = [ram["v{}".format(index)] for index in range(count)]
+    access = time.perf_counter() - start
+    print("variables: create {:.4f}s, write + read all {:.4f}s".format(create, access))
+    ram = Ram(count * 32 * 2)
+    start = time.perf_counter()
+    ram.new_array("a", 32, count)
+    create = time.perf_counter() - start
+    array = ram.array("a")
+    start = time.perf_counter()
+    array[:] = range(count)
+    assert array[:] == values
+    access = time.perf_counter() - start
+    start = time.perf_counter()
+    for index in range(count):
+        array[index] = array[index] + 1
+    elements = time.perf_counter() - start
+    print("array:     create {:.4f}s, write + read all {:.4f}s, element by element {:.4f}s".format(
+        create, access, elements))
+
+
+SUITE_SEED = 1
+SUITE_REPEATS = 3
+
+
+def suite_churn(ram, rng):
+    # allocate and free random sized blocks, freeing a random live one whenever more than 32 are live
+    live = []
+    for _ in range(2000):
+        if len(live) > 32 or (live and rng.random() < 0.3):
+            position, size = live.pop(rng.randrange(len(live)))
+            ram.free(position, size)
+        else:
+            size = rng.randint(1, max(1, ram.size // 256))
+            try:
+                live.append((ram.allocate(size), size))
+            except Exception:
+                pass
+    return 2000
+
+
+def suite_variables(ram, rng):
+    count = min(256, ram.size // 64)
+    names = ["v{}".format(index) for index in range(count)]
+    for name in names:
+        ram.new_variable_left(name, 32, 0)
+    for repeat in range(8):
+        for index, name in enumerate(names):
+            ram[name] = index + repeat
+            ram[name]
+    return count * 16
+
+
+def suite_bulk(ram, rng):
+    data = bytes(rng.getrandbits(8) for _ in range(ram.size // 8))
+    for _ in range(4):
+        ram.write_bytes(0, data)
+        assert ram.read_bytes(0, len(data)) == data
+    return 8
+
+
+def suite_scan(ram, rng):
+    ram.randomize_all()
+    for _ in range(4):
+        ram.scan_for_pattern([1, 0, 1, 1, 0, 0, 1, 0], max_matches=1000)
+    return 4
+
+
+def suite_correct(ram, rng):
+    ram.randomize_all()
+    for plane in (ram.memory, ram.memory_clone_a, ram.memory_clone_b)[:3 if ram.redundancy == "tmr" else 1]:
+        for _ in range(64):
+            plane[rng.randrange(ram.size)] ^= 1
+    ram.correct()
+    return 1
+
+
+def suite_save_load(ram, rng):
+    ram.randomize_all()
+    handle, filename = tempfile.mkstemp(prefix="ramemu_bench_")
+    os.close(handle)
+    try:
+        for _ in range(2):
+            ram.save(filename)
+            ram.load(filename)
+    finally:
+        os.remove(filename)
+    return 4
+
+
+SUITE = [
+    ("allocation_churn", suite_churn),
+    ("variable_get_set", suite_variables),
+    ("bulk_io", suite_bulk),
+    ("scan", suite_scan),
+    ("correct", suite_correct),
+    ("save_load", suite_save_load),
+]
+
+
+def bench_suite(max_exponent=20):
+    # every benchmark on a fresh, seeded ram per size and redundancy, best of SUITE_REPEATS runs,
+    # plus the allocation stats of one instrumented churn run per size. only json goes to stdout
+    results = []
+    allocation = []
+    for exponent in range(12, max_exponent + 1, 4):
+        size = 1 << exponent
+        for redundancy in ("tmr", "none"):
+            for name, work in SUITE:
+                best = None
+                for _ in range(SUITE_REPEATS):
+                    ram = Ram(size, redundancy=redundancy, seed=SUITE_SEED)
+                    rng = random.Random(SUITE_SEED)
+                    start = time.perf_counter()
+                    ops = work(ram, rng)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                results.append({"benchmark": name, "bits": size, "redundancy": redundancy, "seconds": best,
+                                "ops": ops, "ops_per_second": ops / best if best else None})
+        ram = Ram(size, seed=SUITE_SEED)
+        ram.enable_stats()
+        suite_churn(ram, random.Random(SUITE_SEED))
+        allocation.append(dict(ram.stats()["allocation"], bits=size))
+    json.dump({
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "numpy": numpy.__version__ if numpy is not None else None,
+        "seed": SUITE_SEED,
+        "repeats": SUITE_REPEATS,
+        "results": results,
+        "allocation": allocation,
+    }, sys.stdout, indent=1)
+    print()
+
+
+def bench_compare(old, new):
+    # new / old ops per second for every benchmark both suite runs have
+    with open(old) as handle:
+        before = {(entry["benchmark"], entry["bits"], entry["redundancy"]): entry for entry in json.load(handle)["results"]}
+    with open(new) as handle:
+        after = json.load(handle)["results"]
+    print("{:>18} {:>10} {:>10} {:>12} {:>12} {:>9}".format("benchmark", "bits", "redundancy", "old ops/s", "new ops/s", "speedup"))
+    for entry in after:
+        previous = before.get((entry["benchmark"], entry["bits"], entry["redundancy"]))
+        if previous is None or not previous["ops_per_second"] or not entry["ops_per_second"]:
+            continue
+        print("{:>18} {:>10} {:>10} {:>12.1f} {:>12.1f} {:>8.2f}x".format(
+            entry["benchmark"], entry["bits"], entry["redundancy"], previous["ops_per_second"],
+            entry["ops_per_second"], entry["ops_per_second"] / previous["ops_per_second"]))
+
+
+def main():
+    name = sys.argv[1] if len(sys.argv) > 1 else "construct"
+    # compare takes file names, every other benchmark numbers
+    args = sys.argv[2:] if name == "compare" else [int(arg) for arg in sys.argv[2:]]
+    if name == "--construct":
+        construct(*args)
+    elif name == "--sparse":
+        construct_sparse(*args)
+    elif name == "construct":
+        bench_construct(*args)
+    elif name == "variables":
+        bench_variables(*args)
+    elif name == "memory":
+        bench_memory(*args)
+    elif name == "redundancy":
+        bench_redundancy(*args)
+    elif name == "scrub":
+        bench_scrub(*args)
+    elif name == "threads":
+        bench_threads(*args)
+    elif name == "processes":
+        bench_processes(*args)
+    elif name == "sparse":
+        bench_sparse(*args)
+    elif name == "vm":
+        bench_vm(*args)
+    elif name == "transaction":
+        bench_transaction(*args)
+    elif name == "arrays":
+        bench_arrays(*args)
+    elif name == "suite":
+        bench_suite(*args)
+    elif name == "compare":
+        bench_compare(*args)
+    else:
+        raise SystemExit("unknown benchmark: {}".format(name))
+
+
+if __name__ == "__main__":
+    main()
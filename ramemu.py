@@ -1,287 +1,3455 @@
+import asyncio
+import functools
+import heapq
+import inspect
+import json
+import lzma
+import math
+import mmap
+import os
 import random
-import pickle
+import re
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager, nullcontext
+from itertools import chain, islice
+
+try:
+    import numpy
+except ImportError:  # numpy is optional, the python engine is used without it
+    numpy = None
+
+try:
+    import fcntl
+except ImportError:  # not on windows, SharedStorage needs it for its locks
+    fcntl = None
+
+# translation tables between packed bits and their text / list forms
+_BITS_TO_TEXT = bytes.maketrans(bytes(range(256)), b"0" + b"1" * 255)
+_TEXT_TO_BITS = bytes.maketrans(b"01", b"\x00\x01")
+_RUN_PATTERNS = (re.compile("0+"), re.compile("1+"))
+_RUN_CHUNK = 1 << 20  # bits decoded at a time when scanning for runs or patterns
+_DUMP_CHUNK = 1 << 20  # bits read at a time by the dumps and iter_bytes
+# hex dump text column: printable ascii stays, everything else is a dot
+_PRINTABLE = bytes.maketrans(bytes(range(256)), bytes(c if 32 <= c < 127 else 46 for c in range(256)))
+
+
+def _bits_to_int(bits):
+    # converts a list of 0/1 values (msb first) to an unsigned int
+    if len(bits) == 0:
+        return 0
+    return int(bytes(bits).translate(_BITS_TO_TEXT), 2)
+
+
+def _int_to_bits(value, length):
+    # converts an unsigned int to a list of 0/1 values (msb first)
+    if length <= 0:
+        return []
+    return list(format(value, "0{}b".format(length)).encode().translate(_TEXT_TO_BITS))
+
+
+def _string_to_int(string):
+    # (value, bits) of a string at 8 bits per char, through the latin-1 codec
+    try:
+        data = string.encode("latin-1")
+    except UnicodeEncodeError:
+        # chars past 255 keep all their bits, as they always did
+        text = "".join(format(ord(char), "08b") for char in string)
+        return int(text or "0", 2), len(text)
+    return int.from_bytes(data, "big"), len(data) * 8
+
+
+def _int_to_bytes(value, length):
+    # length bits as bytes, a short last byte holds its bits as a number
+    nbytes, rest = divmod(length, 8)
+    data = (value >> rest).to_bytes(nbytes, "big")
+    return data + bytes((value & ((1 << rest) - 1),)) if rest else data
+
+
+def _pattern_text(pattern):
+    # a bit pattern given as a list of 0/1 or a '0'/'1' string, as a '0'/'1' string
+    if isinstance(pattern, str):
+        if pattern.strip("01"):
+            raise Exception("pattern strings may only contain 0 and 1.")
+        return pattern
+    return bytes(pattern).translate(_BITS_TO_TEXT).decode()
+
+
+def _search(read_text, patterns, start, end):
+    # yields (position, pattern index) for every overlapping match fully inside [start, end),
+    # in position order. read_text(position, length) decodes the bits once per chunk and every
+    # pattern is looked for in that chunk with str.find, so the search loops run in c
+    # (boyer-moore style) instead of comparing slices at every offset
+    longest = max(len(pattern) for pattern in patterns)
+    for chunk_start in range(start, end, _RUN_CHUNK):
+        # chunks overlap by longest - 1 bits so matches crossing a boundary are found once
+        text = read_text(chunk_start, min(end, chunk_start + _RUN_CHUNK + max(longest - 1, 0)) - chunk_start)
+        limit = min(_RUN_CHUNK, end - chunk_start)
+        found = []
+        for index, pattern in enumerate(patterns):
+            if not pattern:
+                found.extend((offset, index) for offset in range(limit))
+                continue
+            offset = text.find(pattern)
+            while offset != -1 and offset < limit:
+                found.append((offset, index))
+                offset = text.find(pattern, offset + 1)
+        if len(patterns) > 1:
+            found.sort()
+        for offset, index in found:
+            yield chunk_start + offset, index
+    # an empty pattern also matches right at the end of the range
+    for index, pattern in enumerate(patterns):
+        if not pattern:
+            yield end, index
+
+
+# snapshot file: header, json metadata, the packed planes (raw or compressed), crc32 trailer
+_SNAPSHOT_MAGIC = b"RAMEMU"
+_SNAPSHOT_VERSION = 3  # 2: redundancy modes, planes may differ in size. 3: sparse planes
+_SNAPSHOT_HEADER = struct.Struct(">6sBBI")  # magic, version, compression, metadata length
+_SNAPSHOT_TRAILER = struct.Struct(">I")  # crc32 of the metadata and the raw plane bytes
+_SNAPSHOT_CHUNK = 1 << 20  # bytes written / read at a time
+_COMPRESSIONS = (None, "zlib", "lzma")
+
+
+def _compressor(compression):
+    if compression == "zlib":
+        return zlib.compressobj()
+    if compression == "lzma":
+        return lzma.LZMACompressor()
+    return None
+
+
+def _snapshot_chunks(file, compression, nbytes):
+    # yields the raw plane bytes of a snapshot in bounded chunks, then returns the trailer
+    if compression is None:
+        while nbytes > 0:
+            data = file.read(min(_SNAPSHOT_CHUNK, nbytes))
+            if not data:
+                raise Exception("snapshot is truncated.")
+            nbytes -= len(data)
+            yield data
+        return file.read(_SNAPSHOT_TRAILER.size)
+    if compression == "zlib":
+        decompressor = zlib.decompressobj()
+    else:
+        decompressor = lzma.LZMADecompressor()
+    while not decompressor.eof:
+        # max_length keeps a highly compressed plane from expanding all at once
+        if compression == "zlib":
+            data = decompressor.unconsumed_tail or file.read(_SNAPSHOT_CHUNK)
+        else:
+            data = file.read(_SNAPSHOT_CHUNK) if decompressor.needs_input else b""
+        if not data and (compression == "zlib" or decompressor.needs_input):
+            raise Exception("snapshot is truncated.")
+        yield decompressor.decompress(data, _SNAPSHOT_CHUNK)
+    return (decompressor.unused_data + file.read())[:_SNAPSHOT_TRAILER.size]
+
+
+def _byte_extents(plane):
+    # [first byte, bytes] pieces of a plane a snapshot stores: all of it, or the materialized
+    # pages of a sparse plane
+    return [[start // 8, (start + length + 7) // 8 - start // 8]
+            for start, length, materialized in plane.segments() if materialized]
+
+
+def _to_signed(value, length):
+    # reads an unsigned int of length bits as two's complement
+    if length and value >> (length - 1):
+        return value - (1 << length)
+    return value
+
+
+def _pack(values, bits):
+    # ints (wrapping like write_int) -> one unsigned int of len(values) * bits, first value highest
+    mask = (1 << bits) - 1
+    if bits % 8 == 0:
+        width = bits // 8
+        return int.from_bytes(b"".join((value & mask).to_bytes(width, "big") for value in values), "big")
+    return int("".join(format(value & mask, "0{}b".format(bits)) for value in values) or "0", 2)
+
+
+def _unpack(value, bits, count, signed):
+    # the other way around: count elements of bits each, two's complement when signed
+    if bits % 8 == 0:
+        width = bits // 8
+        data = value.to_bytes(width * count, "big")
+        if numpy is not None and width in (1, 2, 4, 8):
+            return numpy.frombuffer(data, dtype=">{}{}".format("i" if signed else "u", width)).tolist()
+        return [int.from_bytes(data[i:i + width], "big", signed=signed) for i in range(0, len(data), width)]
+    text = format(value, "0{}b".format(bits * count))
+    values = [int(text[i:i + bits], 2) for i in range(0, len(text), bits)]
+    return [_to_signed(value, bits) for value in values] if signed else values
+
+
+def _spans(position, length, base, size):
+    # physical (start, length) pieces of a logical range. logical addresses run from 0 to size,
+    # a range past the last bit is an IndexError; translating by base (a rotation) is the only
+    # thing that carries a range across the physical end, it's then two pieces
+    if not 0 <= position or position + length > size:
+        raise IndexError("bit range out of range")
+    if length <= 0:
+        return ()
+    if not base:
+        return ((position, length),)
+    return _wrap((position + base) % size, length, size)
+
+
+def _wrap(start, length, size):
+    # pieces of a range on a ring of size bits, the part past the end continues at 0
+    # (physical ranges, and variables a rotation carried across the end of the address space)
+    if length <= 0:
+        return ()
+    if start + length <= size:
+        return ((start, length),)
+    return ((start, size - start), (0, start + length - size))
+
+
+class BitArray:
+    # packed bit storage, 8 bits per byte, bit 0 is the msb of byte 0
+    # behaves like a list of 0/1 ints for indexing, slicing and iteration,
+    # and exposes int based range access for the hot paths
+    def __init__(self, size, buffer=None):
+        self.size = size
+        if buffer is None:
+            buffer = bytearray((size + 7) // 8)
+        self.buffer = buffer
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.size)
+            if step == 1:
+                return self.get_bits(start, max(0, stop - start))
+            return [self[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("bit index out of range")
+        return (self.buffer[index >> 3] >> (7 - (index & 7))) & 1
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.size)
+            positions = range(start, stop, step)
+            if len(value) != len(positions):
+                raise ValueError("cannot resize a bit array")
+            if step == 1:
+                self.set_bits(start, value)
+            else:
+                for i, bit in zip(positions, value):
+                    self[i] = bit
+            return
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("bit index out of range")
+        mask = 0x80 >> (index & 7)
+        if value:
+            self.buffer[index >> 3] |= mask
+        else:
+            self.buffer[index >> 3] &= ~mask & 0xFF
+
+    def __iter__(self):
+        return iter(self.get_bits(0, self.size))
+
+    def __eq__(self, other):
+        if isinstance(other, BitArray):
+            return self.size == other.size and self.get_int(0, self.size) == other.get_int(0, other.size)
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return "BitArray({}, {!r})".format(self.size, self.to_text(0, min(self.size, 64)))
+
+    def _check_range(self, position, length):
+        if position < 0 or length < 0 or position + length > self.size:
+            raise IndexError("bit range out of range")
+
+    def get_int(self, position, length):
+        # read length bits starting at position as an unsigned int
+        self._check_range(position, length)
+        if length == 0:
+            return 0
+        first = position >> 3
+        last = (position + length + 7) >> 3
+        chunk = int.from_bytes(self.buffer[first:last], "big")
+        return (chunk >> ((last << 3) - position - length)) & ((1 << length) - 1)
+
+    def set_int(self, position, length, value):
+        # write the low length bits of an unsigned int starting at position
+        self._check_range(position, length)
+        if length == 0:
+            return
+        first = position >> 3
+        last = (position + length + 7) >> 3
+        if not (position | length) & 7:
+            # whole bytes, nothing around the range to preserve
+            self.buffer[first:last] = (value & ((1 << length) - 1)).to_bytes(last - first, "big")
+            return
+        shift = (last << 3) - position - length
+        mask = ((1 << length) - 1) << shift
+        chunk = int.from_bytes(self.buffer[first:last], "big")
+        chunk = (chunk & ~mask) | ((value << shift) & mask)
+        self.buffer[first:last] = chunk.to_bytes(last - first, "big")
+
+    def get_bits(self, position, length):
+        return _int_to_bits(self.get_int(position, length), length)
+
+    def get_bytes(self, position, nbytes):
+        # nbytes starting at a bit position, sliced directly when it is byte aligned
+        if position & 7:
+            return self.get_int(position, nbytes * 8).to_bytes(nbytes, "big")
+        self._check_range(position, nbytes * 8)
+        return bytes(self.buffer[position >> 3:(position >> 3) + nbytes])
+
+    def set_bytes(self, position, data):
+        # write a bytes-like object starting at a bit position
+        nbytes = len(data)
+        if position & 7:
+            self.set_int(position, nbytes * 8, int.from_bytes(data, "big"))
+            return
+        self._check_range(position, nbytes * 8)
+        self.buffer[position >> 3:(position >> 3) + nbytes] = data
+
+    def set_bits(self, position, bits):
+        self.set_int(position, len(bits), _bits_to_int(bits))
+
+    def fill(self, position, length, value):
+        # set a whole range to 0 or 1
+        self.set_int(position, length, (1 << length) - 1 if value else 0)
+
+    def count(self, position=0, length=None):
+        # number of set bits in a range
+        if length is None:
+            length = self.size - position
+        return bin(self.get_int(position, length)).count("1")
+
+    def to_text(self, position=0, length=None):
+        # range as a string of '0' and '1'
+        if length is None:
+            length = self.size - position
+        if length == 0:
+            return ""
+        return format(self.get_int(position, length), "0{}b".format(length))
+
+    def runs(self, value, position=0, length=None):
+        # yields (start, length) of every maximal run of value in a range
+        # the range is decoded in chunks so huge planes don't become one huge string
+        if length is None:
+            length = self.size - position
+        pattern = _RUN_PATTERNS[1 if value else 0]
+        run_start = run_end = None
+        for chunk_start in range(position, position + length, _RUN_CHUNK):
+            text = self.to_text(chunk_start, min(_RUN_CHUNK, position + length - chunk_start))
+            for match in pattern.finditer(text):
+                start = chunk_start + match.start()
+                if start == run_end:
+                    # run continues across the chunk boundary
+                    run_end = chunk_start + match.end()
+                    continue
+                if run_start is not None:
+                    yield run_start, run_end - run_start
+                run_start, run_end = start, chunk_start + match.end()
+        if run_start is not None:
+            yield run_start, run_end - run_start
+
+    def tobytes(self):
+        return bytes(self.buffer)
+
+    def copy(self):
+        return BitArray(self.size, bytearray(self.buffer))
+
+    def segments(self, position=0, length=None):
+        # yields (start, length, materialized) pieces of a range, dense planes are one piece
+        if length is None:
+            length = self.size - position
+        if length > 0:
+            yield position, length, True
+
+    def rotate_left(self, shift):
+        # move every bit shift places towards index 0, the first ones wrap to the end
+        shift %= self.size or 1
+        if shift:
+            value = self.get_int(0, self.size)
+            mask = (1 << self.size) - 1
+            self.set_int(0, self.size, ((value << shift) | (value >> (self.size - shift))) & mask)
+
+
+class _SparseBuffer:
+    # the bytes of a sparse plane: pages of page_bytes that only exist once something non zero
+    # is written to them, the rest reads as zero. supports the indexing and (step 1) slicing
+    # BitArray does on its bytearray, so all of BitArray works on top of it
+    def __init__(self, nbytes, page_bytes):
+        self.nbytes = nbytes
+        self.page_bytes = page_bytes
+        self.pages = {}
+
+    def __len__(self):
+        return self.nbytes
+
+    def _page_length(self, page):
+        return min(self.page_bytes, self.nbytes - page * self.page_bytes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(self.nbytes)
+            if stop <= start:
+                return b""
+            size = self.page_bytes
+            parts = []
+            for page in range(start // size, (stop - 1) // size + 1):
+                first = max(start, page * size) - page * size
+                last = min(stop, (page + 1) * size) - page * size
+                data = self.pages.get(page)
+                parts.append(bytes(last - first) if data is None else bytes(data[first:last]))
+            return b"".join(parts)
+        if index < 0:
+            index += self.nbytes
+        if not 0 <= index < self.nbytes:
+            raise IndexError("byte index out of range")
+        data = self.pages.get(index // self.page_bytes)
+        return 0 if data is None else data[index % self.page_bytes]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(self.nbytes)
+            value = memoryview(value).cast("B")
+            if len(value) != stop - start:
+                raise ValueError("cannot resize a sparse buffer")
+            size = self.page_bytes
+            for page in range(start // size, (stop - 1) // size + 1) if stop > start else ():
+                first = max(start, page * size)
+                last = min(stop, (page + 1) * size)
+                piece = value[first - start:last - start].tobytes()
+                data = self.pages.get(page)
+                if data is None:
+                    if piece.count(0) == len(piece):
+                        continue
+                    data = self.pages[page] = bytearray(self._page_length(page))
+                data[first - page * size:last - page * size] = piece
+            return
+        if index < 0:
+            index += self.nbytes
+        if not 0 <= index < self.nbytes:
+            raise IndexError("byte index out of range")
+        data = self.pages.get(index // self.page_bytes)
+        if data is None:
+            if not value:
+                return
+            data = self.pages[index // self.page_bytes] = bytearray(self._page_length(index // self.page_bytes))
+        data[index % self.page_bytes] = value
+
+
+class SparseBitArray(BitArray):
+    # a BitArray whose pages of page_size bits are materialized on the first non zero write,
+    # so memory scales with what was touched instead of with size. pages are a multiple of 64
+    # bits: whole bytes, and whole words for the parity / hamming check bits
+    def __init__(self, size, page_size=64):
+        if page_size <= 0 or page_size % 64:
+            raise Exception("sparse pages must be a multiple of 64 bits.")
+        super().__init__(size, _SparseBuffer((size + 7) // 8, page_size // 8))
+        self.page_size = page_size
+
+    def materialized(self, position=0, length=None):
+        # sorted numbers of the materialized pages overlapping a range
+        if length is None:
+            length = self.size - position
+        first, last = position // self.page_size, (position + length - 1) // self.page_size
+        return sorted(page for page in self.buffer.pages if first <= page <= last)
+
+    def segments(self, position=0, length=None):
+        # (start, length, materialized) pieces of a range, neighbouring pages joined
+        if length is None:
+            length = self.size - position
+        end = position + length
+        cursor = position
+        pending = None
+        for page in self.materialized(position, length):
+            start = max(page * self.page_size, position)
+            stop = min((page + 1) * self.page_size, end)
+            if pending and pending[1] == start:
+                pending[1] = stop
+                continue
+            if pending:
+                yield pending[0], pending[1] - pending[0], True
+                cursor = pending[1]
+            if start > cursor:
+                yield cursor, start - cursor, False
+            pending = [start, stop]
+        if pending:
+            yield pending[0], pending[1] - pending[0], True
+            cursor = pending[1]
+        if end > cursor:
+            yield cursor, end - cursor, False
+
+    def count(self, position=0, length=None):
+        if length is None:
+            length = self.size - position
+        return sum(super(SparseBitArray, self).count(start, span)
+                   for start, span, materialized in self.segments(position, length) if materialized)
+
+    def fill(self, position, length, value):
+        # page by page, clearing only touches the materialized pages
+        for start, span, materialized in self.segments(position, length):
+            if not materialized and not value:
+                continue
+            offset = start
+            while offset < start + span:
+                chunk = min(self.page_size - offset % self.page_size, start + span - offset)
+                self.set_int(offset, chunk, (1 << chunk) - 1 if value else 0)
+                offset += chunk
+
+    def runs(self, value, position=0, length=None):
+        # unmaterialized stretches are one run of zeros, runs continue across pieces
+        pending = None
+        for start, span, materialized in self.segments(position, length):
+            if materialized:
+                found = super().runs(value, start, span)
+            else:
+                found = [(start, span)] if not value else []
+            for run_start, run_length in found:
+                if pending and pending[0] + pending[1] == run_start:
+                    pending[1] += run_length
+                    continue
+                if pending:
+                    yield tuple(pending)
+                pending = [run_start, run_length]
+        if pending:
+            yield tuple(pending)
+
+    def tobytes(self):
+        return self.buffer[0:len(self.buffer)]
+
+    def copy(self):
+        plane = SparseBitArray(self.size, self.page_size)
+        plane.buffer.pages = {page: bytearray(data) for page, data in self.buffer.pages.items()}
+        return plane
+
+    def rotate_left(self, shift):
+        # pages move to their new place, bits of a page that lands across a page boundary
+        # (shift not a multiple of page_size) are split over the two
+        shift %= self.size or 1
+        if not shift:
+            return
+        rotated = SparseBitArray(self.size, self.page_size)
+        for page in self.materialized():
+            start = page * self.page_size
+            length = min(self.page_size, self.size - start)
+            value = self.get_int(start, length)
+            for target, span in _wrap((start - shift) % self.size, length, self.size):
+                length -= span
+                rotated.set_int(target, span, value >> length)
+        self.buffer = rotated.buffer
+
+    def set_page_size(self, page_size):
+        # regroup the materialized bytes in pages of another size
+        regrouped = SparseBitArray(self.size, page_size)
+        for page, data in self.buffer.pages.items():
+            start = page * self.buffer.page_bytes
+            regrouped.buffer[start:start + len(data)] = data
+        self.buffer = regrouped.buffer
+        self.page_size = page_size
+
+    def gather(self, pages):
+        # dense copy of the given pages back to back (only the last page of a plane is short)
+        data = b"".join(bytes(self.buffer.pages.get(page) or self.buffer._page_length(page)) for page in pages)
+        size = sum(min(self.page_size, self.size - page * self.page_size) for page in pages)
+        return BitArray(size, bytearray(data))
+
+    def scatter(self, pages, dense):
+        # write a gather()ed copy back
+        offset = 0
+        for page in pages:
+            nbytes = self.buffer._page_length(page)
+            start = page * self.buffer.page_bytes
+            self.buffer[start:start + nbytes] = dense.buffer[offset:offset + nbytes]
+            offset += nbytes
+
+
+class PackedStorage:
+    # default storage backend, every bit plane is a packed bytearray
+    # other backends only need to provide plane(name, size) returning a BitArray like object
+    def plane(self, name, size):
+        return BitArray(size)
+
+
+class SparseStorage:
+    # storage backend for huge, mostly untouched address spaces (Ram(size, sparse=True)):
+    # every plane is a SparseBitArray with pages of page_size bits, the ram's page_size
+    def __init__(self, page_size=64):
+        self.page_size = page_size
+
+    def plane(self, name, size):
+        return SparseBitArray(size, self.page_size)
+
+
+_SHARED_MAGIC = b"RAMEMUSH"
+_SHARED_HEADER = struct.Struct("<8sQQQQ")  # magic, generation, metadata length, metadata capacity, table length
+_SHARED_TABLE = 4096  # header + json plane table (name -> [offset, size]), the metadata follows
+_SHARED_META_LOCK = 64  # lock byte of the metadata, the stripe locks are the bytes before it
+
+
+class SharedStorage:
+    # storage backend whose planes live in one memory mapped file, so processes can share a ram
+    # (Ram.attach(name) in the other processes). the file goes to /dev/shm when there is one,
+    # which is what multiprocessing.shared_memory uses too, so nothing touches a disk
+    # layout: header and plane table, ram metadata (json, meta_bytes), then every plane page aligned
+    # the locks are fcntl record locks on the header bytes (see _FileLock)
+    shared = True
+
+    def __init__(self, name=None, create=True, meta_bytes=1 << 20, directory=None):
+        if fcntl is None:
+            raise Exception("shared storage needs fcntl, not available on this platform.")
+        if directory is None:
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        if name is None:
+            name = "ramemu_" + os.urandom(8).hex()
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self.create = create
+        self.locks = {}
+        self.maps = []
+        self.fd = os.open(self.path, os.O_RDWR | (os.O_CREAT | os.O_EXCL if create else 0), 0o600)
+        if create:
+            self.end = _SHARED_TABLE + -(-meta_bytes // mmap.ALLOCATIONGRANULARITY) * mmap.ALLOCATIONGRANULARITY
+            os.ftruncate(self.fd, self.end)
+            self.header = mmap.mmap(self.fd, self.end)
+            _SHARED_HEADER.pack_into(self.header, 0, _SHARED_MAGIC, 0, 0, self.end - _SHARED_TABLE, 0)
+            self.table = {}
+        else:
+            with open(self.path, "rb") as file:
+                magic, _, _, capacity, _ = _SHARED_HEADER.unpack(file.read(_SHARED_HEADER.size))
+            if magic != _SHARED_MAGIC:
+                os.close(self.fd)
+                raise Exception("not a shared ram.")
+            self.end = _SHARED_TABLE + capacity
+            self.header = mmap.mmap(self.fd, self.end)
+            with self.lock(_SHARED_META_LOCK):
+                length = _SHARED_HEADER.unpack_from(self.header)[4]
+                self.table = json.loads(self.header[_SHARED_HEADER.size:_SHARED_HEADER.size + length])
+
+    def plane(self, name, size):
+        # a new plane when creating, the existing one when attaching (or loading a snapshot)
+        nbytes = (size + 7) // 8
+        if name in self.table:
+            offset, plane_size = self.table[name]
+            if plane_size != size:
+                raise Exception("shared plane {!r} has {} bits, not {}.".format(name, plane_size, size))
+        elif not self.create:
+            raise Exception("shared ram has no plane {!r}.".format(name))
+        else:
+            offset = self.end
+            self.end += -(-max(nbytes, 1) // mmap.ALLOCATIONGRANULARITY) * mmap.ALLOCATIONGRANULARITY
+            os.ftruncate(self.fd, self.end)
+            self.table[name] = [offset, size]
+            table = json.dumps(self.table).encode()
+            if _SHARED_HEADER.size + len(table) > _SHARED_TABLE:
+                raise Exception("shared plane table is full.")
+            with self.lock(_SHARED_META_LOCK):
+                self.header[_SHARED_HEADER.size:_SHARED_HEADER.size + len(table)] = table
+                struct.pack_into("<Q", self.header, 32, len(table))
+        if nbytes == 0:
+            return BitArray(size)
+        mapped = mmap.mmap(self.fd, nbytes, offset=offset)
+        self.maps.append(mapped)
+        return BitArray(size, mapped)
+
+    def lock(self, index):
+        # one _FileLock per lock byte, shared by everything in this process using the storage
+        if index not in self.locks:
+            self.locks[index] = _FileLock(self.fd, index)
+        return self.locks[index]
+
+    def generation(self):
+        # bumped by every write_metadata, cheap enough to check on each access
+        return struct.unpack_from("<Q", self.header, 8)[0]
+
+    def read_metadata(self):
+        # (generation, json bytes), hold lock(_SHARED_META_LOCK) around it
+        _, generation, length, _, _ = _SHARED_HEADER.unpack_from(self.header)
+        return generation, self.header[_SHARED_TABLE:_SHARED_TABLE + length]
+
+    def write_metadata(self, data):
+        # returns the new generation, hold lock(_SHARED_META_LOCK) around it
+        if _SHARED_TABLE + len(data) > len(self.header):
+            raise Exception("shared metadata is full (meta_bytes).")
+        self.header[_SHARED_TABLE:_SHARED_TABLE + len(data)] = data
+        generation = self.generation() + 1
+        struct.pack_into("<QQ", self.header, 8, generation, len(data))
+        return generation
+
+    def metadata(self):
+        with self.lock(_SHARED_META_LOCK):
+            return json.loads(self.read_metadata()[1])
+
+    def close(self):
+        # unmap and close the file, the planes of rams using it can't be used afterwards
+        for mapped in self.maps:
+            mapped.close()
+        self.header.close()
+        os.close(self.fd)
+
+    def unlink(self):
+        # remove the shared file, rams that are still attached keep working until they close
+        os.unlink(self.path)
+
+
+class WordCode:
+    # check bits over 64 bit data words, for the parity and hamming redundancy modes
+    # word w is bits [64w, 64w + 64) of the memory plane read as an int (msb first, the last
+    # word zero padded), its check value is the xor of codes[i] over its set bits i (bit 0 = lsb),
+    # computed a byte lane at a time with one 256 entry table per lane
+    def __init__(self, name, width, codes):
+        self.name = name
+        self.width = width  # check bits stored per word
+        self.tables = []
+        for lane in range(8):
+            # lane 0 is the most significant byte of the word
+            lane_codes = codes[8 * (7 - lane):8 * (8 - lane)]
+            table = bytearray(256)
+            for value in range(1, 256):
+                low = value & -value
+                table[value] = table[value ^ low] ^ lane_codes[low.bit_length() - 1]
+            self.tables.append(bytes(table))
+        # syndrome -> data bit, only for codes that can locate a flipped bit
+        self.syndromes = {code & 0x7F: bit for bit, code in enumerate(codes)} if width > 1 else {}
+
+    def encode(self, word):
+        value = 0
+        for lane, byte in enumerate(word.to_bytes(8, "big")):
+            value ^= self.tables[lane][byte]
+        return value
+
+    def repair(self, word, check):
+        # (word, check, data bits fixed) with a single flipped bit corrected, None when the
+        # damage can only be detected (any error under parity, two flipped bits under hamming)
+        expected = self.encode(word)
+        if expected == check:
+            return word, check, 0
+        if not self.syndromes:
+            return None
+        if (bin(word).count("1") + bin(check).count("1")) % 2 == 0:
+            # the overall parity still holds, so an even number of bits flipped
+            return None
+        syndrome = (expected ^ check) & 0x7F
+        if syndrome in self.syndromes:
+            return word ^ (1 << self.syndromes[syndrome]), check, 1
+        if syndrome & (syndrome - 1) == 0:
+            # one of the check bits itself (syndrome 0: the overall parity bit)
+            return word, expected, 0
+        return None
+
+
+def _hamming_codes():
+    # secded (72, 64): every data bit gets a distinct 7 bit syndrome that is not a power of two
+    # (powers of two are the check bits), bit 7 is the overall parity over data and check bits
+    syndromes = [value for value in range(3, 128) if value & (value - 1)][:64]
+    return [syndrome | ((1 + bin(syndrome).count("1")) % 2) << 7 for syndrome in syndromes]
+
+
+# planes kept by each redundancy mode (besides is_used) and the word codes behind them
+_REDUNDANCY_PLANES = {
+    "none": ("memory",),
+    "tmr": ("memory", "memory_clone_a", "memory_clone_b"),
+    "parity": ("memory", "check_bits"),
+    "hamming": ("memory", "check_bits"),
+}
+_WORD_CODES = {
+    "parity": WordCode("parity", 1, [1] * 64),
+    "hamming": WordCode("hamming", 8, _hamming_codes()),
+}
+
+
+def _check_plane_size(size, redundancy):
+    return -(-size // 64) * _WORD_CODES[redundancy].width
+
+
+class PythonEngine:
+    # whole memory operations done on each plane as one big python int
+    # (bit 0 of the plane is the msb), so every loop runs inside the int implementation
+    name = "python"
+
+    def _load(self, plane):
+        return int.from_bytes(plane.buffer, "big")
+
+    def _store(self, plane, value):
+        plane.buffer[:] = value.to_bytes(len(plane.buffer), "big")
+
+    def _valid(self, plane):
+        # mask of the real bits, without the padding at the end of the last byte
+        padding = len(plane.buffer) * 8 - plane.size
+        return ((1 << plane.size) - 1) << padding
+
+    def randomize(self, planes, mask_plane, rng, invert=False):
+        # replace the bits selected by mask_plane (all bits if None) with random ones,
+        # the same random bits go to every plane
+        valid = self._valid(planes[0])
+        if mask_plane is None:
+            mask = valid
+        elif invert:
+            mask = ~self._load(mask_plane) & valid
+        else:
+            mask = self._load(mask_plane) & valid
+        bits = rng.getrandbits(len(planes[0].buffer) * 8) & mask
+        for plane in planes:
+            self._store(plane, (self._load(plane) & ~mask) | bits)
+
+    def flip(self, planes, mask_plane):
+        # invert the bits selected by mask_plane
+        mask = self._load(mask_plane) & self._valid(mask_plane)
+        for plane in planes:
+            self._store(plane, self._load(plane) ^ mask)
+
+    def majority(self, memory, clone_a, clone_b):
+        # bitwise majority vote of the three copies into memory, returns how many bits changed
+        m, a, b = self._load(memory), self._load(clone_a), self._load(clone_b)
+        vote = (m & a) | (m & b) | (a & b)
+        self._store(memory, vote)
+        return bin(m ^ vote).count("1")
+
+    def differences(self, memory, clone_a, clone_b):
+        # positions where memory disagrees with either clone
+        m = self._load(memory)
+        diff = ((m ^ self._load(clone_a)) | (m ^ self._load(clone_b))) & self._valid(memory)
+        if not diff:
+            return []
+        text = format(diff, "0{}b".format(len(memory.buffer) * 8))
+        return [match.start() for match in re.finditer("1", text)]
+
+    def encode(self, plane, tables):
+        # one check value per 64 bit word as bytes: each byte lane is run through its table
+        # with translate and the lanes are xored together as big ints
+        words = -(-plane.size // 64)
+        data = bytes(plane.buffer).ljust(words * 8, b"\0")
+        value = 0
+        for lane, table in enumerate(tables):
+            value ^= int.from_bytes(data[lane::8].translate(table), "big")
+        return value.to_bytes(words, "big")
+
+    def mismatches(self, codes, stored):
+        # indexes where two equally long byte strings differ
+        diff = (int.from_bytes(codes, "big") ^ int.from_bytes(stored, "big")).to_bytes(len(codes), "big")
+        return [match.start() for match in re.finditer(b"[^\0]", diff)]
+
+
+class NumpyEngine:
+    # same operations on numpy uint8 views of the packed planes (no copies of the planes)
+    name = "numpy"
+
+    def _view(self, plane):
+        return numpy.frombuffer(plane.buffer, dtype=numpy.uint8)
+
+    def _valid(self, plane):
+        valid = numpy.full(len(plane.buffer), 0xFF, dtype=numpy.uint8)
+        if plane.size % 8:
+            valid[-1] = (0xFF << (8 - plane.size % 8)) & 0xFF
+        return valid
+
+    def randomize(self, planes, mask_plane, rng, invert=False):
+        valid = self._valid(planes[0])
+        if mask_plane is None:
+            mask = valid
+        elif invert:
+            mask = ~self._view(mask_plane) & valid
+        else:
+            mask = self._view(mask_plane) & valid
+        # the generator is seeded from the ram's own rng so seeded runs stay reproducible
+        generator = numpy.random.default_rng(rng.getrandbits(64))
+        bits = generator.integers(0, 256, len(valid), dtype=numpy.uint8) & mask
+        keep = ~mask
+        for plane in planes:
+            view = self._view(plane)
+            view &= keep
+            view |= bits
+
+    def flip(self, planes, mask_plane):
+        mask = self._view(mask_plane) & self._valid(mask_plane)
+        for plane in planes:
+            self._view(plane)[:] ^= mask
+
+    def majority(self, memory, clone_a, clone_b):
+        m, a, b = self._view(memory), self._view(clone_a), self._view(clone_b)
+        vote = (m & a) | (m & b) | (a & b)
+        changed = int(numpy.unpackbits(m ^ vote).sum())
+        m[:] = vote
+        return changed
+
+    def differences(self, memory, clone_a, clone_b):
+        m = self._view(memory)
+        diff = (m ^ self._view(clone_a)) | (m ^ self._view(clone_b))
+        return numpy.flatnonzero(numpy.unpackbits(diff)[:memory.size]).tolist()
+
+    def encode(self, plane, tables):
+        words = -(-plane.size // 64)
+        data = numpy.zeros(words * 8, dtype=numpy.uint8)
+        data[:len(plane.buffer)] = self._view(plane)
+        lanes = data.reshape(words, 8)
+        codes = numpy.zeros(words, dtype=numpy.uint8)
+        for lane, table in enumerate(tables):
+            codes ^= numpy.frombuffer(table, dtype=numpy.uint8)[lanes[:, lane]]
+        return codes.tobytes()
+
+    def mismatches(self, codes, stored):
+        a = numpy.frombuffer(codes, dtype=numpy.uint8)
+        b = numpy.frombuffer(stored, dtype=numpy.uint8)
+        return numpy.flatnonzero(a != b).tolist()
+
+
+# engine used by new rams unless one is passed explicitly
+default_engine = NumpyEngine() if numpy is not None else PythonEngine()
+
+
+class Allocator:
+    # keeps the free space of a ram as sorted, non-overlapping [start, end) extents
+    # starts is sorted by address (first fit), sizes is sorted by (length, start) (best fit)
+    # so a lookup is a bisect instead of a scan over every bit
+    # the extents are physical, base is the rotation offset of the ram (see Ram.rotate_right):
+    # every method takes and returns logical positions, at no cost while base is 0
+    def __init__(self, size):
+        self.size = size
+        self.base = 0
+        self.starts = []
+        self.ends = {}
+        self.sizes = []
+        self.free_bits = 0
+        if size > 0:
+            self._add(0, size)
+
+    def _add(self, start, end):
+        insort(self.starts, start)
+        self.ends[start] = end
+        insort(self.sizes, (end - start, start))
+        self.free_bits += end - start
+
+    def _remove(self, index):
+        start = self.starts.pop(index)
+        end = self.ends.pop(start)
+        del self.sizes[bisect_left(self.sizes, (end - start, start))]
+        self.free_bits -= end - start
+        return start, end
+
+    def reserve(self, position, length):
+        # mark [position, position + length) as used, splitting the extents it cuts
+        if length <= 0:
+            return
+        for start, span in _spans(position, length, self.base, self.size):
+            self._reserve(start, span)
+
+    def _reserve(self, position, length):
+        end = position + length
+        index = bisect_right(self.starts, position) - 1
+        if index < 0 or self.ends[self.starts[index]] <= position:
+            index += 1
+        while index < len(self.starts) and self.starts[index] < end:
+            start, stop = self._remove(index)
+            if start < position:
+                self._add(start, position)
+                index += 1
+            if stop > end:
+                self._add(end, stop)
+                break
+
+    def release(self, position, length):
+        # mark [position, position + length) as free, coalescing with its neighbours
+        if length <= 0:
+            return
+        for start, span in _spans(position, length, self.base, self.size):
+            self._release(start, span)
+
+    def _release(self, position, length):
+        start, end = position, position + length
+        index = bisect_right(self.starts, start) - 1
+        if index >= 0 and self.ends[self.starts[index]] >= start:
+            start, stop = self._remove(index)
+            end = max(end, stop)
+        else:
+            index += 1
+        while index < len(self.starts) and self.starts[index] <= end:
+            _, stop = self._remove(index)
+            end = max(end, stop)
+        self._add(start, end)
+
+    def first_fit(self, size, alignment=1):
+        # lowest aligned position with size free bits, None if there is none
+        if size <= 0:
+            return 0
+        if self.base:
+            return self.logical().first_fit(size, alignment)
+        for start in self.starts:
+            aligned = -(-start // alignment) * alignment
+            if aligned + size <= self.ends[start]:
+                return aligned
+        return None
+
+    def best_fit(self, size, alignment=1):
+        # aligned position inside the smallest extent that can hold size bits
+        if size <= 0:
+            return 0
+        if self.base:
+            return self.logical().best_fit(size, alignment)
+        for index in range(bisect_left(self.sizes, (size, -1)), len(self.sizes)):
+            length, start = self.sizes[index]
+            aligned = -(-start // alignment) * alignment
+            if aligned + size <= start + length:
+                return aligned
+        return None
+
+    def random_fit(self, size, rng, alignment=1):
+        # aligned position picked uniformly among every position where size bits fit
+        # only extents that can hold the request are considered, so this never retries
+        if size <= 0:
+            return 0
+        if self.base:
+            return self.logical().random_fit(size, rng, alignment)
+        candidates = []
+        total = 0
+        for index in range(bisect_left(self.sizes, (size, -1)), len(self.sizes)):
+            length, start = self.sizes[index]
+            first = -(-start // alignment) * alignment
+            last = start + length - size
+            if first <= last:
+                count = (last - first) // alignment + 1
+                candidates.append((total, first))
+                total += count
+        if total == 0:
+            return None
+        pick = rng.randrange(total)
+        offset, first = candidates[bisect_right(candidates, (pick, float("inf"))) - 1]
+        return first + (pick - offset) * alignment
+
+    def largest(self):
+        # length of the biggest free extent
+        if self.base:
+            return self.logical().largest()
+        return self.sizes[-1][0] if self.sizes else 0
+
+    def is_compact(self):
+        # true when all the free space is one extent at the end (or there is none)
+        if self.base:
+            return self.logical().is_compact()
+        return not self.starts or (len(self.starts) == 1 and self.ends[self.starts[0]] == self.size)
+
+    def extents(self):
+        # free extents as (start, length) in address order
+        if not self.base:
+            return self.physical_extents()
+        # while rotated, the extent holding logical 0 is cut in two and the extents
+        # touching both physical ends are one logical extent
+        pieces = []
+        for start, length in self.physical_extents():
+            logical = (start - self.base) % self.size
+            if logical + length > self.size:
+                pieces.append((logical, self.size - logical))
+                pieces.append((0, logical + length - self.size))
+            else:
+                pieces.append((logical, length))
+        pieces.sort()
+        merged = []
+        for start, length in pieces:
+            if merged and merged[-1][0] + merged[-1][1] == start:
+                merged[-1] = (merged[-1][0], merged[-1][1] + length)
+            else:
+                merged.append((start, length))
+        return merged
+
+    def physical_extents(self):
+        return [(start, self.ends[start] - start) for start in self.starts]
+
+    def logical(self):
+        # an unrotated allocator over the logical free extents, for the searches while rotated
+        # (a linear pass, materialize() on the ram brings back the bisect lookups)
+        if not self.base:
+            return self
+        view = Allocator(self.size)
+        view.set_extents(self.extents())
+        return view
+
+    def set_extents(self, extents):
+        # replace the free space with physical (start, length) extents given in address order
+        self.starts = []
+        self.ends = {}
+        self.sizes = []
+        self.free_bits = 0
+        for start, length in extents:
+            self.starts.append(start)
+            self.ends[start] = start + length
+            self.sizes.append((length, start))
+            self.free_bits += length
+        self.sizes.sort()
+
+
+class PermissionMap:
+    # permissions as sorted, non-overlapping regions, like an mmu region table
+    # region i covers [starts[i], starts[i + 1]) with flags[i] = (read, write)
+    # neighbouring regions never share flags, so the table stays as small as possible
+    # like the allocator the regions are physical and base is the ram's rotation offset,
+    # positions going in and out are logical
+    def __init__(self, size):
+        self.size = size
+        self.base = 0
+        self.starts = [0]
+        self.flags = [(True, True)]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, position):
+        # per bit access like the old list of (read, write) tuples
+        return self.at(position)
+
+    def at(self, position):
+        if self.base:
+            position = (position + self.base) % self.size
+        return self.flags[bisect_right(self.starts, position) - 1]
+
+    def _logical(self, position):
+        return (position - self.base) % self.size if self.base else position
+
+    def _split(self, position):
+        # make sure a region starts exactly at position, returns its index
+        index = bisect_right(self.starts, position) - 1
+        if self.starts[index] != position:
+            index += 1
+            self.starts.insert(index, position)
+            self.flags.insert(index, self.flags[index - 1])
+        return index
+
+    def set(self, position, length, read=True, write=True):
+        if length <= 0:
+            return
+        for start, span in _spans(position, length, self.base, self.size):
+            self._set(start, span, (read, write))
+
+    def _set(self, position, length, flags):
+        end = position + length
+        first = self._split(position)
+        last = self._split(end) if end < self.size else len(self.starts)
+        del self.starts[first + 1:last]
+        del self.flags[first + 1:last]
+        self.flags[first] = flags
+        # merge with equal neighbours
+        if first + 1 < len(self.starts) and self.flags[first + 1] == flags:
+            del self.starts[first + 1]
+            del self.flags[first + 1]
+        if first > 0 and self.flags[first - 1] == flags:
+            del self.starts[first]
+            del self.flags[first]
+
+    def check(self, position, length, for_write=False):
+        # one bisect, then only the regions overlapping the range are looked at
+        if length <= 0:
+            return
+        for start, span in _spans(position, length, self.base, self.size):
+            self._check(start, span, for_write)
+
+    def _check(self, position, length, for_write):
+        end = position + length
+        starts, flags = self.starts, self.flags
+        allowed = 1 if for_write else 0
+        index = bisect_right(starts, position) - 1
+        while index < len(starts) and starts[index] < end:
+            if not flags[index][allowed]:
+                denied = self._logical(max(starts[index], position))
+                raise Exception("{} permission denied at position {}".format(
+                    "write" if for_write else "read", denied))
+            index += 1
+
+    def regions(self, position=0, length=None):
+        # yields (start, length, read, write) for every region overlapping a range
+        if length is None:
+            length = self.size - position
+        if length <= 0:
+            return
+        # pieces of the two physical spans are joined again where the flags continue
+        pending = None
+        for start, span in _spans(position, length, self.base, self.size):
+            for region_start, region_length, read, write in self._regions(start, span):
+                region_start = self._logical(region_start)
+                if pending and pending[0] + pending[1] == region_start and pending[2:] == [read, write]:
+                    pending[1] += region_length
+                    continue
+                if pending:
+                    yield tuple(pending)
+                pending = [region_start, region_length, read, write]
+        if pending:
+            yield tuple(pending)
+
+    def copy(self):
+        permissions = PermissionMap(self.size)
+        permissions.base = self.base
+        permissions.starts = list(self.starts)
+        permissions.flags = list(self.flags)
+        return permissions
+
+    def physical_regions(self):
+        return self._regions(0, self.size)
+
+    def _regions(self, position, length):
+        end = position + length
+        index = max(bisect_right(self.starts, position) - 1, 0)
+        while index < len(self.starts) and self.starts[index] < end:
+            start = max(self.starts[index], position)
+            stop = self.starts[index + 1] if index + 1 < len(self.starts) else self.size
+            read, write = self.flags[index]
+            yield start, min(stop, end) - start, read, write
+            index += 1
+
+
+class PageFlags:
+    # the paging flags (mark_page_used / mark_page_free) as the set of used page numbers,
+    # behaves like the list of booleans it replaces without a slot for every page
+    def __init__(self, count):
+        self.count = count
+        self.used = set()
+
+    def __len__(self):
+        return self.count
+
+    def _page(self, page):
+        if page < 0:
+            page += self.count
+        if not 0 <= page < self.count:
+            raise IndexError("page index out of range")
+        return page
+
+    def __getitem__(self, page):
+        return self._page(page) in self.used
+
+    def __setitem__(self, page, value):
+        if value:
+            self.used.add(self._page(page))
+        else:
+            self.used.discard(self._page(page))
+
+    def __iter__(self):
+        return (page in self.used for page in range(self.count))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def runs(self):
+        # [[flag, count], ...] run length encoding, for the snapshot metadata
+        runs = []
+        position = 0
+        for page in sorted(self.used):
+            if runs and runs[-1][0] and position == page:
+                runs[-1][1] += 1
+            else:
+                if page > position:
+                    runs.append([False, page - position])
+                runs.append([True, 1])
+            position = page + 1
+        if position < self.count:
+            runs.append([False, self.count - position])
+        return runs
+
+    @classmethod
+    def from_runs(cls, runs):
+        flags = cls(sum(count for _, count in runs))
+        position = 0
+        for flag, count in runs:
+            if flag:
+                flags.used.update(range(position, position + count))
+            position += count
+        return flags
+
+
+class VariableTable(MutableMapping):
+    # name -> (position, size) like the plain dict it replaces, but the positions are stored
+    # physical so rotating the ram (which only moves base) never has to rewrite the entries
+    def __init__(self, size):
+        self.size = size
+        self.base = 0
+        self.physical = {}
+
+    def __getitem__(self, name):
+        position, size = self.physical[name]
+        if self.base:
+            position = (position - self.base) % self.size
+        return position, size
+
+    def __setitem__(self, name, place):
+        position, size = place
+        if self.base:
+            position = (position + self.base) % self.size
+        self.physical[name] = (position, size)
+
+    def __delitem__(self, name):
+        del self.physical[name]
+
+    def __iter__(self):
+        return iter(self.physical)
+
+    def __len__(self):
+        return len(self.physical)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class ArrayView:
+    # ram.array(name): the elements of an array variable, elem_bits each and back to back, so
+    # element i is at the array's position + i * elem_bits. a slice is a single read or write of
+    # its whole range (one permission check, one pass over the planes) and its elements are
+    # decoded / encoded in one go. the position is looked up once per access, so a view stays
+    # good when the array is moved (defragment, rotation)
+    def __init__(self, ram, name):
+        meta = ram.variable_metadata[name]
+        if meta["type"] != "array":
+            raise Exception("variable {!r} is not an array.".format(name))
+        self.ram = ram
+        self.name = name
+        self.bits = meta["elem_bits"]
+        self.count = meta["count"]
+        self.signed = meta["signed"]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __repr__(self):
+        return "ArrayView({!r}, {})".format(self.name, self[:])
+
+    def _position(self, offset):
+        # ram address of a bit of the array (rotated across the end of the ram it continues at 0,
+        # so the ranges read and written from here go through ram._read_ring / _write_ring)
+        return (self.ram.variables[self.name][0] + offset) % self.ram.size
+
+    def _index(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("array index out of range")
+        return index
+
+    def _read(self, first, count):
+        # count elements from element first, decoded
+        ram = self.ram
+        with ram._variable_guard(self.name):
+            value = ram._read_ring(self._position(first * self.bits), count * self.bits)
+        return _unpack(value, self.bits, count, self.signed)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indexes = range(*index.indices(self.count))
+            if not indexes:
+                return []
+            if indexes.step == 1:
+                return self._read(indexes.start, len(indexes))
+            # a stepped slice reads the range it spans once and picks from it
+            first = min(indexes[0], indexes[-1])
+            values = self._read(first, abs(indexes[-1] - indexes[0]) + 1)
+            return [values[i - first] for i in indexes]
+        ram = self.ram
+        with ram._variable_guard(self.name):
+            value = ram._read_ring(self._position(self._index(index) * self.bits), self.bits)
+        return _to_signed(value, self.bits) if self.signed else value
+
+    def __setitem__(self, index, values):
+        ram = self.ram
+        if not isinstance(index, slice):
+            with ram._variable_guard(self.name):
+                ram._write_ring(self._position(self._index(index) * self.bits), self.bits, int(values))
+            return
+        indexes = range(*index.indices(self.count))
+        # a single int fills the slice, numpy arrays are taken too
+        if isinstance(values, int):
+            values = [values] * len(indexes)
+        else:
+            values = values.tolist() if hasattr(values, "tolist") else list(values)
+        if len(values) != len(indexes):
+            raise Exception("array slice assignment can't change the size of the array.")
+        if not indexes:
+            return
+        if indexes.step == 1:
+            with ram._variable_guard(self.name):
+                ram._write_ring(self._position(indexes.start * self.bits), len(values) * self.bits,
+                                _pack(values, self.bits))
+            return
+        # a stepped slice is a transaction of element writes: atomic, applied in merged ranges
+        with ram.transaction():
+            for i, value in zip(indexes, values):
+                self[i] = value
+
+    def tolist(self):
+        return self[:]
+
+
+class StructView:
+    # ram.struct(name): the fields of a struct variable, back to back in the order they were
+    # declared. view["field"] reads or writes one field, read() and write() do several in one
+    # pass over the whole struct
+    def __init__(self, ram, name):
+        meta = ram.variable_metadata[name]
+        if meta["type"] != "struct":
+            raise Exception("variable {!r} is not a struct.".format(name))
+        self.ram = ram
+        self.name = name
+        self.fields = {}  # field -> (offset, bits, signed)
+        offset = 0
+        for field, bits, signed in meta["fields"]:
+            self.fields[field] = (offset, bits, signed)
+            offset += bits
+        self.size = offset
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def keys(self):
+        return self.fields.keys()
+
+    def __repr__(self):
+        return "StructView({!r}, {})".format(self.name, self.read())
+
+    def _position(self, offset):
+        return (self.ram.variables[self.name][0] + offset) % self.ram.size
+
+    def _field(self, field):
+        if field not in self.fields:
+            raise Exception("struct {!r} has no field {!r}.".format(self.name, field))
+        return self.fields[field]
+
+    def __getitem__(self, field):
+        offset, bits, signed = self._field(field)
+        ram = self.ram
+        with ram._variable_guard(self.name):
+            value = ram._read_ring(self._position(offset), bits)
+        return _to_signed(value, bits) if signed else value
+
+    def __setitem__(self, field, value):
+        offset, bits, _ = self._field(field)
+        ram = self.ram
+        with ram._variable_guard(self.name):
+            ram._write_ring(self._position(offset), bits, value)
+
+    def read(self):
+        # every field as a dict, from one read of the struct
+        ram = self.ram
+        with ram._variable_guard(self.name):
+            value = ram._read_ring(ram.variables[self.name][0], self.size)
+        fields = {}
+        for field, (offset, bits, signed) in self.fields.items():
+            field_value = (value >> (self.size - offset - bits)) & ((1 << bits) - 1)
+            fields[field] = _to_signed(field_value, bits) if signed else field_value
+        return fields
+
+    def write(self, values=None, **fields):
+        # set several fields (a dict and / or keywords) with one write of the struct,
+        # the fields not given keep their value
+        fields = dict(values or {}, **fields)
+        for field in fields:
+            self._field(field)
+        ram = self.ram
+        with ram._variable_guard(self.name):
+            position = ram.variables[self.name][0]
+            value = 0 if len(fields) == len(self.fields) else ram._read_ring(position, self.size)
+            for field, field_value in fields.items():
+                offset, bits, _ = self.fields[field]
+                shift = self.size - offset - bits
+                mask = ((1 << bits) - 1) << shift
+                value = (value & ~mask) | ((field_value << shift) & mask)
+            ram._write_ring(position, self.size, value)
+
+
+_LOCK_GRANULE = 512  # bits per lock page: whole bytes of every plane, including parity bits
+_LOCK_STRIPES = 64  # lock pages share this many locks round robin
+_NO_LOCK = nullcontext()
+
+
+class _Locks:
+    # holds a sorted list of locks for the length of a with block
+    def __init__(self, locks):
+        self.locks = locks
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
+class _FileLock:
+    # reentrant lock that also works between processes: an fcntl record lock on one byte of a
+    # shared file. record locks belong to the whole process, so a thread lock keeps the threads
+    # apart and only a thread's outermost acquire touches the file
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.offset = offset
+        self.lock = threading.RLock()
+        self.depth = 0
+
+    def acquire(self):
+        self.lock.acquire()
+        self.depth += 1
+        if self.depth == 1:
+            try:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.offset)
+            except BaseException:
+                self.depth -= 1
+                self.lock.release()
+                raise
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.offset)
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class _SharedMeta:
+    # metadata lock of a ram on SharedStorage: the outermost acquire pulls what other processes
+    # published (allocator, permissions, variables, base...), the outermost release publishes
+    # the changes made while holding it
+    def __init__(self, ram, lock):
+        self.ram = ram
+        self.lock = lock
+
+    def acquire(self):
+        self.lock.acquire()
+        if self.lock.depth == 1:
+            try:
+                self.ram._pull()
+            except BaseException:
+                self.lock.release()
+                raise
+
+    def release(self):
+        try:
+            if self.lock.depth == 1:
+                self.ram._push()
+        finally:
+            self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class _RangeGuard(_Locks):
+    # the stripe locks of logical (position, length) ranges of a concurrent ram. the ranges are
+    # translated with the base at the time, so if a rotation got in while waiting the locks are
+    # taken again
+    def __init__(self, ram, ranges):
+        self.ram = ram
+        self.ranges = ranges
+
+    def __enter__(self):
+        ram = self.ram
+        while True:
+            base = ram.base
+            try:
+                self.locks = ram._stripe_locks([span for position, length in self.ranges
+                                                for span in _spans(position, length, base, ram.size)])
+            except IndexError:
+                # out of range: nothing to lock, the access itself reports the error
+                self.locks = []
+            super().__enter__()
+            ram._sync()
+            if ram.base == base:
+                return self
+            super().__exit__()
+
+
+class _VariableGuard(_Locks):
+    # the stripe locks of a variable of a concurrent ram. locks are taken on the physical range,
+    # which rotation never moves, and again if defragment / materialize moved it while waiting.
+    # get_variable and friends hold it too, so they never read a variable that is being moved
+    def __init__(self, ram, name):
+        self.ram = ram
+        self.name = name
+
+    def __enter__(self):
+        ram = self.ram
+        ram._sync()
+        while True:
+            place = ram.variables.physical[self.name]
+            self.locks = ram._stripe_locks(_wrap(place[0], place[1], ram.size))
+            super().__enter__()
+            ram._sync()
+            if ram.variables.physical.get(self.name) == place:
+                return self
+            super().__exit__()
+
+
+def _whole_memory(method):
+    # whole memory operations hold every lock of the ram (Ram._exclusive)
+    # they would miss the buffered writes of a transaction, so they can't run inside one
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        if self._transaction() is not None:
+            raise Exception("{} can't be used inside a transaction.".format(method.__name__))
+        with self._exclusive():
+            return method(self, *args, **kwargs)
+    return locked
+
+
+class _ThreadState(threading.local):
+    # per thread state of a ram: the transaction the thread has open on it
+    transaction = None
+
+
+class Transaction:
+    # with ram.transaction(): ... buffers the writes of the block (write, write_int, write_bytes,
+    # set, reverse and what is built on them: set_variable, ram[name] = ..., fetch_add, ...) and
+    # applies them when it ends: the buffered ranges are merged, permissions are checked once per
+    # merged range, then each range is written to every plane in one pass. if the block raises or
+    # a check fails nothing is written, and the allocations, new variables and permission changes
+    # made in it are undone. reads in the block see its writes, other threads only see them once
+    # it commits. a transaction belongs to the thread that opened it, nested blocks join it
+    def __init__(self, ram):
+        self.ram = ram
+        # buffered writes: sorted, non overlapping logical segments, starts[i] -> (length, value)
+        self.starts = []
+        self.segments = []
+        # sorted bits last written by set / reverse, which don't mark what they write used
+        self.unmarked = []
+        self.undo = []  # callables reverting the metadata changes, in the order they were made
+        self.depth = 0
+
+    def __enter__(self):
+        if self.depth == 0:
+            self.ram._local.transaction = self
+        self.depth += 1
+        return self
+
+    def __exit__(self, kind, error, trace):
+        self.depth -= 1
+        if self.depth == 0:
+            self.ram._local.transaction = None
+            if kind is None:
+                self.commit()
+            else:
+                self.rollback()
+        return False
+
+    def write(self, position, length, value, mark=True):
+        # buffer a write of an unsigned value, a range past the last bit is an IndexError like the ram's
+        if not _spans(position, length, 0, self.ram.size):
+            return
+        if not mark:
+            self._write_bit(position, value)
+            return
+        self._insert(position, length, value)
+        if self.unmarked:
+            del self.unmarked[bisect_left(self.unmarked, position):bisect_left(self.unmarked, position + length)]
+
+    def _write_bit(self, position, value):
+        # a bit written by set / reverse, which don't mark it used (as outside a transaction):
+        # it stays marked if a write before it in the transaction covered it
+        index = bisect_right(self.starts, position) - 1
+        if index < 0 or self.starts[index] + self.segments[index][0] <= position:
+            insort(self.unmarked, position)
+        self._insert(position, 1, value)
+
+    def _insert(self, start, length, value):
+        # the new segment replaces what it overlaps, keeping the parts sticking out on either side
+        end = start + length
+        first = bisect_right(self.starts, start) - 1
+        if first < 0 or self.starts[first] + self.segments[first][0] <= start:
+            first += 1
+        last = first
+        while last < len(self.starts) and self.starts[last] < end:
+            last += 1
+        if first < last:
+            head_start = self.starts[first]
+            head_length, head_value = self.segments[first]
+            if head_start < start:
+                keep = start - head_start
+                value |= (head_value >> (head_length - keep)) << length
+                length += keep
+                start = head_start
+            tail_length, tail_value = self.segments[last - 1]
+            keep = self.starts[last - 1] + tail_length - end
+            if keep > 0:
+                value = (value << keep) | (tail_value & ((1 << keep) - 1))
+                length += keep
+        self.starts[first:last] = [start]
+        self.segments[first:last] = [(length, value)]
+
+    def overlay(self, position, length, value):
+        # value of a range as read from the ram, with the buffered writes laid over it
+        offset = 0
+        for start, span in _spans(position, length, 0, self.ram.size):
+            end = start + span
+            index = max(bisect_right(self.starts, start) - 1, 0)
+            while index < len(self.starts) and self.starts[index] < end:
+                segment_length, segment_value = self.segments[index]
+                segment_end = self.starts[index] + segment_length
+                low, high = max(self.starts[index], start), min(segment_end, end)
+                if low < high:
+                    mask = (1 << (high - low)) - 1
+                    shift = length - offset - (high - start)
+                    bits = (segment_value >> (segment_end - high)) & mask
+                    value = (value & ~(mask << shift)) | (bits << shift)
+                index += 1
+            offset += span
+        return value
+
+    def ranges(self):
+        # the buffered writes with touching segments joined, [(start, length, value)]
+        runs = []
+        for start, (length, value) in zip(self.starts, self.segments):
+            if runs and runs[-1][0] + runs[-1][1] == start:
+                runs[-1][1] += length
+                runs[-1][2].append((length, value))
+            else:
+                runs.append([start, length, [(length, value)]])
+        return [(start, length, pieces[0][1] if len(pieces) == 1
+                 else int("".join(format(piece, "0{}b".format(size)) for size, piece in pieces), 2))
+                for start, length, pieces in runs]
+
+    def commit(self):
+        # check everything first, so a permission error leaves the memory untouched
+        ram = self.ram
+        runs = self.ranges()
+        try:
+            with ram._guard_ranges([(start, length) for start, length, _ in runs]):
+                for start, length, _ in runs:
+                    ram.check_permissions(start, length, for_write=True)
+                for start, length, value in runs:
+                    for plane in ram._planes():
+                        ram._set_int(plane, start, length, value)
+                    ram._encode(start, length)
+                    self._mark(start, length)
+        except BaseException:
+            self.rollback()
+            raise
+        self.starts, self.segments, self.unmarked, self.undo = [], [], [], []
+
+    def _mark(self, start, length):
+        # mark a committed range used, except the bits only set / reverse wrote
+        first = bisect_left(self.unmarked, start)
+        last = bisect_left(self.unmarked, start + length)
+        if first == last:
+            self.ram._mark_used(start, length)
+            return
+        self.ram._touch(start, length)
+        for bit in self.unmarked[first:last] + [start + length]:
+            if bit > start:
+                self.ram._mark_used(start, bit - start)
+            start = bit + 1
+
+    def rollback(self):
+        # drop the buffered writes and undo the metadata changes, newest first
+        # (called in the block it empties the transaction, which then goes on)
+        self.starts, self.segments, self.unmarked = [], [], []
+        while self.undo:
+            self.undo.pop()()
+
+
+class Scrubber:
+    # walks the memory of a ram in chunks and repairs it from its redundancy (tmr clones or
+    # hamming check bits, parity only counts), on a background thread, an asyncio task or by
+    # calling step() yourself. only pages written since they were last scrubbed are visited,
+    # with patrol=True the rest of the memory is swept round robin when nothing is pending
+    # (faults don't write, so that is what finds them)
+    # chunk: bits per step, rate: bits per second cap, interval: idle wait in seconds
+    def __init__(self, ram, chunk=1 << 16, rate=None, interval=0.1, patrol=False):
+        self.ram = ram
+        self.chunk = chunk
+        self.rate = rate
+        self.interval = interval
+        self.patrol = patrol
+        self.pending = set()  # physical page numbers written since they were scrubbed
+        self.damaged = set()  # words found beyond repair by their last scrub
+        self.sweep = None  # position of a full pass over the memory, None when there is none
+        self.cursor = 0  # patrol position
+        # counters
+        self.scrubbed_bits = 0
+        self.corrected_bits = 0
+        self.uncorrectable_words = 0
+        self.steps = 0
+        self.seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        ram.scrubber = self
+
+    def mark_all(self):
+        # everything changed (whole memory operations, load, ...): one full pass
+        self.sweep = 0
+
+    def _next_ranges(self):
+        # physical (start, length) ranges for the next step
+        ram = self.ram
+        if self.pending:
+            pages = heapq.nsmallest(max(self.chunk // ram.page_size, 1), list(self.pending))
+            self.pending.difference_update(pages)
+            ranges = []
+            for page in pages:
+                start = page * ram.page_size
+                length = min(ram.page_size, ram.size - start)
+                if length <= 0:
+                    continue
+                if ranges and ranges[-1][0] + ranges[-1][1] == start:
+                    ranges[-1][1] += length
+                else:
+                    ranges.append([start, length])
+            return ranges
+        if self.sweep is not None:
+            start = self.sweep
+            length = min(self.chunk, ram.size - start)
+            self.sweep = start + length if start + length < ram.size else None
+            return [[start, length]] if length > 0 else []
+        if self.patrol and ram.size:
+            start = self.cursor % ram.size
+            length = min(self.chunk, ram.size - start)
+            self.cursor = (start + length) % ram.size
+            return [[start, length]]
+        return []
+
+    def step(self):
+        # scrub one chunk, returns the number of bits looked at (0: nothing to do)
+        ram = self.ram
+        with ram._exclusive():
+            started = time.perf_counter()
+            bits = 0
+            for start, length in self._next_ranges():
+                corrected, failed = ram._scrub_range(start, length)
+                self.corrected_bits += corrected
+                # a damaged word is counted once, until a scrub finds it readable again
+                words = range(start // 64, -(-(start + length) // 64))
+                self.uncorrectable_words += len(set(failed) - self.damaged)
+                self.damaged.difference_update(words)
+                self.damaged.update(failed)
+                bits += length
+            self.scrubbed_bits += bits
+            self.steps += 1 if bits else 0
+            self.seconds += time.perf_counter() - started
+        return bits
+
+    def scrub_all(self):
+        # one synchronous pass over the whole memory, returns the bits corrected by it
+        before = self.corrected_bits
+        self.pending.clear()
+        self.mark_all()
+        while self.sweep is not None:
+            self.step()
+        return self.corrected_bits - before
+
+    def _delay(self, bits, started):
+        # how long to wait after a step to stay under rate (or idle when there was nothing)
+        if not bits:
+            return self.interval
+        if self.rate:
+            return max(bits / self.rate - (time.perf_counter() - started), 0.0)
+        return 0.0
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            delay = self._delay(self.step(), started)
+            if delay:
+                self._stop.wait(delay)
+
+    def start(self):
+        # scrub on a daemon thread until stop()
+        _check_background(self.ram, "the scrubber")
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ramemu-scrubber", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    async def run_async(self):
+        # the same loop as an asyncio task: asyncio.create_task(scrubber.run_async()),
+        # it returns after stop()
+        _check_background(self.ram, "the scrubber")
+        self._stop.clear()
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(self._delay(self.step(), started))
+
+    def stats(self):
+        return {
+            "scrubbed_bits": self.scrubbed_bits,
+            "corrected_bits": self.corrected_bits,
+            "uncorrectable_words": self.uncorrectable_words,
+            "steps": self.steps,
+            "seconds": self.seconds,
+            "bits_per_second": self.scrubbed_bits / self.seconds if self.seconds else 0.0,
+            "damaged_words": len(self.damaged),
+            "pending_pages": len(self.pending),
+        }
+
+
+def _check_background(ram, what):
+    # the scrubber and fault injector only run next to other work on a concurrent ram: a plain
+    # one doesn't lock its writes, so a step could vote over half written planes and undo them
+    if not ram.concurrent:
+        raise Exception("{} can only run in the background on a concurrent ram.".format(what))
+
+
+def _poisson(rng, mean):
+    # number of events of a poisson process with the given mean
+    if mean <= 0:
+        return 0
+    if mean > 30:
+        return max(0, round(rng.gauss(mean, math.sqrt(mean))))
+    limit, count, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+class FaultInjector:
+    # simulated hardware faults: bits change in the planes behind the ram's back (no permission
+    # checks, no clone or check bit update, no dirty page), only correct() or a scrubber sees them
+    # every plane of the redundancy mode can be hit (memory, clones, check bits), not is_used
+    # rate: single bit flips per second over the whole ram, burst_rate: bursts per second
+    def __init__(self, ram, rate=0.0, burst_rate=0.0, burst_length=8, seed=None):
+        self.ram = ram
+        self.rate = rate
+        self.burst_rate = burst_rate
+        self.burst_length = burst_length
+        self.rng = random.Random(seed)
+        self.flipped_bits = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _pick(self):
+        # a random (name, plane), weighted by plane size
+        planes = [(name, getattr(self.ram, name)) for name in _REDUNDANCY_PLANES[self.ram.redundancy]]
+        pick = self.rng.randrange(sum(len(plane) for _, plane in planes))
+        for name, plane in planes:
+            if pick < len(plane):
+                return name, plane
+            pick -= len(plane)
+
+    def flip(self, count=1):
+        # flip count random bits, returns [(plane name, physical index)]
+        flipped = []
+        with self.ram._exclusive():
+            for _ in range(count):
+                name, plane = self._pick()
+                index = self.rng.randrange(len(plane))
+                plane[index] ^= 1
+                flipped.append((name, index))
+            self.flipped_bits += count
+        return flipped
+
+    def burst(self, length=None):
+        # flip length adjacent bits of one plane, returns (plane name, first index, length)
+        length = length or self.burst_length
+        with self.ram._exclusive():
+            name, plane = self._pick()
+            length = min(length, len(plane))
+            start = self.rng.randrange(len(plane) - length + 1)
+            plane.set_int(start, length, plane.get_int(start, length) ^ ((1 << length) - 1))
+            self.flipped_bits += length
+        return name, start, length
+
+    def stick(self, index, value, plane="memory"):
+        # a stuck-at fault: the physical bit keeps value whatever is written to it
+        with self.ram._exclusive():
+            self.ram._stuck[plane, index] = value
+            getattr(self.ram, plane)[index] = value
+
+    def unstick(self, index, plane="memory"):
+        with self.ram._exclusive():
+            self.ram._stuck.pop((plane, index), None)
+
+    def advance(self, seconds):
+        # inject the faults of seconds of simulated time at rate / burst_rate,
+        # returns how many bits were flipped
+        before = self.flipped_bits
+        self.flip(_poisson(self.rng, self.rate * seconds))
+        for _ in range(_poisson(self.rng, self.burst_rate * seconds)):
+            self.burst()
+        return self.flipped_bits - before
+
+    def _run(self, tick):
+        last = time.perf_counter()
+        while not self._stop.wait(tick):
+            now = time.perf_counter()
+            self.advance(now - last)
+            last = now
+
+    def start(self, tick=0.01):
+        # inject in real time on a daemon thread until stop()
+        _check_background(self.ram, "the fault injector")
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(tick,), name="ramemu-faults", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class _SwapFile:
+    # backing store of a VirtualMemory: slots of page_bytes in a memory mapped temporary file,
+    # doubled when it runs out. a page gets a slot the first time it is evicted with data in it
+    # and keeps it, so evicting it again unchanged costs nothing
+    def __init__(self, page_bytes, directory=None):
+        self.page_bytes = page_bytes
+        fd, self.path = tempfile.mkstemp(prefix="ramemu_swap_", dir=directory)
+        self.file = os.fdopen(fd, "r+b")
+        self.slots = {}  # virtual page -> slot
+        self.free = []
+        self.capacity = 0
+        self.map = None
+        self._grow(64)
+
+    def _grow(self, capacity):
+        # the new tail of the file is a hole, it takes no disk until written
+        self.file.truncate(capacity * self.page_bytes)
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), capacity * self.page_bytes)
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def read(self, page):
+        # the swapped bytes of a page, None if it has none
+        slot = self.slots.get(page)
+        if slot is None:
+            return None
+        offset = slot * self.page_bytes
+        return self.map[offset:offset + self.page_bytes]
+
+    def write(self, page, data):
+        slot = self.slots.get(page)
+        if slot is None:
+            if not self.free:
+                self._grow(self.capacity * 2)
+            slot = self.slots[page] = self.free.pop()
+        offset = slot * self.page_bytes
+        self.map[offset:offset + self.page_bytes] = data
+
+    def discard(self, page):
+        slot = self.slots.pop(page, None)
+        if slot is not None:
+            self.free.append(slot)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+        os.remove(self.path)
+
+
+class VirtualMemory:
+    # a virtual address space of size bits on top of a ram, which plays the physical memory.
+    # virtual pages (ram.page_size bits) are mapped through a page table to frames: frames pages
+    # of the ram claimed as one block, registered as a variable called name so defragment and
+    # rotation move it like any other. only that many pages are resident, the rest live in a
+    # swap file. touching a page that isn't resident is a page fault: it is read back from swap
+    # (zero filled if it never held data) into a free frame, or into one taken from a resident
+    # page, the least recently used with policy="lru", the first the clock hand finds not
+    # referenced since its last pass with policy="clock". only dirty pages are written back.
+    # reads and writes go through the ram, so its permissions, redundancy, locks and dirty
+    # tracking apply to the frames as usual
+    def __init__(self, ram, size, frames=64, policy="clock", name="frames", directory=None):
+        if policy not in ("lru", "clock"):
+            raise Exception("unknown eviction policy {!r}.".format(policy))
+        if size <= 0 or size % ram.page_size != 0:
+            raise Exception("virtual size must be a multiple of the page size.")
+        if frames <= 0:
+            raise Exception("a virtual memory needs at least one frame.")
+        if name in ram.variables:
+            raise Exception("variable {!r} already exists.".format(name))
+        self.ram = ram
+        self.size = size
+        self.page_size = ram.page_size
+        self.frames = frames
+        self.policy = policy
+        self.name = name
+        position = ram.allocate_aligned(frames * self.page_size, self.page_size)
+        ram._register(name, position, frames * self.page_size, "frames", self.page_size)
+        self._ram_pages = range(ram.page_number(position), ram.page_number(position + frames * self.page_size - 1) + 1)
+        for page in self._ram_pages:
+            ram.mark_page_used(page)
+        # permissions of the virtual addresses, the same region map the ram uses
+        self.permissions = PermissionMap(size)
+        self.page_table = {}  # resident virtual page -> frame
+        self.owners = [None] * frames  # frame -> virtual page
+        self.dirty = bytearray(frames)
+        self.referenced = bytearray(frames)  # clock reference bits
+        self.recent = OrderedDict()  # resident pages, least recently used first (lru)
+        self.hand = 0
+        self.free_frames = list(range(frames - 1, -1, -1))
+        self.swap = _SwapFile((self.page_size + 7) // 8, directory)
+        self.lock = threading.RLock()
+        # counters
+        self.hits = 0
+        self.faults = 0
+        self.zero_fills = 0
+        self.swap_ins = 0
+        self.swap_outs = 0
+        self.evictions = 0
+
+    def page_number(self, address):
+        # virtual page of a virtual address
+        return address // self.page_size
+
+    @contextmanager
+    def _locked(self):
+        # the vm's own lock, then the stripe locks of the frames (concurrent rams)
+        with self.lock, self.ram._variable_guard(self.name):
+            yield
+
+    def _position(self, frame, offset=0):
+        # ram address of a bit of a frame, looked up every time since the block can move
+        # (rotated across the end of the ram it continues at 0)
+        return (self.ram.variables[self.name][0] + frame * self.page_size + offset) % self.ram.size
+
+    def _frame(self, page, for_write):
+        # frame of a virtual page, faulting it in when it isn't resident
+        frame = self.page_table.get(page)
+        if frame is None:
+            frame = self._fault(page)
+        else:
+            self.hits += 1
+        if self.policy == "lru":
+            self.recent.move_to_end(page)
+        else:
+            self.referenced[frame] = 1
+        if for_write:
+            self.dirty[frame] = 1
+        return frame
+
+    def _fault(self, page):
+        self.faults += 1
+        frame = self.free_frames.pop() if self.free_frames else self._evict()
+        data = self.swap.read(page)
+        if data is None:
+            self.zero_fills += 1
+            value = 0
+        else:
+            self.swap_ins += 1
+            value = int.from_bytes(data, "big")
+        self.ram._write_ring(self._position(frame), self.page_size, value)
+        self.page_table[page] = frame
+        self.owners[frame] = page
+        self.dirty[frame] = 0
+        if self.policy == "lru":
+            self.recent[page] = None
+        return frame
+
+    def _evict(self):
+        # free a frame by evicting its page, returns the frame
+        if self.policy == "lru":
+            page = self.recent.popitem(last=False)[0]
+            frame = self.page_table[page]
+        else:
+            while self.referenced[self.hand]:
+                self.referenced[self.hand] = 0
+                self.hand = (self.hand + 1) % self.frames
+            frame = self.hand
+            self.hand = (self.hand + 1) % self.frames
+            page = self.owners[frame]
+        self._write_back(frame)
+        del self.page_table[page]
+        self.owners[frame] = None
+        self.evictions += 1
+        return frame
+
+    def _write_back(self, frame):
+        # a dirty frame goes to swap, an all zero page just gives its slot back
+        if not self.dirty[frame]:
+            return
+        page = self.owners[frame]
+        value = self.ram._read_ring(self._position(frame), self.page_size)
+        if value:
+            self.swap.write(page, value.to_bytes(self.swap.page_bytes, "big"))
+            self.swap_outs += 1
+        else:
+            self.swap.discard(page)
+        self.dirty[frame] = 0
+
+    def _pieces(self, address, length, for_write):
+        # (ram address, length) of the frames behind a virtual range, one page at a time. a page
+        # is only faulted in when the previous piece is done with, so one frame is enough
+        if address < 0 or length < 0 or address + length > self.size:
+            raise IndexError("virtual address out of range")
+        self.permissions.check(address, length, for_write)
+        while length > 0:
+            page, offset = divmod(address, self.page_size)
+            span = min(self.page_size - offset, length)
+            yield self._position(self._frame(page, for_write), offset), span
+            address += span
+            length -= span
+
+    def _read_value(self, address, length):
+        value = 0
+        with self._locked():
+            for position, span in self._pieces(address, length, False):
+                value = (value << span) | self.ram._read_ring(position, span)
+        return value
+
+    def _write_value(self, address, length, value):
+        with self._locked():
+            for position, span in self._pieces(address, length, True):
+                length -= span
+                self.ram._write_ring(position, span, value >> length)
+
+    def read(self, address, length):
+        return _int_to_bits(self._read_value(address, length), length)
+
+    def write(self, address, data):
+        self._write_value(address, len(data), _bits_to_int(data))
+
+    def read_int(self, address, length):
+        return _to_signed(self._read_value(address, length), length)
+
+    def write_int(self, address, length, value):
+        self._write_value(address, length, value & ((1 << length) - 1))
+
+    def read_bytes(self, address, nbytes):
+        return self._read_value(address, nbytes * 8).to_bytes(nbytes, "big")
+
+    def write_bytes(self, address, buffer):
+        data = memoryview(buffer).cast("B")
+        self._write_value(address, len(data) * 8, int.from_bytes(data, "big"))
+        return len(data)
+
+    def translate(self, address, for_write=False):
+        # ram address behind a virtual address, faulting its page in
+        # (only good until the next access evicts it)
+        with self._locked():
+            return next(self._pieces(address, 1, for_write))[0]
+
+    def set_permissions(self, address, length, read=True, write=True):
+        # like ram.set_permissions, for virtual addresses
+        with self.lock:
+            self.permissions.set(address, length, read, write)
+
+    def set_page_permissions(self, page, read=True, write=True):
+        self.set_permissions(page * self.page_size, self.page_size, read, write)
+
+    def check_permissions(self, address, length, for_write=False):
+        self.permissions.check(address, length, for_write)
+
+    def permissions_at(self, address):
+        return self.permissions.at(address)
+
+    def is_resident(self, page):
+        return page in self.page_table
+
+    def resident(self):
+        # sorted resident virtual pages
+        return sorted(self.page_table)
+
+    def discard(self, first, count=1):
+        # drop pages without writing them back, they read as zero again
+        with self._locked():
+            for page in range(first, first + count):
+                frame = self.page_table.pop(page, None)
+                if frame is not None:
+                    self.owners[frame] = None
+                    self.dirty[frame] = 0
+                    self.referenced[frame] = 0
+                    self.recent.pop(page, None)
+                    self.free_frames.append(frame)
+                self.swap.discard(page)
+
+    def flush(self):
+        # write every dirty resident page to swap, they stay resident
+        with self._locked():
+            for frame, page in enumerate(self.owners):
+                if page is not None:
+                    self._write_back(frame)
+
+    def close(self):
+        # give the frames back to the ram and remove the swap file
+        with self._locked():
+            position, length = self.ram.variables[self.name]
+            for start, span in _wrap(position, length, self.ram.size):
+                self.ram.free(start, span)
+            with self.ram._meta:
+                del self.ram.variables[self.name]
+                del self.ram.variable_metadata[self.name]
+            for page in self._ram_pages:
+                self.ram.mark_page_free(page)
+            self.swap.close()
+            self.page_table.clear()
+
+    def stats(self):
+        accesses = self.hits + self.faults
+        return {
+            "hits": self.hits,
+            "faults": self.faults,
+            "zero_fills": self.zero_fills,
+            "swap_ins": self.swap_ins,
+            "swap_outs": self.swap_outs,
+            "evictions": self.evictions,
+            "fault_rate": self.faults / accesses if accesses else 0.0,
+            "resident_pages": len(self.page_table),
+            "swapped_pages": len(self.swap.slots),
+            "swap_bytes": self.swap.capacity * self.swap.page_bytes,
+        }
+
+
+def _variable_bits(ram, arguments, result):
+    return ram.variables[arguments["name"]][1]
+
+
+def _scanned_bits(ram, arguments, result):
+    # an explicit end=0 scans nothing, only None means to the end
+    end = ram.size if arguments["end"] is None else arguments["end"]
+    return max(end - arguments["start"], 0)
+
+
+def _whole_bits(ram, arguments, result):
+    return ram.size
+
+
+# the operations ram.enable_stats() instruments, with the bits a call processes:
+# a parameter name, a constant, or a function of (ram, arguments, result)
+_STATS_BITS = {
+    "read": "length",
+    "read_int": "length",
+    "write_int": "length",
+    "write": lambda ram, arguments, result: len(arguments["data"]),
+    "read_bytes": lambda ram, arguments, result: arguments["nbytes"] * 8,
+    "write_bytes": lambda ram, arguments, result: result * 8,
+    "get": 1,
+    "set": 1,
+    "reverse": 1,
+    "free": "length",
+    "check_permissions": "length",
+    "set_permissions": "length",
+    "allocate": "size",
+    "allocate_left": "size",
+    "allocate_best": "size",
+    "allocate_aligned": "size",
+    "new_variable": "size",
+    "new_variable_left": "size",
+    "new_variable_string": _variable_bits,
+    "new_variable_string_left": _variable_bits,
+    "new_array": _variable_bits,
+    "new_struct": _variable_bits,
+    "get_variable": _variable_bits,
+    "set_variable": _variable_bits,
+    "get_variable_string": _variable_bits,
+    "set_variable_string": _variable_bits,
+    "fetch_add": _variable_bits,
+    "compare_and_swap": _variable_bits,
+    "scan_for_pattern": _scanned_bits,
+    "scan_for_patterns": _scanned_bits,
+    "correct": _whole_bits,
+    "compare_memory": _whole_bits,
+    "randomize": _whole_bits,
+    "randomize_unused": _whole_bits,
+    "randomize_all": _whole_bits,
+    "reverse_all": _whole_bits,
+    "rotate_left": _whole_bits,
+    "rotate_right": _whole_bits,
+    "materialize": _whole_bits,
+    "defragment": _whole_bits,
+    "save": _whole_bits,
+    "load": _whole_bits,
+    "checkpoint": _whole_bits,
+    "restore": _whole_bits,
+    "hex_dump": _whole_bits,
+    "dump_memory": _whole_bits,
+    "to_string": _whole_bits,
+}
+
+
+class Stats:
+    # the counters behind ram.enable_stats(): calls, bits, seconds (inclusive, so fetch_add
+    # also counts the get_variable and set_variable it makes) and errors per operation, what allocation went through,
+    # and the hooks called after every instrumented call
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hooks = {}  # operation ("allocation" for allocations) -> [callback]
+        self.reset()
+
+    def reset(self):
+        self.operations = {}  # name -> [calls, bits, seconds, errors]
+        self.allocations = 0
+        self.allocation_failures = {}  # reason -> count
+        self.requested_bits = 0
+        self.scanned_extents = 0
+        self.max_scanned_extents = 0
+        self.repaired_bits = 0
+        self.mismatched_bits = 0
+
+    def _record(self, name, seconds, bits, error):
+        with self.lock:
+            entry = self.operations.get(name)
+            if entry is None:
+                entry = self.operations[name] = [0, 0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += bits
+            entry[2] += seconds
+            entry[3] += error is not None
+
+    def _notify(self, operation, event):
+        for callback in self.hooks.get(operation, ()):
+            callback(event)
+
+    def instrument(self, ram, name, method):
+        # method wrapped to count its calls, the bound ram method is passed in
+        bits = _STATS_BITS[name]
+        parameters = inspect.signature(method).parameters
+        names = list(parameters)
+        defaults = {key: parameter.default for key, parameter in parameters.items()
+                    if parameter.default is not inspect.Parameter.empty}
+
+        @functools.wraps(method)
+        def instrumented(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except BaseException as error:
+                seconds = time.perf_counter() - started
+                self._record(name, seconds, 0, error)
+                if name in self.hooks:
+                    self._notify(name, {"operation": name, "arguments": dict(zip(names, args), **kwargs),
+                                        "result": None, "error": error, "seconds": seconds, "bits": 0})
+                raise
+            seconds = time.perf_counter() - started
+            if isinstance(bits, int):
+                count = bits
+                arguments = None
+            else:
+                arguments = dict(defaults)
+                arguments.update(zip(names, args))
+                arguments.update(kwargs)
+                count = arguments[bits] if isinstance(bits, str) else bits(ram, arguments, result)
+            self._record(name, seconds, count, None)
+            if name == "correct" or name == "compare_memory":
+                with self.lock:
+                    if name == "correct":
+                        self.repaired_bits += result
+                    else:
+                        self.mismatched_bits += len(result)
+            if name in self.hooks:
+                if arguments is None:
+                    arguments = dict(zip(names, args), **kwargs)
+                self._notify(name, {"operation": name, "arguments": arguments, "result": result,
+                                    "error": None, "seconds": seconds, "bits": count})
+            return result
+        return instrumented
+
+    def instrument_claim(self, ram, claim):
+        # every allocation goes through Ram._claim: attempts, failure reasons and how many free
+        # extents (in address order) the search passed before it found a block
+        def instrumented(find, size, message="not enough memory."):
+            scanned = []
+
+            def search():
+                position = find()
+                allocator = ram.allocator
+                if position is None:
+                    scanned.append(len(allocator.starts))
+                else:
+                    scanned.append(bisect_right(allocator.starts, (position + allocator.base) % allocator.size))
+                return position
+
+            error = position = None
+            started = time.perf_counter()
+            try:
+                position = claim(search, size, message)
+            except Exception as failure:
+                error = failure
+                raise
+            finally:
+                seconds = time.perf_counter() - started
+                with self.lock:
+                    self.allocations += 1
+                    self.requested_bits += size
+                    if scanned:
+                        self.scanned_extents += scanned[0]
+                        self.max_scanned_extents = max(self.max_scanned_extents, scanned[0])
+                    if error is not None:
+                        reason = str(error)
+                        self.allocation_failures[reason] = self.allocation_failures.get(reason, 0) + 1
+                if "allocation" in self.hooks:
+                    self._notify("allocation", {"operation": "allocation", "size": size, "position": position,
+                                                "error": error, "seconds": seconds,
+                                                "scanned": scanned[0] if scanned else 0})
+            return position
+        return instrumented
+
+    def report(self):
+        with self.lock:
+            operations = {name: {"calls": calls, "bits": bits, "seconds": seconds, "errors": errors,
+                                 "seconds_per_call": seconds / calls if calls else 0.0}
+                          for name, (calls, bits, seconds, errors) in sorted(self.operations.items())}
+            failures = sum(self.allocation_failures.values())
+            return {
+                "operations": operations,
+                "allocation": {
+                    "attempts": self.allocations,
+                    "failures": failures,
+                    "failure_reasons": dict(self.allocation_failures),
+                    "requested_bits": self.requested_bits,
+                    "scanned_extents": self.scanned_extents,
+                    "mean_scanned_extents": self.scanned_extents / self.allocations if self.allocations else 0.0,
+                    "max_scanned_extents": self.max_scanned_extents,
+                },
+                "repaired_bits": self.repaired_bits,
+                "mismatched_bits": self.mismatched_bits,
+            }
+
 
 class Ram:
-    def __init__(self, size):  # size in bits
+    def __init__(self, size, storage=None, seed=None, engine=None, redundancy="tmr", concurrent=False,
+                 sparse=False):  # size in bits
         # this shit initializes the ram with given size and clones
         # also tracks usage and variable allocation
+        # bits are packed by the storage backend instead of one list slot per bit
+        # redundancy picks how the memory is protected:
+        #   "tmr"     two full clones, majority vote (3x the memory, corrects any single copy)
+        #   "hamming" 8 check bits per 64 bit word, corrects 1 and detects 2 flipped bits per word
+        #   "parity"  1 check bit per 64 bit word, only detects
+        #   "none"    just the memory
+        # concurrent=True makes the ram safe to share between threads: data access locks the
+        # lock pages it touches (striped), allocation and permission changes take a metadata lock
+        # and whole memory operations take everything
+        # storage=SharedStorage() shares it between processes as well (always concurrent then),
+        # the other processes open it with Ram.attach(storage.name)
+        # sparse=True only materializes the pages (page_size bits) something is written to,
+        # for huge address spaces that are mostly never touched (same as storage=SparseStorage())
+        if redundancy not in _REDUNDANCY_PLANES:
+            raise Exception("unknown redundancy mode {!r}.".format(redundancy))
         self.size = size
-        self.memory = [0] * size
-        self.memory_clone_a = [0] * size
-        self.memory_clone_b = [0] * size
-        self.is_used = [False] * size
-        self.variables = {}
-        # permissions: store permissions as tuples (read, write) per bit
-        self.permissions = [(True, True)] * size  
+        self.redundancy = redundancy
+        if storage is None:
+            storage = SparseStorage() if sparse else PackedStorage()
+        self.storage = storage
+        # pages for the paging simulation, dirty tracking and sparse planes
+        self.page_size = getattr(storage, "page_size", 64)  # default page size, can be changed
+        self.memory = self.storage.plane("memory", size)
+        self.memory_clone_a = self.memory_clone_b = self.check_bits = None
+        if redundancy == "tmr":
+            self.memory_clone_a = self.storage.plane("memory_clone_a", size)
+            self.memory_clone_b = self.storage.plane("memory_clone_b", size)
+        elif redundancy in _WORD_CODES:
+            self.check_bits = self.storage.plane("check_bits", _check_plane_size(size, redundancy))
+        self.is_used = self.storage.plane("is_used", size)
+        # free extents, kept in sync with is_used by _mark_used / _mark_free
+        self.allocator = Allocator(size)
+        # per instance random source, pass a seed to make runs reproducible
+        self.rng = random.Random(seed)
+        # engine for the whole memory operations (randomize, correct, compare, ...)
+        self.engine = engine if engine is not None else default_engine
+        # rotation offset: logical address a lives at physical bit (a + base) % size
+        # the planes never move on a rotation, the allocator, permissions and variables
+        # translate with the same base
+        self.base = 0
+        self.variables = VariableTable(size)
+        # permissions: (read, write) flags stored per region instead of per bit
+        self.permissions = PermissionMap(size)
         # store variable metadata like type (int, string), alignment, etc.
         self.variable_metadata = {}
         # store pages info for paging simulation
-        self.page_size = 64  # default page size, can be changed
-        self.pages = [False] * (size // self.page_size)
+        self.pages = PageFlags(size // self.page_size)
+        # dirty page tracking for incremental checkpoints
+        # _dirty holds the page numbers changed since the last checkpoint,
+        # _dirty_all is set when everything changed (whole memory operations, page size change)
+        self.checkpoints = []
+        self._last_checkpoint = None
+        self._dirty = set()
+        self._dirty_all = True
+        # background helpers: the attached Scrubber, stuck-at faults from a FaultInjector,
+        # and the lock they hold around each step (hold it too when writing while they run)
+        self.scrubber = None
+        self._stuck = {}
+        self.lock = threading.RLock()
+        # the transaction each thread has open (see transaction())
+        self._local = _ThreadState()
+        # opt in instrumentation (enable_stats), nothing is counted or wrapped until then
+        self._stats = None
+        self._instrumented = False
+        self._shared = getattr(self.storage, "shared", False)
+        self.concurrent = concurrent or self._shared
+        if self._shared:
+            # the locks hold between processes, and the metadata lock keeps the metadata in sync
+            self._stripes = [self.storage.lock(stripe) for stripe in range(_LOCK_STRIPES)]
+            self._meta = _SharedMeta(self, self.storage.lock(_SHARED_META_LOCK))
+            self._generation = 0
+            self._published = None
+            with self._meta:
+                pass
+        elif concurrent:
+            self._stripes = [threading.RLock() for _ in range(_LOCK_STRIPES)]
+            self._meta = threading.RLock()
+        else:
+            self._meta = _NO_LOCK
+
+    @classmethod
+    def attach(cls, name, engine=None, directory=None):
+        # open a ram another process created on a SharedStorage, by the storage's name
+        # (attach once per process: fcntl locks can't tell two attachments in one process apart)
+        storage = SharedStorage(name, create=False, directory=directory)
+        meta = storage.metadata()
+        return cls(meta["size"], storage=storage, engine=engine, redundancy=meta["redundancy"])
+
+    def _shared_metadata(self):
+        # what processes sharing a ram keep in sync, everything but the per process random state
+        meta = self._snapshot_metadata()
+        del meta["rng"]
+        return meta
+
+    def _pull(self):
+        # called with the shared metadata lock held
+        generation = self.storage.generation()
+        if generation != self._generation:
+            self._restore_metadata(json.loads(self.storage.read_metadata()[1]))
+            self._generation = generation
+            self._published = json.dumps(self._shared_metadata()).encode()
+
+    def _push(self):
+        # called with the shared metadata lock held, writes only when something changed
+        data = json.dumps(self._shared_metadata()).encode()
+        if data != self._published:
+            self._generation = self.storage.write_metadata(data)
+            self._published = data
+
+    def _sync(self):
+        # a shared ram picks up metadata other processes changed before touching memory
+        if self._shared and self.storage.generation() != self._generation:
+            with self._meta:
+                pass
+
+    def _stripe_locks(self, spans):
+        # sorted stripe locks of the lock pages under physical spans
+        stripes = set()
+        for start, length in spans:
+            first = start // _LOCK_GRANULE
+            last = (start + length - 1) // _LOCK_GRANULE
+            if last - first + 1 >= _LOCK_STRIPES:
+                return self._stripes
+            stripes.update(page % _LOCK_STRIPES for page in range(first, last + 1))
+        return [self._stripes[stripe] for stripe in sorted(stripes)]
+
+    def _guard(self, position, length):
+        # locks a logical range for data access in concurrent mode
+        if not self.concurrent:
+            return _NO_LOCK
+        return _RangeGuard(self, ((position, length),))
+
+    def _guard_ranges(self, ranges):
+        # locks several logical ranges at once (a transaction commit)
+        if not self.concurrent:
+            return _NO_LOCK
+        return _RangeGuard(self, ranges)
+
+    def enable_stats(self):
+        # opt in instrumentation: the operations in _STATS_BITS are wrapped on this instance to
+        # count calls, bits, seconds and errors, and allocations are followed through _claim.
+        # until it is called (and after disable_stats) the methods are the plain ones, so it
+        # costs nothing. counters carry on across disable / enable, reset_stats() clears them
+        if self._stats is None:
+            self._stats = Stats()
+        if not self._instrumented:
+            for name in _STATS_BITS:
+                setattr(self, name, self._stats.instrument(self, name, getattr(self, name)))
+            self._claim = self._stats.instrument_claim(self, self._claim)
+            self._instrumented = True
+        return self._stats
+
+    def disable_stats(self):
+        # back to the plain methods, the counters are kept
+        if self._instrumented:
+            for name in list(_STATS_BITS) + ["_claim"]:
+                self.__dict__.pop(name, None)
+            self._instrumented = False
+
+    def stats(self):
+        # what enable_stats() counted so far, as a dict
+        return (self._stats or Stats()).report()
+
+    def reset_stats(self):
+        if self._stats is not None:
+            self._stats.reset()
+
+    def add_hook(self, operation, callback):
+        # callback(event) after every call of an instrumented operation (or "allocation" for every
+        # allocation), event is a dict: operation, arguments, result, error, seconds, bits.
+        # turns stats on
+        if operation not in _STATS_BITS and operation != "allocation":
+            raise Exception("no hook for {!r}.".format(operation))
+        self.enable_stats().hooks.setdefault(operation, []).append(callback)
+
+    def remove_hook(self, operation, callback):
+        if self._stats is not None and callback in self._stats.hooks.get(operation, ()):
+            self._stats.hooks[operation].remove(callback)
+            if not self._stats.hooks[operation]:
+                del self._stats.hooks[operation]
+
+    def _transaction(self):
+        # the transaction this thread has open on the ram, None outside one
+        return self._local.transaction
+
+    def transaction(self):
+        # batch writes: with ram.transaction(): ... (see Transaction)
+        transaction = self._transaction()
+        return transaction if transaction is not None else Transaction(self)
+
+    def _variable_guard(self, name):
+        # locks a variable for a read-modify-write in concurrent mode
+        if not self.concurrent:
+            return _NO_LOCK
+        return _VariableGuard(self, name)
+
+    def _exclusive(self):
+        # the whole ram: every stripe, then the metadata lock (the order range guards use too)
+        # without concurrent mode just ram.lock (the scrubber and fault injector go through here)
+        if not self.concurrent:
+            return self.lock
+        return _Locks(self._stripes + [self._meta, self.lock])
+
+    def _touch(self, position, length):
+        # remember the (physical) pages of a changed range, for checkpoints and the scrubber
+        if length > 0:
+            for start, span in _spans(position, length, self.base, self.size):
+                self._touch_physical(start, span)
+
+    def _touch_physical(self, start, length, scrubbed=False):
+        # scrubbed: the change is a scrubber repair, the page doesn't need another visit
+        if self._stuck:
+            self._hold_stuck()
+        first = start // self.page_size
+        last = (start + length - 1) // self.page_size
+        pages = (first,) if first == last else range(first, last + 1)
+        if not self._dirty_all:
+            self._dirty.update(pages)
+        if self.scrubber is not None and not scrubbed:
+            self.scrubber.pending.update(pages)
+
+    def _touch_all(self):
+        self._dirty_all = True
+        self._dirty.clear()
+        if self._stuck:
+            self._hold_stuck()
+        if self.scrubber is not None:
+            self.scrubber.mark_all()
+
+    def _hold_stuck(self):
+        # stuck-at faults (see FaultInjector.stick) keep their value whatever was written
+        for (name, index), value in list(self._stuck.items()):
+            plane = getattr(self, name, None)
+            if plane is not None and index < len(plane):
+                plane[index] = value
+
+    def _set_base(self, base):
+        self.base = base
+        self.allocator.base = base
+        self.permissions.base = base
+        self.variables.base = base
+
+    def _index(self, position):
+        # physical index of a single logical bit
+        if not self.base:
+            return position
+        if not 0 <= position < self.size:
+            raise IndexError("bit index out of range")
+        return (position + self.base) % self.size
+
+    def _get_int(self, plane, position, length):
+        # plane.get_int in logical addresses
+        spans = _spans(position, length, self.base, self.size)
+        if len(spans) == 1:
+            return plane.get_int(*spans[0])
+        value = 0
+        for start, span in spans:
+            value = (value << span) | plane.get_int(start, span)
+        return value
+
+    def _set_int(self, plane, position, length, value):
+        # plane.set_int in logical addresses
+        for start, span in _spans(position, length, self.base, self.size):
+            length -= span
+            plane.set_int(start, span, value >> length)
+
+    def _fill(self, plane, position, length, value):
+        for start, span in _spans(position, length, self.base, self.size):
+            plane.fill(start, span, value)
+
+    def _text(self, position, length):
+        # main memory as '0'/'1' text in logical addresses
+        return "".join(self.memory.to_text(start, span)
+                       for start, span in _spans(position, length, self.base, self.size))
 
     def set_permissions(self, position, length, read=True, write=True):
         # sets permissions for a range of memory bits
         # read/write are booleans
-        for i in range(length):
-            self.permissions[position + i] = (read, write)
+        transaction = self._transaction()
+        if transaction is not None:
+            regions = list(self.permissions.regions(position, length))
+            transaction.undo.append(lambda: self._set_regions(regions))
+        self._set_regions(((position, length, read, write),))
+
+    def _set_regions(self, regions):
+        # (start, length, read, write) regions, also how a rolled back transaction puts them back
+        with self._meta:
+            if not self.concurrent:
+                for position, length, read, write in regions:
+                    self.permissions.set(position, length, read, write)
+                return
+            # concurrent readers keep checking against the old map until the new one is swapped in
+            permissions = self.permissions.copy()
+            for position, length, read, write in regions:
+                permissions.set(position, length, read, write)
+            self.permissions = permissions
 
     def check_permissions(self, position, length, for_write=False):
         # checks if a given range of memory is accessible for read or write
-        for i in range(length):
-            r, w = self.permissions[position + i]
-            if for_write and not w:
-                raise Exception("write permission denied at position {}".format(position + i))
-            if not for_write and not r:
-                raise Exception("read permission denied at position {}".format(position + i))
-
-    def allocate(self, size):
-        # allocate memory randomly, tries 100 times
-        attempts = 0
-        while attempts < 100:
-            position = random.randint(0, self.size - size)
-            if all(not self.is_used[position + i] for i in range(size)):
-                for i in range(size):
-                    self.is_used[position + i] = True
-                return position
-            attempts += 1
-        raise Exception("not enough memory after 100 attempts.")
+        self.permissions.check(position, length, for_write)
+
+    def permissions_at(self, position):
+        # (read, write) flags of a single bit
+        return self.permissions.at(position)
+
+    def iter_regions(self, position=0, length=None):
+        # yields (start, length, read, write) for each permission region in a range
+        return self.permissions.regions(position, length)
+
+    def _mark_used(self, position, length):
+        # rewriting bits that are already used (the common case) leaves the allocator alone
+        if self._get_int(self.is_used, position, length) != (1 << length) - 1:
+            self._fill(self.is_used, position, length, 1)
+            with self._meta:
+                self.allocator.reserve(position, length)
+        self._touch(position, length)
+
+    def _mark_free(self, position, length):
+        self._fill(self.is_used, position, length, 0)
+        with self._meta:
+            self.allocator.release(position, length)
+        self._touch(position, length)
+
+    def _claim(self, find, size, message="not enough memory."):
+        # search and reserve in one step under the metadata lock, so two threads are never
+        # handed the same block, then mark it used under the block's own locks
+        with self._meta:
+            position = find()
+            if position is None:
+                raise Exception(message)
+            self.allocator.reserve(position, size)
+        with self._guard(position, size):
+            self._mark_used(position, size)
+        transaction = self._transaction()
+        if transaction is not None:
+            transaction.undo.append(lambda: self._unclaim(position, size))
+        return position
+
+    def _unclaim(self, position, size):
+        # undo of a claim made in a transaction that rolled back (its writes were never applied)
+        with self._guard(position, size):
+            self._mark_free(position, size)
+
+    def allocate(self, size, alignment=1):
+        # allocate memory at a random free position
+        # sampled uniformly from the holes that can hold it, so it only fails when nothing fits
+        return self._claim(lambda: self.allocator.random_fit(size, self.rng, alignment), size)
 
     def allocate_left(self, size):
-        # allocate memory as left as possible (where free)
-        for position in range(self.size - size + 1):
-            if all(not self.is_used[position + i] for i in range(size)):
-                for i in range(size):
-                    self.is_used[position + i] = True
-                return position
-        raise Exception("not enough memory.")
+        # allocate memory as left as possible (first fit over the free extents)
+        return self._claim(lambda: self.allocator.first_fit(size), size)
+
+    def allocate_best(self, size, alignment=1):
+        # allocate memory in the smallest free hole that fits (best fit)
+        return self._claim(lambda: self.allocator.best_fit(size, alignment), size)
 
     def write(self, position, data):
         # write data at position, also update clones and permissions
-        length_of_data = len(data)
-        self.check_permissions(position, length_of_data, for_write=True)
-        for i in range(length_of_data):
-            self.memory[position + i] = data[i]
-            self.memory_clone_a[position + i] = data[i]
-            self.memory_clone_b[position + i] = data[i]
-            self.is_used[position + i] = True
+        self._write_value(position, len(data), _bits_to_int(data))
+
+    def write_int(self, position, length, value):
+        # write an int as length bits of two's complement, values that don't fit wrap around
+        self._write_value(position, length, value & ((1 << length) - 1))
+
+    def _write_value(self, position, length, value):
+        # every write ends up here with the bits packed into an unsigned int
+        transaction = self._transaction()
+        if transaction is not None:
+            transaction.write(position, length, value)
+            return
+        with self._guard(position, length):
+            self.check_permissions(position, length, for_write=True)
+            spans = _spans(position, length, self.base, self.size)
+            if len(spans) == 1:
+                start = spans[0][0]
+                for plane in self._planes():
+                    plane.set_int(start, length, value)
+            else:
+                for plane in self._planes():
+                    self._set_int(plane, position, length, value)
+            self._encode(position, length)
+            self._mark_used(position, length)
 
     def convert_dec_to_bin(self, dec, size=None):
         # converts decimal to binary (two's complement if negative)
-        if dec == 0 and size is not None:
-            return [0] * size
-        bin_array = []
-        is_negative = dec < 0
-        dec = abs(dec)
-        while dec > 0:
-            bin_array.append(dec % 2)
-            dec //=2
-        bin_array.reverse()
-        if size:
-            # pad binary number to match size
-            bin_array = [0] * (size - len(bin_array)) + bin_array
-        if is_negative:
-            # use two's complement for negative numbers
-            bin_array = self.twos_complement(bin_array, size)
-        return bin_array
+        if dec < 0:
+            # masking with the width gives the two's complement directly
+            width = size if size else dec.bit_length() + 1
+            return _int_to_bits(dec & ((1 << width) - 1), width)
+        # positive numbers are padded to size but keep all their bits
+        return _int_to_bits(dec, max(size or 0, dec.bit_length()))
 
     def twos_complement(self, bin_array, size):
-        # ensures two's complement
-        bin_array = [0] * (size - len(bin_array)) + bin_array
-        bin_array = [1 - bit for bit in bin_array]
-        carry = 1
-        for i in range(size - 1, -1, -1):
-            if bin_array[i] == 0 and carry == 1:
-                bin_array[i] = 1
-                carry = 0
-            elif bin_array[i] == 1 and carry == 1:
-                bin_array[i] = 0
-                carry = 1
-        return bin_array
+        # ensures two's complement (negation modulo 2 ** size)
+        return _int_to_bits(-_bits_to_int(bin_array) & ((1 << size) - 1), size)
 
     def convert_bin_to_dec(self, bin_array):
         # converts binary array (two's complement) to decimal
-        if len(bin_array) == 0:
-            return 0
-        is_negative = bin_array[0] == 1
-        if is_negative:
-            # two's complement negative
-            bin_copy = self.twos_complement(bin_array[:], len(bin_array))
-            value = -sum(bin_copy[i] * (2 ** (len(bin_copy) - i - 1)) for i in range(len(bin_copy)))
-        else:
-            value = sum(bin_array[i] * (2 ** (len(bin_array) - i - 1)) for i in range(len(bin_array)))
-        return value
+        return _to_signed(_bits_to_int(bin_array), len(bin_array))
 
     def convert_string_to_bin(self, string):
         # converts string to binary array (8 bits per char)
-        bin_array = []
-        for char in string:
-            bin_array.extend([int(bit) for bit in format(ord(char), '08b')])
-        return bin_array
+        return _int_to_bits(*_string_to_int(string))
 
     def convert_bin_to_string(self, bin_array):
-        # converts binary array to string (8 bits per char)
-        chars = []
-        for i in range(0, len(bin_array), 8):
-            byte = bin_array[i:i+8]
-            byte_val = int(''.join(map(str, byte)), 2)
-            chars.append(chr(byte_val))
-        return ''.join(chars)
+        # converts binary array to string (8 bits per char, a short last chunk is a char too)
+        return _int_to_bytes(_bits_to_int(bin_array), len(bin_array)).decode("latin-1")
 
     def read(self, position, length):
         # read data from memory
-        self.check_permissions(position, length, for_write=False)
-        data = []
-        for i in range(length):
-            data.append(self.memory[position + i])
-        return data
+        return _int_to_bits(self._read_value(position, length), length)
+
+    def _read_value(self, position, length):
+        # unsigned value of a range, with the writes of an open transaction over it
+        with self._guard(position, length):
+            self.check_permissions(position, length, for_write=False)
+            value = self._get_int(self.memory, position, length)
+        transaction = self._transaction()
+        return value if transaction is None else transaction.overlay(position, length, value)
+
+    def _read_ring(self, position, length):
+        # _read_value of a variable's range: one rotated across the end of the address space
+        # continues at 0, its two pieces are read under one guard
+        pieces = _wrap(position, length, self.size)
+        if len(pieces) < 2:
+            return self._read_value(position, length)
+        (high, high_length), (low, low_length) = pieces
+        with self._guard_ranges(pieces):
+            return (self._read_value(high, high_length) << low_length) | self._read_value(low, low_length)
+
+    def _write_ring(self, position, length, value):
+        # _write_value of a variable's range (values that don't fit wrap around like write_int),
+        # both pieces are checked before either is written so a denied one leaves the other alone
+        value &= (1 << length) - 1
+        pieces = _wrap(position, length, self.size)
+        if len(pieces) < 2:
+            self._write_value(position, length, value)
+            return
+        (high, high_length), (low, low_length) = pieces
+        with self._guard_ranges(pieces):
+            if self._transaction() is None:
+                self.check_permissions(high, high_length, for_write=True)
+                self.check_permissions(low, low_length, for_write=True)
+            self._write_value(high, high_length, value >> low_length)
+            self._write_value(low, low_length, value & ((1 << low_length) - 1))
+
+    def read_bytes(self, position, nbytes):
+        # read nbytes starting at a bit position, one permission check for the whole range
+        if self._transaction() is not None:
+            return self._read_value(position, nbytes * 8).to_bytes(nbytes, "big")
+        with self._guard(position, nbytes * 8):
+            self.check_permissions(position, nbytes * 8, for_write=False)
+            spans = _spans(position, nbytes * 8, self.base, self.size)
+            if len(spans) == 1:
+                return self.memory.get_bytes(spans[0][0], nbytes)
+            return self._get_int(self.memory, position, nbytes * 8).to_bytes(nbytes, "big")
+
+    def write_bytes(self, position, buffer):
+        # write any bytes-like object (bytes, bytearray, memoryview, numpy array...)
+        # permissions, clones and usage are handled once for the whole range
+        data = memoryview(buffer).cast("B")
+        length = len(data) * 8
+        transaction = self._transaction()
+        if transaction is not None:
+            transaction.write(position, length, int.from_bytes(data, "big"))
+            return len(data)
+        with self._guard(position, length):
+            self.check_permissions(position, length, for_write=True)
+            spans = _spans(position, length, self.base, self.size)
+            if len(spans) == 1:
+                for plane in self._planes():
+                    plane.set_bytes(spans[0][0], data)
+            else:
+                value = int.from_bytes(data, "big")
+                for plane in self._planes():
+                    self._set_int(plane, position, length, value)
+            self._encode(position, length)
+            self._mark_used(position, length)
+            return len(data)
+
+    def view(self, position=0, nbytes=None):
+        # zero copy, read-only memoryview of a byte aligned region of the main memory
+        # read-only because writing through it would skip the clones and usage tracking
+        if position % 8 != 0:
+            raise Exception("view must start on a byte boundary.")
+        if self.sparse:
+            raise Exception("a sparse ram has no contiguous memory to view.")
+        if nbytes is None:
+            nbytes = (self.size - position) // 8
+        self.check_permissions(position, nbytes * 8, for_write=False)
+        spans = _spans(position, nbytes * 8, self.base, self.size) or ((position, 0),)
+        if len(spans) > 1 or spans[0][0] % 8 != 0:
+            # a rotated ram only has zero copy views where the bytes are physically in one piece
+            raise Exception("region is not contiguous in the rotated memory, call materialize() first.")
+        start = spans[0][0] // 8
+        return memoryview(self.memory.buffer)[start:start + nbytes].toreadonly()
+
+    def __buffer__(self, flags):
+        # buffer protocol (python 3.12+), memoryview(ram) is the whole memory read-only
+        return self.view()
 
     def read_int(self, position, length):
-        # read an integer from memory
-        data = self.read(position, length)
-        return self.convert_bin_to_dec(data)
+        # read a two's complement integer straight from the packed bits
+        return _to_signed(self._read_value(position, length), length)
 
     def free(self, position, length):
         # free memory
-        self.check_permissions(position, length, for_write=True)
-        for i in range(length):
-            self.memory[position + i] = 0
-            self.memory_clone_a[position + i] = 0
-            self.memory_clone_b[position + i] = 0
-            self.is_used[position + i] = False
-            self.permissions[position + i] = (True, True)
+        if self._transaction() is not None:
+            raise Exception("free can't be used inside a transaction.")
+        with self._guard(position, length):
+            self.check_permissions(position, length, for_write=True)
+            for plane in self._planes():
+                self._fill(plane, position, length, 0)
+            self._encode(position, length)
+            self._mark_free(position, length)
+            self.set_permissions(position, length, True, True)
 
     def set(self, position, data):
         # set a single bit, with permissions check
-        self.check_permissions(position, 1, for_write=True)
-        self.memory[position] = data
-        self.memory_clone_a[position] = data
-        self.memory_clone_b[position] = data
+        transaction = self._transaction()
+        if transaction is not None:
+            transaction.write(position, 1, 1 if data else 0, mark=False)
+            return
+        with self._guard(position, 1):
+            self.check_permissions(position, 1, for_write=True)
+            index = self._index(position)
+            for plane in self._planes():
+                plane[index] = data
+            self._encode(position, 1)
+            self._touch(position, 1)
 
     def get(self, position):
         # get a single bit
-        self.check_permissions(position, 1, for_write=False)
-        return self.memory[position]
+        if self._transaction() is not None:
+            return self._read_value(position, 1)
+        with self._guard(position, 1):
+            self.check_permissions(position, 1, for_write=False)
+            return self.memory[self._index(position)]
 
     def reverse(self, position):
         # flip a single bit
-        self.check_permissions(position, 1, for_write=True)
-        self.memory[position] = 1 - self.memory[position]
-        self.memory_clone_a[position] = 1 - self.memory_clone_a[position]
-        self.memory_clone_b[position] = 1 - self.memory_clone_b[position]
+        transaction = self._transaction()
+        if transaction is not None:
+            transaction.write(position, 1, 1 - transaction.overlay(position, 1, self.memory[self._index(position)]),
+                              mark=False)
+            return
+        with self._guard(position, 1):
+            self.check_permissions(position, 1, for_write=True)
+            index = self._index(position)
+            for plane in self._planes():
+                plane[index] = 1 - plane[index]
+            self._encode(position, 1)
+            self._touch(position, 1)
+
+    @property
+    def sparse(self):
+        return isinstance(self.memory, SparseBitArray)
+
+    @contextmanager
+    def _dense(self, planes, everything=False, write=True):
+        # the engines work on whole packed planes. a sparse ram hands them dense copies of the
+        # pages any of the planes has materialized (the others are zero in every plane, and
+        # mixing zeros gives zeros), or of every page when everything is set, and writes
+        # them back. yields (planes, pages), pages is None for a dense ram
+        if not self.sparse:
+            yield planes, None
+            return
+        if everything:
+            pages = range(-(-self.size // self.memory.page_size))
+        else:
+            pages = sorted(set().union(*(plane.buffer.pages for plane in planes)))
+        dense = [plane.gather(pages) for plane in planes]
+        yield dense, pages
+        if write:
+            for plane, copy in zip(planes, dense):
+                plane.scatter(pages, copy)
+
+    def _planes(self):
+        # the planes every write goes to
+        if self.redundancy == "tmr":
+            return (self.memory, self.memory_clone_a, self.memory_clone_b)
+        return (self.memory,)
+
+    def _plane_names(self):
+        # every plane of the current redundancy mode, in snapshot order
+        return _REDUNDANCY_PLANES[self.redundancy] + ("is_used",)
+
+    def _word(self, index):
+        # physical 64 bit word of the main memory, zero padded past the end
+        start = index * 64
+        length = min(64, self.size - start)
+        return self.memory.get_int(start, length) << (64 - length)
 
+    def _encode(self, position, length):
+        # refresh the check bits of every word a logical range touches
+        code = _WORD_CODES.get(self.redundancy)
+        if code is None:
+            return
+        for start, span in _spans(position, length, self.base, self.size):
+            self._encode_physical(start, span)
+
+    def _encode_physical(self, start, length):
+        code = _WORD_CODES.get(self.redundancy)
+        if code is None:
+            return
+        for index in range(start // 64, (start + length - 1) // 64 + 1):
+            self.check_bits.set_int(index * code.width, code.width, code.encode(self._word(index)))
+
+    def _encode_all(self):
+        code = _WORD_CODES.get(self.redundancy)
+        if code is None:
+            return
+        codes, words = self._codes(code)
+        for first, count, offset in words:
+            self._store_checks(codes[offset:offset + count], code, first)
+
+    def _codes(self, code):
+        # (fresh check values of the words that can be non zero, [(first word, words, offset)])
+        # that is every word of a dense ram, and the words of the pages a sparse ram has
+        # materialized in the memory or the check bits (a zero word has zero check bits)
+        if not self.sparse:
+            return self.engine.encode(self.memory, code.tables), [(0, -(-self.size // 64), 0)]
+        page_size = self.memory.page_size
+        per_page = page_size // 64
+        pages = set(self.memory.buffer.pages)
+        for page in self.check_bits.buffer.pages:
+            first = page * self.check_bits.page_size // code.width // per_page
+            pages.update(range(first, first + self.check_bits.page_size // code.width // per_page))
+        pages = sorted(page for page in pages if page * page_size < self.size)
+        words, offset = [], 0
+        for page in pages:
+            count = -(-min(page_size, self.size - page * page_size) // 64)
+            words.append((page * per_page, count, offset))
+            offset += count
+        return self.engine.encode(self.memory.gather(pages), code.tables), words
+
+    def _store_checks(self, codes, code, first=0):
+        # check values (one byte per word) of the words from first on
+        if code.width == 8:
+            self.check_bits.set_bytes(first * 8, codes)
+        elif codes:
+            self.check_bits.set_int(first, len(codes), int(codes.translate(_BITS_TO_TEXT), 2))
+
+    def _stored_checks(self, code, first=0, count=None):
+        # the stored check values, one byte per word like engine.encode returns them
+        if count is None:
+            count = len(self.check_bits) // code.width - first
+        if code.width == 8:
+            return self.check_bits.get_bytes(first * 8, count)
+        return self.check_bits.to_text(first, count).encode().translate(_TEXT_TO_BITS)
+
+    def _scrub_words(self, indexes):
+        # repair the given physical words from their check bits,
+        # returns (data bits corrected, indexes of words that could not be repaired)
+        code = _WORD_CODES[self.redundancy]
+        corrected, failed = 0, []
+        for index in indexes:
+            word = self._word(index)
+            check = self.check_bits.get_int(index * code.width, code.width)
+            repaired = code.repair(word, check)
+            if repaired is None:
+                failed.append(index)
+                continue
+            new_word, new_check, fixed = repaired
+            length = min(64, self.size - index * 64)
+            if new_word != word:
+                self.memory.set_int(index * 64, length, new_word >> (64 - length))
+            if new_check != check:
+                self.check_bits.set_int(index * code.width, code.width, new_check)
+            if new_word != word or new_check != check:
+                self._touch_physical(index * 64, length, scrubbed=True)
+            corrected += fixed
+        return corrected, failed
+
+    def _scrub_range(self, start, length):
+        # check and repair the physical bits [start, start + length) against the redundancy,
+        # returns (bits corrected, indexes of the words that could not be repaired)
+        # unlike correct(), tmr repairs the clones too so damage can't pile up in them
+        if self.redundancy == "tmr":
+            planes = self._planes()
+            m, a, b = (plane.get_int(start, length) for plane in planes)
+            vote = (m & a) | (m & b) | (a & b)
+            corrected = bin((m ^ vote) | (a ^ vote) | (b ^ vote)).count("1")
+            if corrected:
+                for plane in planes:
+                    plane.set_int(start, length, vote)
+                self._touch_physical(start, length, scrubbed=True)
+            return corrected, []
+        code = _WORD_CODES.get(self.redundancy)
+        if code is None:
+            return 0, []
+        first, last = start // 64, -(-(start + length) // 64)
+        begin, end = first * 64, min(last * 64, self.size)
+        words = BitArray(end - begin, bytearray(self.memory.buffer[begin // 8:(end + 7) // 8]))
+        stored = self._stored_checks(code, first, last - first)
+        bad = self.engine.mismatches(self.engine.encode(words, code.tables), stored)
+        return self._scrub_words([first + index for index in bad])
+
+    def _bad_words(self):
+        # physical words whose check bits don't match their data
+        code = _WORD_CODES[self.redundancy]
+        codes, words = self._codes(code)
+        stored = b"".join(self._stored_checks(code, first, count) for first, count, _ in words)
+        bad = self.engine.mismatches(codes, stored)
+        if not self.sparse:
+            return bad
+        # back from positions in the gathered words to word indexes
+        offsets = [offset for _, _, offset in words]
+        found = []
+        for index in bad:
+            first, _, offset = words[bisect_right(offsets, index) - 1]
+            found.append(first + index - offset)
+        return found
+
+    def _check_used_writable(self):
+        # used bits must all be writable, checked per read-only region instead of per bit
+        for start, length, _, write in self.permissions.physical_regions():
+            if not write and self.is_used.count(start, length):
+                position = (next(self.is_used.runs(1, start, length))[0] - self.base) % self.size
+                raise Exception("write permission denied at position {}".format(position))
+
+    @_whole_memory
     def reverse_all(self):
         # flip all used bits
-        for i in range(self.size):
-            if self.is_used[i]:
-                self.check_permissions(i, 1, for_write=True)
-                self.memory[i] = 1 - self.memory[i]
-                self.memory_clone_a[i] = 1 - self.memory_clone_a[i]
-                self.memory_clone_b[i] = 1 - self.memory_clone_b[i]
+        self._check_used_writable()
+        with self._dense(self._planes() + (self.is_used,)) as (planes, _):
+            self.engine.flip(planes[:-1], planes[-1])
+        self._encode_all()
+        self._touch_all()
 
     def __str__(self):
         # returns a string of bits
-        return "".join(map(str, self.memory))
+        return self._text(0, self.size)
 
+    @_whole_memory
     def rotate_right(self, how_many):
-        # circular shift to the right
-        how_many = how_many % self.size
-        last_bits = self.memory[-how_many:]
-        self.memory = last_bits + self.memory[:-how_many]
-        self.memory_clone_a = last_bits + self.memory_clone_a[:-how_many]
-        self.memory_clone_b = last_bits + self.memory_clone_b[:-how_many]
+        # circular shift to the right of the whole address space: memory, clones, usage,
+        # permissions and variables all move together, nothing is copied, only base changes
+        self._set_base((self.base - how_many) % self.size)
 
     def rotate_left(self, how_many):
         # circular shift to the left
-        how_many = how_many % self.size
-        first_bits = self.memory[:how_many]
-        self.memory = self.memory[how_many:] + first_bits
-        self.memory_clone_a = self.memory_clone_a[how_many:] + first_bits
-        self.memory_clone_b = self.memory_clone_b[how_many:] + first_bits
+        self.rotate_right(-how_many)
+
+    @_whole_memory
+    def materialize(self):
+        # physically rotate the planes so logical and physical addresses match again (base 0),
+        # for raw access to the planes, zero copy views and the fast allocator lookups
+        if not self.base:
+            return
+        base = self.base
+        # the check bits are per physical word, fix what they can before they are rebuilt
+        self.correct()
+        for plane in self._planes() + (self.is_used,):
+            plane.rotate_left(base)
+        self._encode_all()
+        regions = list(self.permissions.regions())
+        free = self.allocator.extents()
+        variables = dict(self.variables.items())
+        self._set_base(0)
+        self.permissions = PermissionMap(self.size)
+        for start, length, read, write in regions:
+            self.permissions.set(start, length, read, write)
+        self.allocator.set_extents(free)
+        self.variables.update(variables)
+        self._touch_all()
 
     def to_string(self):
         # convert all the memory from binary to string (only makes sense if divisible by 8)
-        return self.convert_bin_to_string(self.memory)
+        return "".join(data.decode("latin-1") for data in self.iter_bytes())
 
     def new_variable(self, name, size, initial_value=0, var_type="int", alignment=1):
         # create a new variable of given size (in bits)
         # if alignment > 1, try to align
         aligned_pos = self.allocate_aligned(size, alignment)
-        self.variables[name] = (aligned_pos, size)
-        bin_value = self.convert_dec_to_bin(initial_value, size)
-        self.write(aligned_pos, bin_value)
-        self.variable_metadata[name] = {
-            "type": var_type,
-            "alignment": alignment
-        }
+        self.write_int(aligned_pos, size, initial_value)
+        self._register(name, aligned_pos, size, var_type, alignment)
+
+    def _register(self, name, position, size, var_type, alignment, **details):
+        # variables are metadata: registered under the metadata lock, after their value is written
+        # details: what else their type needs (element size of an array, fields of a struct)
+        transaction = self._transaction()
+        if transaction is not None:
+            previous = (self.variables.physical.get(name), self.variable_metadata.get(name))
+            transaction.undo.append(lambda: self._unregister(name, *previous))
+        with self._meta:
+            self.variables[name] = (position, size)
+            self.variable_metadata[name] = {
+                "type": var_type,
+                "alignment": alignment,
+                **details
+            }
+
+    def _unregister(self, name, physical, metadata):
+        # put back what a variable name held before a transaction that rolled back
+        with self._meta:
+            if physical is None:
+                self.variables.physical.pop(name, None)
+                self.variable_metadata.pop(name, None)
+            else:
+                self.variables.physical[name] = physical
+                self.variable_metadata[name] = metadata
 
     def allocate_aligned(self, size, alignment):
         # allocate memory aligned to a certain boundary
-        # tries to find a chunk starting at a multiple of alignment
-        for pos in range(0, self.size - size + 1, alignment):
-            if all(not self.is_used[pos + i] for i in range(size)):
-                for i in range(size):
-                    self.is_used[pos + i] = True
-                return pos
-        raise Exception("not enough aligned memory.")
+        # first free chunk starting at a multiple of alignment
+        return self._claim(lambda: self.allocator.first_fit(size, alignment), size, "not enough aligned memory.")
 
     def new_variable_left(self, name, size, initial_value=0, var_type="int", alignment=1):
         # aligned, from the left side
         # basically the same as allocate_left but with alignment
-        for pos in range(0, self.size - size + 1, alignment):
-            if all(not self.is_used[pos + i] for i in range(size)):
-                for i in range(size):
-                    self.is_used[pos + i] = True
-                self.variables[name] = (pos, size)
-                bin_value = self.convert_dec_to_bin(initial_value, size)
-                self.write(pos, bin_value)
-                self.variable_metadata[name] = {
-                    "type": var_type,
-                    "alignment": alignment
-                }
-                return
-        raise Exception("not enough memory.")
+        pos = self._claim(lambda: self.allocator.first_fit(size, alignment), size)
+        self.write_int(pos, size, initial_value)
+        self._register(name, pos, size, var_type, alignment)
 
     def new_variable_string(self, name, string, alignment=1):
         # create a new string variable
-        bin_value = self.convert_string_to_bin(string)
-        pos = self.allocate_aligned(len(bin_value), alignment)
-        self.variables[name] = (pos, len(bin_value))
-        self.write(pos, bin_value)
-        self.variable_metadata[name] = {
-            "type": "string",
-            "alignment": alignment
-        }
+        value, length = _string_to_int(string)
+        pos = self.allocate_aligned(length, alignment)
+        self._write_value(pos, length, value)
+        self._register(name, pos, length, "string", alignment)
 
     def new_variable_string_left(self, name, string, alignment=1):
         # create a new string variable aligned and from the left
-        bin_value = self.convert_string_to_bin(string)
-        for pos in range(0, self.size - len(bin_value) + 1, alignment):
-            if all(not self.is_used[pos + i] for i in range(len(bin_value))):
-                for i in range(len(bin_value)):
-                    self.is_used[pos + i] = True
-                self.variables[name] = (pos, len(bin_value))
-                self.write(pos, bin_value)
-                self.variable_metadata[name] = {
-                    "type": "string",
-                    "alignment": alignment
-                }
-                return
-        raise Exception("not enough memory.")
+        value, length = _string_to_int(string)
+        pos = self._claim(lambda: self.allocator.first_fit(length, alignment), length)
+        self._write_value(pos, length, value)
+        self._register(name, pos, length, "string", alignment)
 
-    def get_variable(self, name):
-        position, size = self.variables[name]
-        bin_value = self.read(position, size)
-        # if type is int
-        if self.variable_metadata[name]["type"] == "int":
-            return self.convert_bin_to_dec(bin_value)
+    def new_array(self, name, elem_bits, count, signed=True, initial=0, alignment=1):
+        # an array of count elements of elem_bits in one block (see array())
+        # initial: one value for every element, or a list of count values
+        if elem_bits <= 0 or count <= 0:
+            raise Exception("an array needs a positive element size and count.")
+        if isinstance(initial, int):
+            values = [initial] * count
         else:
-            # if it's not int, assume something else
-            return bin_value
+            values = initial.tolist() if hasattr(initial, "tolist") else list(initial)
+        if len(values) != count:
+            raise Exception("initial values don't match the array size.")
+        position = self.allocate_aligned(elem_bits * count, alignment)
+        self._write_value(position, elem_bits * count, _pack(values, elem_bits))
+        self._register(name, position, elem_bits * count, "array", alignment,
+                       elem_bits=elem_bits, count=count, signed=signed)
+
+    def new_struct(self, name, fields, initial=None, alignment=1):
+        # a struct: fields is a list of (field, bits) or (field, bits, signed), laid out in order
+        # in one block (see struct()). fields are unsigned unless signed is given, flags and
+        # bytes are the common case. initial: dict of field values, the others start at 0
+        layout = []
+        for field in fields:
+            field_name, bits, signed = (tuple(field) + (False,))[:3]
+            if bits <= 0:
+                raise Exception("field {!r} needs a positive size.".format(field_name))
+            if any(field_name == other for other, _, _ in layout):
+                raise Exception("duplicate field {!r}.".format(field_name))
+            layout.append([field_name, bits, signed])
+        if not layout:
+            raise Exception("a struct needs at least one field.")
+        size = sum(bits for _, bits, _ in layout)
+        position = self.allocate_aligned(size, alignment)
+        self.write_int(position, size, 0)
+        self._register(name, position, size, "struct", alignment, fields=layout)
+        if initial:
+            self.struct(name).write(initial)
+
+    def array(self, name):
+        # element and slice access to an array variable: ram.array("buf")[10:1000] = values
+        return ArrayView(self, name)
+
+    def struct(self, name):
+        # field access to a struct variable: ram.struct("point")["x"] = 3
+        return StructView(self, name)
+
+    def _read_int_raw(self, start, length):
+        # read_int of a physical range in one piece, no locks, transaction or span translation:
+        # get_variable / set_variable go straight here for an int variable when the ram isn't
+        # concurrent, no transaction is open and stats are off (the general path goes through the
+        # counted check_permissions). a variable cut in two by the end of the planes can't
+        self.permissions._check(start, length, False)
+        return _to_signed(self.memory.get_int(start, length), length)
+
+    def _write_int_raw(self, start, length, value):
+        # write_int of a physical range in one piece, with what _write_value does around it:
+        # clones, check bits, usage and the dirty pages
+        self.permissions._check(start, length, True)
+        value &= (1 << length) - 1
+        for plane in self._planes():
+            plane.set_int(start, length, value)
+        if self.check_bits is not None:
+            self._encode_physical(start, length)
+        if self.is_used.get_int(start, length) != (1 << length) - 1:
+            self.is_used.fill(start, length, 1)
+            self.allocator._reserve(start, length)
+        self._touch_physical(start, length)
+
+    def get_variable(self, name):
+        if not self.concurrent and not self._instrumented and self._local.transaction is None:
+            position, size = self.variables.physical[name]
+            if position + size <= self.size and self.variable_metadata[name]["type"] == "int":
+                return self._read_int_raw(position, size)
+        with self._variable_guard(name):
+            position, size = self.variables[name]
+            var_type = self.variable_metadata[name]["type"]
+            # if type is int
+            if var_type == "int":
+                return _to_signed(self._read_ring(position, size), size)
+            elif var_type == "array":
+                return self.array(name)[:]
+            elif var_type == "struct":
+                return self.struct(name).read()
+            else:
+                # if it's not int, assume something else
+                return _int_to_bits(self._read_ring(position, size), size)
 
     def get_variable_string(self, name):
-        position, size = self.variables[name]
-        bin_value = self.read(position, size)
-        return self.convert_bin_to_string(bin_value)
+        with self._variable_guard(name):
+            position, size = self.variables[name]
+            return _int_to_bytes(self._read_ring(position, size), size).decode("latin-1")
 
     def __getitem__(self, name):
         # get value of variable by name
@@ -293,129 +3461,525 @@ class Ram:
 
     def __iadd__(self, name):
         # increment variable by 1
-        val = self.get_variable(name)
-        self.set_variable(name, val + 1)
+        self.fetch_add(name, 1)
         return self
 
     def __isub__(self, name):
         # decrement variable by 1
-        val = self.get_variable(name)
-        self.set_variable(name, val - 1)
+        self.fetch_add(name, -1)
         return self
 
+    def fetch_add(self, name, delta=1):
+        # atomically add delta to an int variable (wrapping like write_int), returns the old value
+        if not self.concurrent:
+            value = self.get_variable(name)
+            self.set_variable(name, value + delta)
+            return value
+        with self._variable_guard(name):
+            value = self.get_variable(name)
+            self.set_variable(name, value + delta)
+        return value
+
+    def compare_and_swap(self, name, expected, new):
+        # atomically set an int variable to new if it holds expected, returns whether it did
+        with self._variable_guard(name):
+            if self.get_variable(name) != expected:
+                return False
+            self.set_variable(name, new)
+        return True
+
     def set_variable(self, name, value):
         # sets variable's value
-        position, size = self.variables[name]
-        if self.variable_metadata[name]["type"] == "int":
-            bin_value = self.convert_dec_to_bin(value, size)
-            self.write(position, bin_value)
-        else:
-            raise Exception("cannot set non-int variable this way.")
+        if not self.concurrent and not self._instrumented and self._local.transaction is None:
+            position, size = self.variables.physical[name]
+            if position + size <= self.size and self.variable_metadata[name]["type"] == "int":
+                self._write_int_raw(position, size, value)
+                return
+        with self._variable_guard(name):
+            position, size = self.variables[name]
+            var_type = self.variable_metadata[name]["type"]
+            if var_type == "int":
+                self._write_ring(position, size, value)
+            elif var_type == "array":
+                self.array(name)[:] = value
+            elif var_type == "struct":
+                self.struct(name).write(value)
+            else:
+                raise Exception("cannot set non-int variable this way.")
 
     def set_variable_string(self, name, string):
         # sets a string variable
-        position, size = self.variables[name]
-        bin_value = self.convert_string_to_bin(string)
-        if len(bin_value) > size:
-            raise Exception("new string is larger than allocated space.")
-        # pad if smaller
-        bin_value = bin_value + [0]*(size - len(bin_value))
-        self.write(position, bin_value)
+        with self._variable_guard(name):
+            position, size = self.variables[name]
+            value, length = _string_to_int(string)
+            if length > size:
+                raise Exception("new string is larger than allocated space.")
+            # pad if smaller
+            self._write_ring(position, size, value << (size - length))
 
+    @_whole_memory
     def randomize(self):
         # randomize used memory
-        for i in range(self.size):
-            if self.is_used[i]:
-                self.check_permissions(i, 1, for_write=True)
-                val = random.randint(0,1)
-                self.memory[i] = val
-                self.memory_clone_a[i] = val
-                self.memory_clone_b[i] = val
+        self._check_used_writable()
+        with self._dense(self._planes() + (self.is_used,)) as (planes, _):
+            self.engine.randomize(planes[:-1], planes[-1], self.rng)
+        self._encode_all()
+        self._touch_all()
 
+    @_whole_memory
     def randomize_unused(self):
-        # randomize unused memory
-        for i in range(self.size):
-            if not self.is_used[i]:
-                val = random.randint(0,1)
-                self.memory[i] = val
-                self.memory_clone_a[i] = val
-                self.memory_clone_b[i] = val
+        # randomize unused memory (materializes every page of a sparse ram)
+        with self._dense(self._planes() + (self.is_used,), everything=True) as (planes, _):
+            self.engine.randomize(planes[:-1], planes[-1], self.rng, invert=True)
+        self._encode_all()
+        self._touch_all()
 
+    @_whole_memory
     def randomize_all(self):
-        # randomize entire memory
-        for i in range(self.size):
-            val = random.randint(0,1)
-            self.memory[i] = val
-            self.memory_clone_a[i] = val
-            self.memory_clone_b[i] = val
-
-    def save(self, filename):
-        # save all the properties of the ram object to a file
-        # saving entire __dict__
-        with open(filename, "bw") as file:
-            pickle.dump(self.__dict__, file)
-
-    def load(self, filename):
-        # load all the properties of the ram object from a file
-        with open(filename, "br") as file:
-            self.__dict__.update(pickle.load(file))
+        # randomize entire memory (materializes every page of a sparse ram)
+        with self._dense(self._planes(), everything=True) as (planes, _):
+            self.engine.randomize(planes, None, self.rng)
+        self._encode_all()
+        self._touch_all()
 
-    def correct(self):
-        # correct the memory using the two clones
-        for i in range(self.size):
-            if self.memory_clone_a[i] == self.memory_clone_b[i]:
-                self.memory[i] = self.memory_clone_a[i]
+    def _snapshot_metadata(self):
+        # everything except the planes, small enough to keep as json
+        # permissions and pages are run length encoded
+        return {
+            "size": self.size,
+            "page_size": self.page_size,
+            "pages": self.pages.runs(),
+            # physical, like the planes, base says how they are rotated
+            "base": self.base,
+            "permissions": [[length, read, write] for _, length, read, write in self.permissions.physical_regions()],
+            "variables": self.variables.physical,
+            "variable_metadata": self.variable_metadata,
+            "free": self.allocator.physical_extents(),
+            "rng": self.rng.getstate(),
+            "redundancy": self.redundancy,
+            "planes": list(self._plane_names()),
+        }
+
+    def _restore_metadata(self, meta):
+        self.size = meta["size"]
+        self.page_size = meta["page_size"]
+        self.redundancy = meta.get("redundancy", "tmr")
+        self.pages = PageFlags.from_runs(meta["pages"])
+        self.permissions = PermissionMap(self.size)
+        position = 0
+        for length, read, write in meta["permissions"]:
+            self.permissions.set(position, length, read, write)
+            position += length
+        self.variables = VariableTable(self.size)
+        self.variables.physical = {name: tuple(place) for name, place in meta["variables"].items()}
+        self.variable_metadata = meta["variable_metadata"]
+        # the free extents come from the metadata so a mapped usage plane isn't read
+        self.allocator = Allocator(self.size)
+        self.allocator.set_extents(meta["free"])
+        self._set_base(meta.get("base", 0))
+        if "rng" in meta:
+            version, state, gauss = meta["rng"]
+            self.rng.setstate((version, tuple(state), gauss))
+
+    @_whole_memory
+    def save(self, filename, compression=None):
+        # save the ram to a snapshot file: header, json metadata, packed planes, crc32
+        # the planes are streamed in chunks, optionally through zlib or lzma
+        # a sparse ram only stores its materialized pages, listed as byte extents per plane
+        if compression not in _COMPRESSIONS:
+            raise Exception("unknown compression {!r}.".format(compression))
+        meta = self._snapshot_metadata()
+        if self.sparse:
+            meta["sparse"] = {name: _byte_extents(getattr(self, name)) for name in self._plane_names()}
+        meta = json.dumps(meta).encode()
+        compressor = _compressor(compression)
+        with open(filename, "wb") as file:
+            file.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION,
+                                             _COMPRESSIONS.index(compression), len(meta)))
+            file.write(meta)
+            crc = zlib.crc32(meta)
+            for name in self._plane_names():
+                plane = getattr(self, name)
+                data = plane.buffer if self.sparse else memoryview(plane.buffer)
+                for start, nbytes in _byte_extents(plane):
+                    for offset in range(start, start + nbytes, _SNAPSHOT_CHUNK):
+                        chunk = data[offset:min(offset + _SNAPSHOT_CHUNK, start + nbytes)]
+                        crc = zlib.crc32(chunk, crc)
+                        file.write(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                file.write(compressor.flush())
+            file.write(_SNAPSHOT_TRAILER.pack(crc))
+
+    @_whole_memory
+    def load(self, filename, use_mmap=False, verify=True):
+        # load a snapshot written by save
+        # with use_mmap=True an uncompressed snapshot is memory mapped copy-on-write instead of
+        # read, pages come in lazily as they are touched and changes never reach the file
+        # (verify=False skips the crc so nothing has to be read up front)
+        with open(filename, "rb") as file:
+            header = file.read(_SNAPSHOT_HEADER.size)
+            if len(header) < _SNAPSHOT_HEADER.size or header[:6] != _SNAPSHOT_MAGIC:
+                raise Exception("not a ramemu snapshot.")
+            _, version, compression, meta_length = _SNAPSHOT_HEADER.unpack(header)
+            if version > _SNAPSHOT_VERSION:
+                raise Exception("snapshot version {} is not supported.".format(version))
+            compression = _COMPRESSIONS[compression]
+            meta_bytes = file.read(meta_length)
+            if len(meta_bytes) != meta_length:
+                raise Exception("snapshot is truncated.")
+            meta = json.loads(meta_bytes)
+            meta.setdefault("redundancy", "tmr")
+            size = meta["size"]
+            if self._shared and (use_mmap or size != self.size or meta["redundancy"] != self.redundancy):
+                raise Exception("a shared ram only loads snapshots of its size and redundancy, without mmap.")
+            # every plane is size bits except the check bits of the parity and hamming modes
+            sizes = [_check_plane_size(size, meta["redundancy"]) if name == "check_bits" else size
+                     for name in meta["planes"]]
+            crc = zlib.crc32(meta_bytes)
+            extents = meta.get("sparse")
+            if use_mmap:
+                if compression is not None:
+                    raise Exception("only uncompressed snapshots can be memory mapped.")
+                if extents is not None:
+                    raise Exception("sparse snapshots can't be memory mapped.")
+                mapped = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY))
+                offset = _SNAPSHOT_HEADER.size + meta_length
+                planes = {}
+                for name, plane_size in zip(meta["planes"], sizes):
+                    nbytes = (plane_size + 7) // 8
+                    planes[name] = BitArray(plane_size, mapped[offset:offset + nbytes])
+                    offset += nbytes
+                trailer = mapped[offset:offset + _SNAPSHOT_TRAILER.size]
+                if verify:
+                    for name in meta["planes"]:
+                        crc = zlib.crc32(planes[name].buffer, crc)
             else:
-                values = [self.memory[i], self.memory_clone_a[i], self.memory_clone_b[i]]
-                # majority vote
-                self.memory[i] = max(set(values), key=values.count)
+                planes = {name: self.storage.plane(name, plane_size) for name, plane_size in zip(meta["planes"], sizes)}
+                for plane in planes.values():
+                    if isinstance(plane, SparseBitArray) and plane.page_size != meta["page_size"] \
+                            and meta["page_size"] % 64 == 0:
+                        plane.set_page_size(meta["page_size"])
+                # (buffer, first byte, bytes) in the order the data was written
+                targets = [(planes[name].buffer, start, nbytes) for name in meta["planes"]
+                           for start, nbytes in (extents[name] if extents else [(0, len(planes[name].buffer))])]
+                chunks = _snapshot_chunks(file, compression, sum(nbytes for _, _, nbytes in targets))
+                target, filled = 0, 0
+                while True:
+                    try:
+                        chunk = next(chunks)
+                    except StopIteration as done:
+                        trailer = done.value
+                        break
+                    crc = zlib.crc32(chunk, crc)
+                    # spread the chunk over the planes in order
+                    while chunk:
+                        if target == len(targets):
+                            raise Exception("snapshot has more data than its planes.")
+                        buffer, start, nbytes = targets[target]
+                        take = min(len(chunk), nbytes - filled)
+                        buffer[start + filled:start + filled + take] = chunk[:take]
+                        chunk = chunk[take:]
+                        filled += take
+                        if filled == nbytes:
+                            target, filled = target + 1, 0
+                if target != len(targets):
+                    raise Exception("snapshot is truncated.")
+        if verify and (len(trailer) != _SNAPSHOT_TRAILER.size or _SNAPSHOT_TRAILER.unpack(trailer)[0] != crc):
+            raise Exception("snapshot checksum mismatch.")
+        self._restore_metadata(meta)
+        self.memory_clone_a = self.memory_clone_b = self.check_bits = None
+        for name in meta["planes"]:
+            setattr(self, name, planes[name])
+        # checkpoints taken before belong to the old state
+        self.checkpoints = []
+        self._last_checkpoint = None
+        self._touch_all()
+
+    @_whole_memory
+    def checkpoint(self, full=False):
+        # record the current state and return its checkpoint id
+        # only the pages changed since the previous checkpoint are stored (a delta against it),
+        # a full copy is taken for the first one, after whole memory changes or when asked
+        meta = json.loads(json.dumps(self._snapshot_metadata()))
+        if full or self._dirty_all or self._last_checkpoint is None:
+            # a sparse plane is copied as it is, its unmaterialized pages stay unmaterialized
+            planes = {name: getattr(self, name).copy() if self.sparse else getattr(self, name).tobytes()
+                      for name in self._plane_names()}
+            entry = {"parent": None, "meta": meta, "planes": planes}
+        else:
+            pages = {}
+            for page in sorted(self._dirty):
+                start = page * self.page_size
+                length = min(self.page_size, self.size - start)
+                if length > 0:
+                    pages[start] = (length, [getattr(self, name).get_int(plane_start, plane_length)
+                                             for name, plane_start, plane_length in self._page_ranges(start, length)])
+            entry = {"parent": self._last_checkpoint, "meta": meta, "pages": pages}
+        self.checkpoints.append(entry)
+        self._last_checkpoint = len(self.checkpoints) - 1
+        self._dirty.clear()
+        self._dirty_all = False
+        return self._last_checkpoint
+
+    def _page_ranges(self, start, length):
+        # (plane name, start, length) of what a page covers in every plane,
+        # for the check bits that is the check values of the words the page overlaps
+        ranges = []
+        for name in self._plane_names():
+            if name == "check_bits":
+                width = _WORD_CODES[self.redundancy].width
+                first = start // 64 * width
+                ranges.append((name, first, ((start + length - 1) // 64 + 1) * width - first))
+            else:
+                ranges.append((name, start, length))
+        return ranges
+
+    @_whole_memory
+    def restore(self, checkpoint_id):
+        # go back to a checkpoint: copy its base snapshot and replay the deltas leading to it
+        chain = [checkpoint_id]
+        while "planes" not in self.checkpoints[chain[-1]]:
+            chain.append(self.checkpoints[chain[-1]]["parent"])
+        chain.reverse()
+        for name, data in self.checkpoints[chain[0]]["planes"].items():
+            if self.sparse:
+                getattr(self, name).buffer = data.copy().buffer
+            else:
+                getattr(self, name).buffer[:] = data
+        for index in chain[1:]:
+            for start, (length, values) in self.checkpoints[index]["pages"].items():
+                for (name, plane_start, plane_length), value in zip(self._page_ranges(start, length), values):
+                    getattr(self, name).set_int(plane_start, plane_length, value)
+        meta = self.checkpoints[checkpoint_id]["meta"]
+        self._restore_metadata(meta)
+        # new checkpoints are deltas against the restored one
+        self._last_checkpoint = checkpoint_id
+        self._dirty.clear()
+        self._dirty_all = False
+
+    def checkpoint_size(self, checkpoint_id):
+        # bits of plane data stored by a checkpoint
+        entry = self.checkpoints[checkpoint_id]
+        if "planes" in entry:
+            return sum(len(getattr(self, name)) for name in self._plane_names())
+        return sum(plane_length for start, (length, _) in entry["pages"].items()
+                   for _, _, plane_length in self._page_ranges(start, length))
+
+    @_whole_memory
+    def correct(self):
+        # correct the memory using the two clones (bitwise majority vote) under tmr,
+        # or the check bits of every word under hamming (parity and none can't correct)
+        # returns how many bits of the main memory were changed
+        if self.redundancy == "hamming":
+            return self._scrub_words(self._bad_words())[0]
+        if self.redundancy != "tmr":
+            return 0
+        with self._dense(self._planes()) as (planes, _):
+            changed = self.engine.majority(*planes)
+        if changed:
+            self._touch_all()
+        return changed
 
+    @_whole_memory
     def compare_memory(self):
         # compare the memory with the two clones and return the indexes of differences
-        differences = []
-        for i in range(self.size):
-            if (self.memory[i] != self.memory_clone_a[i]) or (self.memory[i] != self.memory_clone_b[i]):
-                differences.append(i)
+        # under parity / hamming: the first bit of every word whose check bits don't match
+        if self.redundancy == "tmr":
+            with self._dense(self._planes(), write=False) as (planes, pages):
+                differences = self.engine.differences(*planes)
+            if pages is not None:
+                page_size = self.memory.page_size
+                differences = [pages[index // page_size] * page_size + index % page_size for index in differences]
+        elif self.redundancy in _WORD_CODES:
+            differences = [index * 64 for index in self._bad_words()]
+        else:
+            differences = []
+        if self.base:
+            return sorted((position - self.base) % self.size for position in differences)
         return differences
 
     def memory_usage(self):
-        # percentage of memory used
-        used_memory = sum(self.is_used)
+        # percentage of memory used, the allocator keeps a running count
+        used_memory = self.size - self.allocator.free_bits
         return (used_memory / self.size) * 100
 
     def dump_memory(self):
         # dump memory in 8-bit chunks
-        return [''.join(map(str, self.memory[i:i+8])) for i in range(0, self.size, 8)]
+        chunks = []
+        for position in range(0, self.size, _DUMP_CHUNK):
+            bits = self._text(position, min(_DUMP_CHUNK, self.size - position))
+            chunks.extend(bits[i:i+8] for i in range(0, len(bits), 8))
+        return chunks
+
+    def _chunks(self, start, end, chunk=_DUMP_CHUNK):
+        # (position, bytes) of the main memory between two bit positions, chunk bits at a time
+        # (a multiple of 8). like hex_dump and to_string always did, a short last byte holds its
+        # bits as a number
+        for position in range(start, end, chunk):
+            length = min(chunk, end - position)
+            with self._guard(position, length):
+                value = self._get_int(self.memory, position, length)
+            yield position, _int_to_bytes(value, length)
+
+    def iter_bytes(self, start=0, end=None):
+        # the main memory from bit start to bit end as a stream of bytes objects, so it can go to
+        # a file or a pipe without ever being in memory whole (no permission checks, like the dumps)
+        if end is None:
+            end = self.size
+        for _, data in self._chunks(start, end):
+            yield data
+
+    def iter_hex_dump(self, start=0, end=None, width=16):
+        # classic hex dump lines, generated a chunk at a time: byte offset, width bytes in hex and
+        # the same bytes as text (a dot where not printable). start is a bit position on a byte
+        # boundary. a sparse ram gets a * line for each run of lines it never wrote to
+        if end is None:
+            end = self.size
+        if start % 8 != 0:
+            raise Exception("hex dump must start on a byte boundary.")
+        if width <= 0:
+            raise Exception("hex dump lines need a positive width.")
+        line = width * 8
+        # the materialized ranges, widened to whole lines counted from start
+        ranges = []
+        for first, last in self._materialized_ranges(start, end, align=8):
+            first = start + (first - start) // line * line
+            last = min(start - (start - last) // line * line, end)
+            if ranges and first <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], last)
+            else:
+                ranges.append([first, last])
+        chunk = max(_DUMP_CHUNK // line, 1) * line
+        position = start
+        for first, last in ranges:
+            if first > position:
+                yield "*"
+            for offset, data in self._chunks(first, last, chunk):
+                for i in range(0, len(data), width):
+                    row = data[i:i + width]
+                    yield "{:08X}  {:<{}}  |{}|".format(offset // 8 + i, row.hex(" ").upper(), width * 3 - 1,
+                                                       row.translate(_PRINTABLE).decode("ascii"))
+            position = last
+        if position < end:
+            yield "*"
 
     def hex_dump(self):
         # hex dump for a more realistic memory inspection
-        output = []
-        for i in range(0, self.size, 8):
-            byte_str = self.memory[i:i+8]
-            byte_val = int(''.join(map(str, byte_str)), 2)
-            output.append('{:02X}'.format(byte_val))
-        return ' '.join(output)
-
-    def defragment(self):
-        # simple defragmentation: push used blocks to the left
-        new_memory = []
-        new_usage = []
-        # extract all used bits
-        for i in range(self.size):
-            if self.is_used[i]:
-                new_memory.append(self.memory[i])
-                new_usage.append(True)
-        # fill the rest with zeros
-        unused_len = self.size - len(new_memory)
-        new_memory.extend([0]*unused_len)
-        new_usage.extend([False]*unused_len)
-        self.memory = new_memory
-        self.memory_clone_a = new_memory[:]
-        self.memory_clone_b = new_memory[:]
-        self.is_used = new_usage
-        # variables need to be relocated if we kept track of addresses
-        # for simplicity, we lose variable info or try re-map them if we had a better map
-        # this is a simplistic approach, so careful with defragmentation usage, 
+        # a sparse ram skips its unmaterialized pages (all zero), a * stands for each skipped run
+        parts = []
+        position = 0
+        for start, end in self._materialized_ranges(0, self.size, align=8):
+            if start > position:
+                parts.append("*")
+            parts.extend(data.hex(" ").upper() for _, data in self._chunks(start, end))
+            position = end
+        if position < self.size:
+            parts.append("*")
+        return ' '.join(parts)
+
+    def _materialized_ranges(self, start, end, margin=0, align=1):
+        # logical [start, end) ranges that can hold anything but zeros: the whole range for a
+        # dense ram, the materialized pages of the main memory for a sparse one, widened by
+        # margin on both sides and out to multiples of align, merged and clipped to the range
+        if not self.sparse:
+            return [(start, end)]
+        ranges = []
+        offset = 0
+        for physical, span in _spans(0, self.size, self.base, self.size):
+            for piece, length, materialized in self.memory.segments(physical, span):
+                if not materialized:
+                    continue
+                first = piece - physical + offset
+                first = max((first - margin) // align * align, start)
+                last = min(-(-(piece - physical + offset + length + margin) // align) * align, end)
+                if first >= last:
+                    continue
+                if ranges and first <= ranges[-1][1]:
+                    ranges[-1] = (ranges[-1][0], max(ranges[-1][1], last))
+                else:
+                    ranges.append((first, last))
+            offset += span
+        return ranges
+
+    @_whole_memory
+    def defragment(self, step_budget=None):
+        # compaction: slide used blocks left into the first hole, one block at a time
+        # variables and permission regions move with their data
+        # step_budget caps the bits moved by one call so a big memory can be compacted
+        # a bit at a time; blocks are only cut between variables, never inside one
+        # returns True once memory is fully compacted
+        # raw positions returned by allocate() are not tracked and move like everything else
+        order = sorted((position, name) for name, (position, _) in self.variables.items())
+        if order and order[-1][0] + self.variables[order[-1][1]][1] > self.size:
+            # a variable rotated across the end of memory can't slide, rotate it back to 0
+            # first (only the base changes, everything else moves with it like in a slide)
+            self.rotate_left(order[-1][0])
+            order = sorted((position, name) for name, (position, _) in self.variables.items())
+        starts = [position for position, _ in order]
+        names = [name for _, name in order]
+        moved = 0
+        while not self.allocator.is_compact():
+            free = self.allocator.logical()
+            hole = free.starts[0]
+            block_start = free.ends[hole]
+            next_hole = bisect_right(free.starts, block_start)
+            block_end = free.starts[next_hole] if next_hole < len(free.starts) else self.size
+            length = block_end - block_start
+            if step_budget is not None and moved + length > step_budget:
+                length = self._defragment_cut(starts, names, block_start, block_end, step_budget - moved)
+                if length == 0:
+                    if moved:
+                        return False
+                    # always make progress, even if the first variable is bigger than the budget
+                    length = self._defragment_cut(starts, names, block_start, block_end, None)
+            self._relocate(block_start, hole, length, starts, names)
+            moved += length
+            if step_budget is not None and moved >= step_budget:
+                break
+        return self.allocator.is_compact()
+
+    def _defragment_cut(self, starts, names, block_start, block_end, budget):
+        # how much of a used block can move without splitting a variable:
+        # the longest such prefix within budget, or the shortest one when budget is None
+        cut = block_start + budget if budget is not None else block_start + 1
+        cut = min(cut, block_end)
+        index = bisect_left(starts, cut) - 1
+        if index >= 0:
+            position, size = self.variables[names[index]]
+            if position < cut < position + size:
+                cut = position if budget is not None else position + size
+        return max(min(cut, block_end), block_start) - block_start
+
+    def _relocate(self, source, target, length, starts, names):
+        # move length used bits from source down to target (target < source), with their
+        # permissions and the variables that start inside them; the vacated bits become free
+        shift = source - target
+        regions = list(self.permissions.regions(source, length))
+        for plane in self._planes():
+            self._set_int(plane, target, length, self._get_int(plane, source, length))
+        for start, region_length, read, write in regions:
+            self.permissions.set(start - shift, region_length, read, write)
+        vacated = max(source, target + length)
+        for plane in self._planes():
+            self._fill(plane, vacated, source + length - vacated, 0)
+        self._encode(target, source + length - target)
+        self.permissions.set(vacated, source + length - vacated, True, True)
+        self._mark_used(target, length)
+        self._mark_free(vacated, source + length - vacated)
+        # the variable order never changes (blocks only slide into the hole before them)
+        first = bisect_left(starts, source)
+        last = bisect_left(starts, source + length)
+        for index in range(first, last):
+            starts[index] -= shift
+            self.variables[names[index]] = (starts[index], self.variables[names[index]][1])
+
+    @_whole_memory
+    def fragmentation(self):
+        # 0.0 when the free space is one hole, close to 1.0 when it is scattered in tiny holes
+        # (1 - largest free extent / total free space)
+        if self.allocator.free_bits == 0:
+            return 0.0
+        return 1 - self.allocator.largest() / self.allocator.free_bits
 
     def where(self, name):
         # convert to hex
@@ -424,22 +3988,51 @@ class Ram:
     def size_of(self, name):
         return self.variables[name][1]
 
-    def scan_for_pattern(self, pattern):
-        # scan memory for a given bit pattern (list of bits)
-        # returns all starting indexes where pattern is found
-        matches = []
-        plen = len(pattern)
-        for i in range(self.size - plen + 1):
-            if self.memory[i:i+plen] == pattern:
-                matches.append(i)
+    def scan_for_pattern(self, pattern, start=0, end=None, max_matches=None):
+        # scan memory for a given bit pattern (list of bits or '0'/'1' string)
+        # returns all starting indexes where pattern is found inside [start, end)
+        return list(self.iter_pattern(pattern, start, end, max_matches))
+
+    def iter_pattern(self, pattern, start=0, end=None, max_matches=None):
+        # same as scan_for_pattern but yields the matches lazily
+        matches = (position for position, _ in self.iter_patterns([pattern], start, end))
+        return islice(matches, max_matches)
+
+    def iter_patterns(self, patterns, start=0, end=None, max_matches=None):
+        # search several patterns in one pass, yields (position, pattern index) in position order
+        if end is None:
+            end = self.size
+        texts = [_pattern_text(pattern) for pattern in patterns]
+        if not texts:
+            return iter(())
+        if self.sparse and all("1" in text for text in texts):
+            # every match has a 1 in it, so it overlaps a materialized page: only the
+            # materialized pages are searched (with the pattern length around them)
+            ranges = self._materialized_ranges(start, end, margin=max(map(len, texts)) - 1)
+            return islice(chain.from_iterable(_search(self._text, texts, first, last) for first, last in ranges),
+                          max_matches)
+        return islice(_search(self._text, texts, start, end), max_matches)
+
+    def scan_for_patterns(self, patterns, start=0, end=None, max_matches=None):
+        # multi pattern scan, returns one list of positions per pattern
+        matches = [[] for _ in patterns]
+        for position, index in self.iter_patterns(patterns, start, end, max_matches):
+            matches[index].append(position)
         return matches
 
+    @_whole_memory
     def set_page_size(self, new_size):
         # set a new page size, re-initialize pages
         if self.size % new_size != 0:
             raise Exception("page size must evenly divide total memory size.")
+        if self.sparse:
+            # the sparse planes are paged with it
+            for name in self._plane_names():
+                getattr(self, name).set_page_size(new_size)
         self.page_size = new_size
-        self.pages = [False] * (self.size // self.page_size)
+        self.pages = PageFlags(self.size // self.page_size)
+        # dirty page numbers mean something else now
+        self._touch_all()
 
     def page_number(self, address):
         # get page number for a given address
@@ -0,0 +1,1272 @@
+# regression tests for ramemu, run with python -m pytest
+# (test.py is the interactive demo, these don't ask for anything)
+import random
+from contextlib import nullcontext
+
+import pytest
+
+import ramemu
+from ramemu import BitArray, Ram
+
+
+# packed planes
+
+
+def test_bit_array_behaves_like_a_list_of_bits():
+    rng = random.Random(1)
+    bits = [rng.randint(0, 1) for _ in range(77)]
+    array = BitArray(77)
+    array[:] = bits
+    assert list(array) == bits and array == bits
+    assert len(array.buffer) == 10
+    assert array[5] == bits[5] and array[-1] == bits[-1]
+    assert array[3:40] == bits[3:40] and array[1:60:7] == bits[1:60:7]
+    array[2:30:3] = [1] * 10
+    bits[2:30:3] = [1] * 10
+    assert array == bits
+    assert array.count() == sum(bits)
+    with pytest.raises(IndexError):
+        array[77]
+    with pytest.raises(ValueError):
+        array[0:4] = [1]
+
+
+def test_bit_array_int_access_across_byte_boundaries():
+    rng = random.Random(2)
+    array = BitArray(200)
+    bits = [0] * 200
+    for _ in range(300):
+        position = rng.randrange(200)
+        length = rng.randint(0, 200 - position)
+        value = rng.getrandbits(length) if length else 0
+        array.set_int(position, length, value)
+        bits[position:position + length] = [int(bit) for bit in format(value, "0{}b".format(length))] if length else []
+        assert list(array) == bits
+        assert array.get_int(position, length) == value
+    with pytest.raises(IndexError):
+        array.get_int(190, 11)
+
+
+def test_bit_array_bytes_text_and_runs():
+    array = BitArray(40)
+    array.set_bytes(3, b"\xf0\x0f")
+    assert array.to_text(0, 24) == "000111100000000111100000"
+    assert array.get_bytes(3, 2) == b"\xf0\x0f"
+    assert list(array.runs(1)) == [(3, 4), (15, 4)]
+    array.fill(30, 10, 1)
+    assert list(array.runs(1, 20)) == [(30, 10)]
+    assert array.copy() == array and array.copy().buffer is not array.buffer
+
+
+def test_ram_planes_are_packed_and_kept_in_sync():
+    ram = Ram(1000)
+    for plane in (ram.memory, ram.memory_clone_a, ram.memory_clone_b, ram.is_used):
+        assert isinstance(plane, BitArray) and len(plane.buffer) == 125
+    ram.write(10, [1, 0, 1, 1])
+    assert ram.read(10, 4) == [1, 0, 1, 1]
+    assert ram.memory[10:14] == ram.memory_clone_a[10:14] == ram.memory_clone_b[10:14] == [1, 0, 1, 1]
+    assert ram.is_used[10:14] == [1, 1, 1, 1] and ram.memory_usage() == 0.4
+
+
+# free extent allocator
+
+
+def test_allocator_reserve_splits_and_release_coalesces():
+    allocator = ramemu.Allocator(100)
+    allocator.reserve(10, 5)
+    allocator.reserve(40, 20)
+    assert allocator.extents() == [(0, 10), (15, 25), (60, 40)]
+    assert allocator.free_bits == 75 and allocator.largest() == 40
+    # reserving across extents and already used bits
+    allocator.reserve(5, 50)
+    assert allocator.extents() == [(0, 5), (60, 40)]
+    allocator.release(50, 5)
+    assert allocator.extents() == [(0, 5), (50, 5), (60, 40)]
+    # releasing the gap merges with both neighbours
+    allocator.release(55, 5)
+    assert allocator.extents() == [(0, 5), (50, 50)]
+    allocator.release(0, 100)
+    assert allocator.extents() == [(0, 100)] and allocator.is_compact()
+    assert allocator.sizes == [(100, 0)] and allocator.free_bits == 100
+
+
+def test_allocator_first_and_best_fit():
+    allocator = ramemu.Allocator(100)
+    allocator.reserve(0, 100)
+    allocator.release(10, 30)
+    allocator.release(50, 8)
+    allocator.release(70, 12)
+    assert allocator.first_fit(8) == 10 and allocator.best_fit(8) == 50
+    assert allocator.best_fit(10) == 70 and allocator.first_fit(31) is None
+    assert allocator.first_fit(8, alignment=16) == 16 and allocator.best_fit(8, alignment=16) == 16
+    assert allocator.best_fit(30) == 10 and allocator.best_fit(31) is None
+
+
+def test_allocator_matches_a_bit_by_bit_model():
+    rng = random.Random(3)
+    allocator = ramemu.Allocator(300)
+    used = [0] * 300
+    for _ in range(500):
+        position = rng.randrange(300)
+        length = rng.randint(1, 300 - position)
+        if rng.random() < 0.5:
+            allocator.reserve(position, length)
+            used[position:position + length] = [1] * length
+        else:
+            allocator.release(position, length)
+            used[position:position + length] = [0] * length
+        plane = BitArray(300)
+        plane[:] = used
+        assert allocator.extents() == list(plane.runs(0))
+        assert allocator.free_bits == used.count(0)
+
+
+def test_ram_allocate_left_best_and_free():
+    ram = Ram(256)
+    assert ram.allocate_left(32) == 0 and ram.allocate_left(32) == 32
+    ram.free(0, 32)
+    ram.allocate_left(100)
+    assert ram.allocate_best(10) == 0
+    assert ram.allocator.extents() == [(10, 22), (164, 92)]
+    with pytest.raises(Exception, match="not enough memory."):
+        ram.allocate_left(200)
+
+
+def test_random_fit_only_picks_positions_that_fit():
+    allocator = ramemu.Allocator(100)
+    allocator.reserve(0, 100)
+    allocator.release(10, 5)
+    allocator.release(40, 20)
+    rng = random.Random(4)
+    picks = {allocator.random_fit(8, rng) for _ in range(2000)}
+    # every start that leaves room for 8 bits, and nothing in the 5 bit hole
+    assert picks == set(range(40, 53))
+    assert {allocator.random_fit(8, rng, alignment=4) for _ in range(500)} == {40, 44, 48, 52}
+    assert allocator.random_fit(21, rng) is None
+
+
+def test_allocate_is_seeded_and_only_fails_when_nothing_fits():
+    first, second = Ram(4096, seed=5), Ram(4096, seed=5)
+    assert [first.allocate(64) for _ in range(20)] == [second.allocate(64) for _ in range(20)]
+    ram = Ram(128, seed=6)
+    ram.allocate_left(60)
+    ram.write(100, [1])
+    # only [60, 100) can hold 40 bits, a random allocator with retries would usually miss it
+    assert ram.allocate(40) == 60
+    with pytest.raises(Exception, match="not enough memory."):
+        ram.allocate(28)
+
+
+# permission regions
+
+
+def test_permission_map_splits_and_merges_regions():
+    permissions = ramemu.PermissionMap(100)
+    permissions.set(10, 20, write=False)
+    permissions.set(50, 10, read=False, write=False)
+    assert list(permissions.regions()) == [
+        (0, 10, True, True), (10, 20, True, False), (30, 20, True, True), (50, 10, False, False), (60, 40, True, True)]
+    # overwriting the middle of a region splits it, restoring the flags merges it back
+    permissions.set(15, 5)
+    assert permissions.starts == [0, 10, 15, 20, 30, 50, 60]
+    permissions.set(15, 5, write=False)
+    assert permissions.starts == [0, 10, 30, 50, 60]
+    permissions.set(0, 100)
+    assert permissions.starts == [0] and permissions.flags == [(True, True)]
+    assert permissions[99] == (True, True)
+
+
+def test_permission_map_matches_a_bit_by_bit_model():
+    rng = random.Random(7)
+    permissions = ramemu.PermissionMap(200)
+    model = [(True, True)] * 200
+    for _ in range(300):
+        position = rng.randrange(200)
+        length = rng.randint(1, 200 - position)
+        flags = (rng.random() < 0.5, rng.random() < 0.5)
+        permissions.set(position, length, *flags)
+        model[position:position + length] = [flags] * length
+        assert [permissions[index] for index in range(200)] == model
+        # neighbouring regions never share flags
+        assert all(a != b for a, b in zip(permissions.flags, permissions.flags[1:]))
+
+
+def test_ram_permission_checks_report_the_first_denied_bit():
+    ram = Ram(128)
+    ram.set_permissions(20, 10, write=False)
+    ram.set_permissions(40, 4, read=False)
+    ram.write(0, [1] * 20)
+    with pytest.raises(Exception, match="write permission denied at position 20"):
+        ram.write(10, [1] * 20)
+    with pytest.raises(Exception, match="read permission denied at position 40"):
+        ram.read(30, 20)
+    assert ram.read(20, 10) == [0] * 10
+    assert ram.permissions_at(41) == (False, True)
+
+
+# int variables
+
+
+@pytest.mark.parametrize("size", [1, 7, 8, 16, 33, 64, 1024])
+def test_int_variables_round_trip_as_twos_complement(size):
+    ram = Ram(4096, seed=8)
+    rng = random.Random(size)
+    ram.new_variable("a", size, -1)
+    assert ram["a"] == -1
+    for _ in range(50):
+        value = rng.randrange(-(1 << (size - 1)), 1 << (size - 1)) if size > 1 else rng.choice([0, -1])
+        ram["a"] = value
+        assert ram["a"] == value
+    # values that don't fit wrap around
+    ram["a"] = 1 << size
+    assert ram["a"] == 0
+    ram.set_variable("a", 0)
+    ram += "a"
+    ram += "a"
+    ram -= "a"
+    assert ram["a"] == (1 if size > 1 else -1)
+
+
+def test_int_conversions_match_the_list_based_ones():
+    ram = Ram(8)
+    assert ram.convert_dec_to_bin(5, 8) == [0, 0, 0, 0, 0, 1, 0, 1]
+    assert ram.convert_dec_to_bin(-5, 8) == [1, 1, 1, 1, 1, 0, 1, 1]
+    assert ram.convert_dec_to_bin(300, 4) == [1, 0, 0, 1, 0, 1, 1, 0, 0]
+    assert ram.convert_bin_to_dec([1, 1, 1, 1, 1, 0, 1, 1]) == -5
+    assert ram.twos_complement([0, 0, 0, 0, 0, 1, 0, 1], 8) == [1, 1, 1, 1, 1, 0, 1, 1]
+    assert ram.convert_bin_to_string(ram.convert_string_to_bin("hi")) == "hi"
+
+
+# bulk bytes
+
+
+@pytest.mark.parametrize("position", [0, 8, 3, 13])
+def test_bytes_round_trip_at_any_bit_position(position):
+    ram = Ram(1024)
+    data = bytes(range(40, 90))
+    assert ram.write_bytes(position, data) == 50
+    assert ram.read_bytes(position, 50) == data
+    assert ram.read(position, 8) == [int(bit) for bit in format(40, "08b")]
+    assert ram.memory_clone_b.get_bytes(position, 50) == data
+    assert ram.is_used.count() == 400
+    ram.write_bytes(position, bytearray(b"\xff") + memoryview(b"\x00"))
+    assert ram.read_bytes(position, 2) == b"\xff\x00"
+
+
+def test_view_is_zero_copy_and_read_only():
+    ram = Ram(256)
+    view = ram.view(64, 4)
+    ram.write_bytes(64, b"abcd")
+    assert bytes(view) == b"abcd" and view.readonly
+    with pytest.raises(TypeError):
+        view[0] = 1
+    with pytest.raises(Exception, match="byte boundary"):
+        ram.view(3, 1)
+    ram.set_permissions(80, 8, read=False)
+    with pytest.raises(Exception, match="read permission denied"):
+        ram.view(64, 4)
+
+
+# whole memory engines
+
+ENGINES = [ramemu.PythonEngine()] + ([ramemu.NumpyEngine()] if ramemu.numpy is not None else [])
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda engine: engine.name)
+def test_whole_memory_operations_match_a_bit_by_bit_model(engine):
+    rng = random.Random(9)
+    for seed in range(20):
+        size = rng.randint(1, 300)
+        ram = Ram(size, engine=engine, seed=seed)
+        for _ in range(4):
+            position = rng.randrange(size)
+            ram.write(position, [rng.randint(0, 1) for _ in range(rng.randint(0, size - position))])
+        for plane in (ram.memory, ram.memory_clone_a, ram.memory_clone_b):
+            for _ in range(3):
+                plane[rng.randrange(size)] ^= 1
+        memory, a, b, used = list(ram.memory), list(ram.memory_clone_a), list(ram.memory_clone_b), list(ram.is_used)
+        assert ram.compare_memory() == [i for i in range(size) if memory[i] != a[i] or memory[i] != b[i]]
+        voted = [1 if memory[i] + a[i] + b[i] >= 2 else 0 for i in range(size)]
+        assert ram.correct() == sum(x != y for x, y in zip(memory, voted))
+        # like the list based ram, only the main memory is rewritten
+        assert list(ram.memory) == voted and list(ram.memory_clone_a) == a
+        ram.reverse_all()
+        assert list(ram.memory) == [1 - voted[i] if used[i] else voted[i] for i in range(size)]
+        assert list(ram.memory_clone_a) == [1 - a[i] if used[i] else a[i] for i in range(size)]
+        before = list(ram.memory)
+        ram.randomize()
+        assert all(ram.memory[i] == before[i] for i in range(size) if not used[i])
+        assert all(ram.memory[i] == ram.memory_clone_a[i] == ram.memory_clone_b[i] for i in range(size) if used[i])
+        before = list(ram.memory)
+        ram.randomize_unused()
+        assert all(ram.memory[i] == before[i] for i in range(size) if used[i])
+        # the padding bits of the last byte stay 0
+        ram.randomize_all()
+        assert ram.memory.buffer[-1] & ((1 << (-size % 8)) - 1) == 0
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda engine: engine.name)
+def test_seeded_randomize_is_reproducible(engine):
+    first, second = Ram(1000, seed=1, engine=engine), Ram(1000, seed=1, engine=engine)
+    first.randomize_all()
+    second.randomize_all()
+    assert first.memory == second.memory
+
+
+# pattern search
+
+
+def naive_matches(bits, pattern, start, end):
+    return [i for i in range(start, end - len(pattern) + 1) if bits[i:i + len(pattern)] == pattern]
+
+
+@pytest.mark.parametrize("chunk", [16, 1 << 20])
+def test_pattern_search_finds_overlapping_matches_across_chunks(monkeypatch, chunk):
+    monkeypatch.setattr(ramemu, "_RUN_CHUNK", chunk)
+    rng = random.Random(10)
+    ram = Ram(500)
+    bits = [rng.randint(0, 1) for _ in range(500)]
+    ram.write(0, bits)
+    for pattern in ([1, 1], [1, 0, 1], [0, 0, 0, 1, 1], [1] * 7):
+        assert ram.scan_for_pattern(pattern) == naive_matches(bits, pattern, 0, 500)
+        assert ram.scan_for_pattern("".join(map(str, pattern)), 37, 401) == naive_matches(bits, pattern, 37, 401)
+    assert ram.scan_for_pattern([1, 0, 1], max_matches=3) == naive_matches(bits, [1, 0, 1], 0, 500)[:3]
+    assert ram.scan_for_patterns([[1, 1], [0, 0]], 10, 60) == [
+        naive_matches(bits, [1, 1], 10, 60), naive_matches(bits, [0, 0], 10, 60)]
+    positions = [position for position, _ in ram.iter_patterns([[1, 1], [0, 0]])]
+    assert positions == sorted(positions)
+
+
+def test_pattern_search_is_lazy_and_checks_pattern_strings():
+    ram = Ram(64)
+    matches = ram.iter_pattern([0])
+    assert next(matches) == 0 and next(matches) == 1
+    with pytest.raises(Exception, match="pattern strings may only contain 0 and 1."):
+        ram.scan_for_pattern("012")
+
+
+# snapshots
+
+
+def snapshot_ram():
+    ram = Ram(3000, seed=11)
+    ram.new_variable("a", 32, -7)
+    ram.new_variable_string("s", "hello")
+    ram.set_permissions(2000, 100, write=False)
+    ram.mark_page_used(3)
+    ram.randomize_unused()
+    return ram
+
+
+def assert_same_ram(loaded, ram):
+    assert loaded.memory == ram.memory and loaded.memory_clone_b == ram.memory_clone_b
+    assert loaded.is_used == ram.is_used
+    assert loaded["a"] == -7 and loaded.get_variable_string("s") == "hello"
+    assert list(loaded.permissions.regions()) == list(ram.permissions.regions())
+    assert loaded.allocator.extents() == ram.allocator.extents()
+    assert list(loaded.pages) == list(ram.pages)
+    # the rng state is part of the snapshot, so the next allocation is the same
+    assert loaded.allocate(16) == ram.allocate(16)
+
+
+@pytest.mark.parametrize("compression", [None, "zlib", "lzma"])
+def test_snapshot_round_trip(tmp_path, compression):
+    ram = snapshot_ram()
+    ram.save(tmp_path / "ram.snap", compression=compression)
+    loaded = Ram(8)
+    loaded.load(tmp_path / "ram.snap")
+    assert loaded.size == 3000
+    assert_same_ram(loaded, ram)
+
+
+def test_snapshot_crc_and_truncation_are_detected(tmp_path):
+    ram = snapshot_ram()
+    ram.save(tmp_path / "ram.snap")
+    data = bytearray((tmp_path / "ram.snap").read_bytes())
+    # a bit of the memory plane, right after the header and the metadata
+    meta_length = ramemu._SNAPSHOT_HEADER.unpack_from(data)[3]
+    data[ramemu._SNAPSHOT_HEADER.size + meta_length + 10] ^= 1
+    (tmp_path / "bad.snap").write_bytes(data)
+    with pytest.raises(Exception, match="snapshot checksum mismatch."):
+        Ram(8).load(tmp_path / "bad.snap")
+    # verify=False takes the flipped bit as it is
+    loaded = Ram(8)
+    loaded.load(tmp_path / "bad.snap", verify=False)
+    assert loaded.compare_memory() != []
+    (tmp_path / "short.snap").write_bytes(data[:len(data) // 2])
+    with pytest.raises(Exception, match="snapshot is truncated."):
+        Ram(8).load(tmp_path / "short.snap")
+
+
+def test_snapshot_mmap_is_copy_on_write(tmp_path):
+    ram = snapshot_ram()
+    ram.save(tmp_path / "ram.snap")
+    original = (tmp_path / "ram.snap").read_bytes()
+    loaded = Ram(8)
+    loaded.load(tmp_path / "ram.snap", use_mmap=True)
+    assert_same_ram(loaded, ram)
+    loaded["a"] = 12345
+    assert loaded["a"] == 12345
+    assert (tmp_path / "ram.snap").read_bytes() == original
+    ram.save(tmp_path / "packed.snap", compression="zlib")
+    with pytest.raises(Exception, match="only uncompressed snapshots can be memory mapped."):
+        Ram(8).load(tmp_path / "packed.snap", use_mmap=True)
+
+
+def test_snapshot_older_versions_load_and_pickles_are_refused(tmp_path):
+    ram = snapshot_ram()
+    ram.save(tmp_path / "ram.snap")
+    data = bytearray((tmp_path / "ram.snap").read_bytes())
+    # a version 2 snapshot (before sparse planes) has the same layout, the header isn't in the crc
+    data[6] = 2
+    (tmp_path / "v2.snap").write_bytes(data)
+    loaded = Ram(8)
+    loaded.load(tmp_path / "v2.snap")
+    assert_same_ram(loaded, ram)
+    data[6] = ramemu._SNAPSHOT_VERSION + 1
+    (tmp_path / "future.snap").write_bytes(data)
+    with pytest.raises(Exception, match="is not supported."):
+        Ram(8).load(tmp_path / "future.snap")
+    # the old pickled __dict__ files are not loaded: unpickling could run any code
+    import pickle
+    (tmp_path / "old.pkl").write_bytes(pickle.dumps({"size": 8, "memory": [0] * 8}))
+    with pytest.raises(Exception, match="not a ramemu snapshot."):
+        Ram(8).load(tmp_path / "old.pkl")
+
+
+# checkpoints
+
+
+@pytest.mark.parametrize("redundancy", ["tmr", "hamming"])
+def test_delta_checkpoints_only_store_dirty_pages_and_restore_any_point(redundancy):
+    rng = random.Random(12)
+    ram = Ram(64 * 64, seed=12, redundancy=redundancy)
+    states = []
+    first = ram.checkpoint()
+    states.append((first, ram.memory.copy(), ram.is_used.copy(), dict(ram.variables)))
+    assert ram.checkpoint_size(first) == sum(len(getattr(ram, name)) for name in ram._plane_names())
+    for step in range(6):
+        ram.new_variable("v{}".format(step), 16, step)
+        ram.write_int(rng.randrange(0, 64 * 64 - 8), 8, rng.getrandbits(8))
+        checkpoint = ram.checkpoint()
+        # two writes touch at most four pages
+        assert 0 < ram.checkpoint_size(checkpoint) <= 4 * sum(
+            length for _, _, length in ram._page_ranges(0, 64))
+        states.append((checkpoint, ram.memory.copy(), ram.is_used.copy(), dict(ram.variables)))
+    for checkpoint, memory, used, variables in [states[3], states[-1], states[0], states[5]]:
+        ram.restore(checkpoint)
+        assert ram.memory == memory and ram.is_used == used and dict(ram.variables) == variables
+        assert ram.compare_memory() == []
+    # after a restore new checkpoints are deltas against the restored one
+    ram.restore(states[2][0])
+    ram.write_int(0, 8, 0xAB)
+    later = ram.checkpoint()
+    assert ram.checkpoints[later]["parent"] == states[2][0]
+    ram.restore(states[4][0])
+    ram.restore(later)
+    assert ram.read_int(0, 8) == -0x55 and dict(ram.variables) == states[2][3]
+
+
+def test_whole_memory_changes_take_a_full_checkpoint():
+    ram = Ram(1024, seed=13)
+    ram.checkpoint()
+    ram.randomize_all()
+    assert "planes" in ram.checkpoints[ram.checkpoint()]
+    ram.write(0, [1])
+    assert "pages" in ram.checkpoints[ram.checkpoint()]
+
+
+# defragmentation
+
+
+def fragmented_ram():
+    ram = Ram(2048, seed=14)
+    for index in range(40):
+        ram.new_variable_left("v{}".format(index), 24, index * 1000 - 7)
+    for index in range(0, 40, 3):
+        position, size = ram.variables["v{}".format(index)]
+        ram.free(position, size)
+        del ram.variables["v{}".format(index)]
+    ram.set_permissions(*ram.variables["v10"], write=False)
+    return ram
+
+
+def test_defragment_compacts_and_moves_variables_with_their_permissions():
+    ram = fragmented_ram()
+    values = {name: ram[name] for name in ram.variables}
+    assert ram.fragmentation() > 0
+    assert ram.defragment() is True
+    assert ram.allocator.is_compact() and ram.fragmentation() == 0.0
+    assert {name: ram[name] for name in ram.variables} == values
+    assert sorted(position for position, _ in ram.variables.values()) == list(range(0, 26 * 24, 24))
+    assert ram.permissions_at(ram.variables["v10"][0]) == (True, False)
+    assert list(ram.permissions.regions(26 * 24)) == [(26 * 24, 2048 - 26 * 24, True, True)]
+    # the vacated bits are free and zero
+    assert ram.memory.count(26 * 24) == 0 and ram.compare_memory() == []
+
+
+def test_budgeted_defragment_moves_at_most_the_budget_and_never_splits_variables():
+    ram = fragmented_ram()
+    values = {name: ram[name] for name in ram.variables}
+    calls = 0
+    while True:
+        before = dict(ram.variables)
+        done = ram.defragment(step_budget=50)
+        calls += 1
+        moved = sum(size for name, (position, size) in ram.variables.items() if before[name][0] != position)
+        # a variable is 24 bits, so at most two fit in the budget
+        assert moved <= 48
+        assert {name: ram[name] for name in ram.variables} == values
+        if done:
+            break
+    assert calls > 1 and ram.allocator.is_compact()
+    # a budget smaller than a variable still makes progress
+    ram = fragmented_ram()
+    position = ram.variables["v1"][0]
+    ram.defragment(step_budget=1)
+    assert ram.variables["v1"][0] < position
+
+
+@pytest.mark.parametrize("step_budget", [None, 40])
+def test_defragment_rotates_a_variable_across_the_end_back_to_the_start(step_budget):
+    ram = fragmented_ram()
+    ram.rotate_left(ram.variables["v20"][0] + 10)
+    position, size = ram.variables["v20"]
+    assert position + size > ram.size
+    values = {name: ram[name] for name in ram.variables}
+    while not ram.defragment(step_budget):
+        pass
+    assert ram.allocator.is_compact() and ram.fragmentation() == 0.0
+    assert {name: ram[name] for name in ram.variables} == values
+    assert ram.variables["v20"][0] == 0
+    assert sorted(position for position, _ in ram.variables.values()) == list(range(0, 26 * 24, 24))
+    assert ram.permissions_at(ram.variables["v10"][0]) == (True, False)
+    assert ram.compare_memory() == []
+
+
+# rotation
+
+
+def logical_bits(ram):
+    return ram.read(0, ram.size)
+
+
+def test_rotation_matches_shifting_the_lists_and_wraps_variables():
+    rng = random.Random(15)
+    ram = Ram(200, seed=15)
+    ram.new_variable("a", 40, -123456)
+    ram.write(150, [1, 0, 1, 1, 0, 1])
+    ram.set_permissions(150, 6, write=False)
+    bits = logical_bits(ram)
+    used = ram.is_used.copy()
+    shift = 0
+    for _ in range(20):
+        amount = rng.randrange(-300, 300)
+        ram.rotate_right(amount)
+        shift = (shift + amount) % 200
+        assert logical_bits(ram) == bits[200 - shift:] + bits[:200 - shift]
+        # variables, permissions and the usage move with their bits, even across the end
+        assert ram["a"] == -123456
+        assert ram.permissions_at((150 + shift) % 200) == (True, False)
+        assert ram.allocator.free_bits == 200 - used.count()
+        assert sum(length for _, length in ram.allocator.extents()) == 200 - used.count()
+    ram.rotate_left(shift)
+    assert logical_bits(ram) == bits and ram.variables["a"][0] == 0
+
+
+def test_reads_writes_and_allocation_across_the_wrap_point():
+    ram = Ram(128, seed=16)
+    ram.rotate_right(50)
+    # logical 100..140 crosses the physical end of the planes
+    ram.rotate_left(30)
+    ram.write_int(100, 28, 0x5BCDEF0)
+    assert ram.read_int(100, 28) == 0x5BCDEF0
+    ram.new_variable("b", 64, -2)
+    assert ram["b"] == -2
+    with pytest.raises(Exception, match="write permission denied at position 120"):
+        ram.set_permissions(120, 4, write=False)
+        ram.write(118, [1] * 8)
+    ram.materialize()
+    assert ram.base == 0 and ram.read_int(100, 28) == 0x5BCDEF0 and ram["b"] == -2
+    assert ram.permissions_at(121) == (True, False)
+    assert ram.compare_memory() == []
+
+
+def test_ranges_past_the_last_bit_are_an_index_error_rotated_or_not():
+    ram = Ram(64)
+    for access in (lambda: ram.write(60, [1] * 8), lambda: ram.write(64, [1]), lambda: ram.read(64, 4),
+                   lambda: ram.write_int(-1, 4, 1), lambda: ram.read_bytes(60, 1),
+                   lambda: ram.set_permissions(60, 8, write=False)):
+        with pytest.raises(IndexError):
+            access()
+        ram.rotate_right(10)
+    with pytest.raises(IndexError):
+        with ram.transaction():
+            ram.write(60, [1] * 8)
+    assert ram.memory.count() == 0 and ram.is_used.count() == 0
+    assert list(ram.iter_regions()) == [(0, 64, True, True)]
+    # in range, the translation by base still carries it across the physical end
+    ram.rotate_left(60 - ram.base)
+    ram.write(0, [1] * 8)
+    assert ram.read(0, 8) == [1] * 8 and ram.memory.get_int(60, 4) == 15 and ram.memory.get_int(0, 4) == 15
+
+
+def test_variables_rotated_across_the_end_keep_working():
+    ram = Ram(256, concurrent=True)
+    ram.new_variable("a", 40, -5)
+    ram.new_array("arr", 8, 10, initial=list(range(10)))
+    ram.new_struct("s", [("x", 12, True), ("y", 20)], initial={"x": -3, "y": 7})
+    for name in ("a", "arr", "s"):
+        position, size = ram.variables[name]
+        ram.rotate_left(position + size // 2)
+        assert ram.variables[name][0] + size > ram.size
+        with pytest.raises(IndexError):
+            ram.read(*ram.variables[name])
+        assert ram["a"] == -5 and ram["arr"] == list(range(10)) and ram["s"] == {"x": -3, "y": 7}
+    ram.array("arr")[4:6] = [40, 50]
+    ram.struct("s")["x"] = -1
+    ram["a"] = 123
+    ram += "a"
+    assert ram["arr"][3:7] == [3, 40, 50, 6] and ram["s"]["x"] == -1 and ram["a"] == 124
+    # a denied piece leaves the other one alone
+    ram.rotate_left(ram.variables["a"][0] + 20)
+    ram.set_permissions(0, 20, write=False)
+    with pytest.raises(Exception, match="write permission denied at position 0"):
+        ram["a"] = 0
+    assert ram["a"] == 124 and ram.compare_memory() == []
+
+
+# redundancy modes
+
+
+def test_hamming_secded_corrects_one_and_detects_two_flipped_bits():
+    code = ramemu._WORD_CODES["hamming"]
+    rng = random.Random(17)
+    for _ in range(200):
+        word = rng.getrandbits(64)
+        check = code.encode(word)
+        bit = rng.randrange(64)
+        assert code.repair(word ^ (1 << bit), check) == (word, check, 1)
+        # a flipped check bit is repaired in the check value
+        assert code.repair(word, check ^ (1 << rng.randrange(8))) == (word, check, 0)
+        other = rng.choice([b for b in range(64) if b != bit])
+        assert code.repair(word ^ (1 << bit) ^ (1 << other), check) is None
+        assert code.repair(word ^ (1 << bit), check ^ (1 << rng.randrange(8))) is None
+
+
+@pytest.mark.parametrize("redundancy", ["tmr", "hamming", "parity", "none"])
+def test_redundancy_modes_correct_and_detect_what_they_promise(redundancy):
+    ram = Ram(64 * 20 + 13, seed=18, redundancy=redundancy)
+    ram.randomize_all()
+    ram.write_int(200, 64, -3)
+    clean = ram.memory.copy()
+    assert ram.compare_memory() == []
+    # one flipped bit in word 1 and two in word 5 (the last word is short)
+    for bit in (70, 5 * 64 + 1, 5 * 64 + 40, 20 * 64 + 12):
+        ram.memory[bit] ^= 1
+    assert (ram.memory_clone_a is not None) == (redundancy == "tmr")
+    assert (ram.check_bits is not None) == (redundancy in ("parity", "hamming"))
+    if redundancy == "none":
+        assert ram.compare_memory() == [] and ram.correct() == 0
+    elif redundancy == "tmr":
+        assert ram.compare_memory() == [70, 5 * 64 + 1, 5 * 64 + 40, 20 * 64 + 12]
+        assert ram.correct() == 4 and ram.memory == clean
+    elif redundancy == "parity":
+        # parity sees an odd number of flips per word, nothing else, and repairs nothing
+        assert ram.compare_memory() == [64, 20 * 64]
+        assert ram.correct() == 0
+    else:
+        assert ram.compare_memory() == [64, 5 * 64, 20 * 64]
+        assert ram.correct() == 2
+        assert ram.compare_memory() == [5 * 64]
+        assert ram.memory[70] == clean[70] and ram.memory[5 * 64 + 1] != clean[5 * 64 + 1]
+
+
+# scrubbing and fault injection
+
+
+def test_fault_injector_is_seeded_and_only_touches_the_redundancy_planes():
+    first, second = Ram(4096, redundancy="hamming"), Ram(4096, redundancy="hamming")
+    flips = ramemu.FaultInjector(first, seed=19).flip(50)
+    assert flips == ramemu.FaultInjector(second, seed=19).flip(50)
+    assert {name for name, _ in flips} <= {"memory", "check_bits"}
+    assert first.is_used.count() == 0
+    injector = ramemu.FaultInjector(Ram(4096), rate=100.0, burst_rate=1.0, burst_length=4, seed=20)
+    flipped = injector.advance(10)
+    assert flipped == injector.flipped_bits and 800 < flipped < 1200
+
+
+@pytest.mark.parametrize("redundancy", ["tmr", "hamming"])
+def test_scrubber_repairs_single_faults_and_counts_what_it_cannot(redundancy):
+    ram = Ram(64 * 64, seed=21, redundancy=redundancy)
+    ram.randomize_all()
+    clean = ram.memory.copy()
+    scrubber = ramemu.Scrubber(ram, chunk=512)
+    scrubber.scrub_all()
+    injector = ramemu.FaultInjector(ram, seed=22)
+    # one bit in every fourth word, always in the memory plane
+    for word in range(0, 64, 4):
+        ram.memory[word * 64 + 9] ^= 1
+    assert scrubber.scrub_all() == 16
+    assert ram.memory == clean and ram.compare_memory() == []
+    stats = scrubber.stats()
+    assert stats["scrubbed_bits"] == 2 * 64 * 64 and stats["corrected_bits"] == 16
+    # a stuck-at bit keeps its value through writes until it is unstuck
+    injector.stick(100, 1 - clean[100])
+    ram.write(100, [clean[100]])
+    assert ram.memory[100] == 1 - clean[100]
+    injector.unstick(100)
+    if redundancy == "hamming":
+        ram.memory[300] ^= 1
+        ram.memory[301] ^= 1
+        scrubber.scrub_all()
+        assert scrubber.stats()["uncorrectable_words"] == 1 and scrubber.stats()["damaged_words"] == 1
+        # counted once, not on every pass
+        scrubber.scrub_all()
+        assert scrubber.stats()["uncorrectable_words"] == 1
+
+
+def test_scrubber_steps_through_pending_pages_first():
+    ram = Ram(64 * 64, seed=23)
+    scrubber = ramemu.Scrubber(ram, chunk=128)
+    ram.write_int(64 * 10, 64, -1)
+    ram.write_int(64 * 40, 64, -1)
+    assert scrubber.pending == {10, 40}
+    assert scrubber.step() == 128 and scrubber.pending == set()
+    assert scrubber.step() == 0
+
+
+def test_background_scrubbing_needs_a_concurrent_ram_and_loses_no_writes():
+    import asyncio
+    import sys
+    import threading
+    plain = Ram(4096)
+    with pytest.raises(Exception, match="the scrubber can only run in the background on a concurrent ram."):
+        ramemu.Scrubber(plain).start()
+    with pytest.raises(Exception, match="the scrubber can only run in the background"):
+        asyncio.run(ramemu.Scrubber(plain).run_async())
+    with pytest.raises(Exception, match="the fault injector can only run in the background"):
+        ramemu.FaultInjector(plain).start()
+    # switch threads as often as possible, so a step lands in the middle of writes
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        ram = Ram(64 * 256, seed=24, concurrent=True)
+        scrubber = ramemu.Scrubber(ram, chunk=4096, interval=0)
+        scrubber.start()
+        lost = []
+
+        def work(index):
+            rng = random.Random(index)
+            for _ in range(3000):
+                position = 64 * (64 * index + rng.randrange(63))
+                value = rng.getrandbits(32)
+                ram.write_int(position, 32, value)
+                if ram.read_int(position, 32) & 0xFFFFFFFF != value:
+                    lost.append(position)
+
+        threads = [threading.Thread(target=work, args=(index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        scrubber.stop()
+    finally:
+        sys.setswitchinterval(interval)
+    assert lost == [] and scrubber.stats()["corrected_bits"] == 0 and scrubber.stats()["steps"] > 0
+    assert ram.compare_memory() == []
+
+
+# concurrency
+
+
+def test_fetch_add_and_compare_and_swap_are_atomic_across_threads():
+    import threading
+    ram = Ram(64 * 64, concurrent=True)
+    ram.new_variable("counter", 32, 0)
+    ram.new_variable("owner", 8, 0)
+    wins = []
+
+    def work(index):
+        for _ in range(500):
+            ram.fetch_add("counter", 1)
+        if ram.compare_and_swap("owner", 0, index):
+            wins.append(index)
+        for offset in range(100):
+            ram.write_int(64 * (8 + index) + offset % 32, 8, index)
+
+    threads = [threading.Thread(target=work, args=(index,)) for index in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ram["counter"] == 4000
+    assert len(wins) == 1 and ram["owner"] == wins[0]
+    assert ram.compare_memory() == []
+
+
+@pytest.mark.parametrize("redundancy", ["tmr", "hamming", "none"])
+def test_plain_variable_fast_path_matches_the_locked_path(redundancy):
+    plain, locked = Ram(64 * 16, redundancy=redundancy), Ram(64 * 16, redundancy=redundancy, concurrent=True)
+    for ram in (plain, locked):
+        ram.rotate_right(100)
+        scrubber = ramemu.Scrubber(ram)
+        ram.checkpoint()
+        ram.new_variable("a", 24, 5)
+        ram.new_variable("b", 64, -1)
+        ram.set_permissions(*ram.variables["b"], write=False)
+        ram["a"] = -77
+        ram += "a"
+        assert ram["a"] == -76 and ram.fetch_add("a", 10) == -76
+        with pytest.raises(Exception, match="write permission denied"):
+            ram["b"] = 3
+        assert ram["b"] == -1
+    assert plain.memory == locked.memory and plain.is_used == locked.is_used
+    assert plain.check_bits == locked.check_bits and plain.compare_memory() == []
+    assert plain._dirty == locked._dirty and plain.scrubber.pending == locked.scrubber.pending
+    assert plain.allocator.extents() == locked.allocator.extents()
+
+
+def test_variable_across_the_physical_end_takes_the_general_path():
+    ram = Ram(128)
+    ram.rotate_right(100)
+    ram.allocate_left(90)
+    # logical 90 is physical 118, so the variable is cut in two by the end of the planes
+    ram.new_variable("a", 32, 0)
+    position, size = ram.variables.physical["a"]
+    assert ram.variables["a"][0] == 90 and position + size > ram.size
+    ram["a"] = -123456
+    assert ram["a"] == -123456 and ram.read_int(90, 32) == -123456
+    assert ram.memory.get_int(118, 10) == ram.read_int(90, 10) & 0x3FF
+
+
+# shared memory
+
+
+def shared_worker(name, directory, count):
+    ram = Ram.attach(name, directory=directory)
+    for _ in range(count):
+        ram.fetch_add("counter", 1)
+    ram.new_variable("from_child", 16, 4321)
+    ram.storage.close()
+
+
+@pytest.mark.skipif(ramemu.fcntl is None, reason="shared storage needs fcntl")
+def test_shared_ram_is_seen_and_updated_by_attached_processes(tmp_path):
+    import multiprocessing
+    storage = ramemu.SharedStorage(directory=str(tmp_path))
+    try:
+        ram = Ram(64 * 64, storage=storage, redundancy="hamming")
+        assert ram.concurrent
+        ram.new_variable("counter", 32, 0)
+        ram.write_bytes(512, b"shared")
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=shared_worker, args=(storage.name, str(tmp_path), 200)) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        for _ in range(200):
+            ram.fetch_add("counter", 1)
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+        assert ram["counter"] == 600
+        # metadata made in the other processes (the variables, their allocations) is picked up
+        assert ram["from_child"] == 4321
+        assert ram.allocator.free_bits == 64 * 64 - 32 - 48 - 2 * 16
+        other = Ram.attach(storage.name, directory=str(tmp_path))
+        assert other.redundancy == "hamming" and other.read_bytes(512, 6) == b"shared"
+        assert other.compare_memory() == []
+    finally:
+        storage.close()
+        storage.unlink()
+
+
+@pytest.mark.skipif(ramemu.fcntl is None, reason="shared storage needs fcntl")
+def test_attach_refuses_files_that_are_not_shared_rams(tmp_path):
+    (tmp_path / "junk").write_bytes(bytes(4096))
+    with pytest.raises(Exception, match="not a shared ram."):
+        Ram.attach("junk", directory=str(tmp_path))
+
+
+# sparse planes
+
+
+def test_sparse_ram_only_materializes_what_is_written():
+    size = 1 << 40
+    ram = Ram(size, sparse=True, seed=24)
+    assert ram.sparse and ram.memory.materialized() == []
+    positions = [size // 7 * index for index in range(7)]
+    for index, position in enumerate(positions):
+        ram.write_int(position, 64, index + 1)
+    # writing zeros into an untouched page materializes nothing
+    ram.write_int(size // 2 + 64 * 1000, 64, 0)
+    assert len(ram.memory.materialized()) <= 14
+    assert [ram.read_int(position, 64) for position in positions] == list(range(1, 8))
+    assert ram.read_int(size - 64, 64) == 0
+    assert ram.scan_for_pattern("1" * 3) == [positions[6] + 61]
+    ram.new_variable("a", 32, -5)
+    assert ram["a"] == -5 and ram.compare_memory() == []
+    ram.memory.set_int(positions[3], 64, 0)
+    assert ram.correct() == 1 and ram.read_int(positions[3], 64) == 4
+
+
+def test_sparse_ram_snapshots_and_checkpoints(tmp_path):
+    ram = Ram(1 << 32, sparse=True, redundancy="hamming")
+    ram.write_bytes(1 << 31, b"far away")
+    first = ram.checkpoint()
+    ram.write_bytes(1 << 20, b"later")
+    ram.checkpoint()
+    ram.save(tmp_path / "sparse.snap", compression="zlib")
+    assert (tmp_path / "sparse.snap").stat().st_size < 10000
+    # the storage comes from the ram loading it, a sparse snapshot stays small in a sparse ram
+    loaded = Ram(64, sparse=True)
+    loaded.load(tmp_path / "sparse.snap")
+    assert len(loaded.memory.materialized()) <= 4 and loaded.read_bytes(1 << 20, 5) == b"later"
+    assert loaded.read_bytes(1 << 31, 8) == b"far away" and loaded.compare_memory() == []
+    ram.restore(first)
+    assert ram.read_bytes(1 << 20, 5) == bytes(5) and ram.read_bytes(1 << 31, 8) == b"far away"
+    assert "*" in ram.hex_dump()
+
+
+# virtual memory
+
+
+@pytest.mark.parametrize("policy", ["lru", "clock"])
+def test_virtual_memory_evicts_to_swap_and_faults_back_in(tmp_path, policy):
+    ram = Ram(64 * 32, seed=25)
+    vm = ramemu.VirtualMemory(ram, 1 << 30, frames=4, policy=policy, directory=str(tmp_path))
+    try:
+        rng = random.Random(26)
+        model = {}
+        for _ in range(400):
+            page = rng.randrange(16) if rng.random() < 0.8 else rng.randrange(1 << 24)
+            address = page * 64 + rng.choice([0, 32])
+            if rng.random() < 0.6:
+                value = rng.getrandbits(32) - (1 << 31)
+                vm.write_int(address, 32, value)
+                model[address] = value
+            elif address in model:
+                assert vm.read_int(address, 32) == model[address]
+            assert len(vm.resident()) <= 4
+        for address, value in model.items():
+            assert vm.read_int(address, 32) == value
+        stats = vm.stats()
+        assert stats["faults"] > 4 and stats["evictions"] == stats["faults"] - 4
+        assert stats["swap_outs"] > 0 and stats["swap_ins"] > 0
+        # the frames are an ordinary variable of the ram
+        assert ram.variables["frames"][1] == 4 * 64
+    finally:
+        vm.close()
+
+
+def test_lru_evicts_the_least_recently_used_page_and_clean_pages_skip_swap(tmp_path):
+    vm = ramemu.VirtualMemory(Ram(64 * 8), 64 * 100, frames=2, policy="lru", directory=str(tmp_path))
+    try:
+        vm.write_int(0, 8, 1)
+        vm.write_int(64, 8, 2)
+        vm.read_int(0, 8)
+        vm.read_int(128, 8)
+        assert vm.resident() == [0, 2] and vm.is_resident(vm.page_number(128))
+        assert vm.stats()["swap_outs"] == 1
+        # page 2 was never written: evicting it writes nothing
+        vm.read_int(0, 8)
+        assert vm.read_int(64, 8) == 2 and vm.resident() == [0, 1]
+        assert vm.stats()["swap_outs"] == 1 and vm.stats()["swap_ins"] == 1
+        vm.set_permissions(0, 64, write=False)
+        with pytest.raises(Exception, match="write permission denied at position 0"):
+            vm.write_int(0, 8, 5)
+        with pytest.raises(IndexError):
+            vm.read_int(64 * 100 - 4, 8)
+    finally:
+        vm.close()
+
+
+# transactions
+
+
+def test_transaction_commits_all_writes_at_once_and_reads_see_them():
+    ram = Ram(1024)
+    ram.new_variable("a", 32, 1)
+    ram.new_variable("b", 32, 2)
+    with ram.transaction():
+        ram["a"] = 10
+        ram["b"] = ram["a"] + 5
+        ram.write_bytes(512, b"xy")
+        assert ram["b"] == 15 and ram.read_bytes(512, 2) == b"xy"
+        # nothing reaches the planes before the commit
+        assert ram.memory.get_int(*ram.variables["a"]) == 1 and ram.memory.get_bytes(512, 2) == bytes(2)
+        assert ram.is_used.count(512, 16) == 0
+    assert ram["a"] == 10 and ram["b"] == 15 and ram.read_bytes(512, 2) == b"xy"
+    assert ram.is_used.count(512, 16) == 16 and ram.compare_memory() == []
+
+
+def test_transaction_rolls_back_writes_and_metadata_on_errors():
+    ram = Ram(1024, seed=27)
+    ram.new_variable("a", 32, 1)
+    ram.new_variable("locked", 32, 2)
+    ram.set_permissions(*ram.variables["locked"], write=False)
+    before = (ram.memory.tobytes(), ram.allocator.extents(), dict(ram.variables), list(ram.permissions.regions()))
+    with pytest.raises(Exception, match="write permission denied"):
+        with ram.transaction():
+            ram["a"] = 99
+            ram.new_variable("new", 64, -1)
+            ram.allocate(100)
+            ram.set_permissions(0, 8, read=False)
+            ram["locked"] = 3
+    assert (ram.memory.tobytes(), ram.allocator.extents(), dict(ram.variables), list(ram.permissions.regions())) == before
+    assert "new" not in ram.variable_metadata and ram["a"] == 1
+    with pytest.raises(KeyError):
+        with ram.transaction():
+            ram["a"] = 5
+            raise KeyError("stop")
+    assert ram["a"] == 1
+
+
+def test_nested_transactions_join_and_rollback_empties_the_block():
+    ram = Ram(256)
+    ram.new_variable("a", 16, 0)
+    with ram.transaction() as outer:
+        ram["a"] = 1
+        with ram.transaction() as inner:
+            assert inner is outer
+            ram["a"] = 2
+        assert ram.memory.get_int(*ram.variables["a"]) == 0
+        outer.rollback()
+        assert ram["a"] == 0
+        ram["a"] = 3
+    assert ram["a"] == 3
+    with ram.transaction():
+        with pytest.raises(Exception, match="can't be used inside a transaction."):
+            ram.correct()
+
+
+def test_set_and_reverse_mark_nothing_used_in_a_transaction_either():
+    rng = random.Random(28)
+    for _ in range(100):
+        operations = [(rng.choice(["set", "reverse", "write"]), rng.randrange(60), rng.randint(0, 1), rng.randint(1, 4))
+                      for _ in range(rng.randint(1, 12))]
+        results = []
+        for batched in (False, True):
+            ram = Ram(64)
+            ram.checkpoint()
+            with ram.transaction() if batched else nullcontext():
+                for kind, position, value, length in operations:
+                    if kind == "set":
+                        ram.set(position, value)
+                    elif kind == "reverse":
+                        ram.reverse(position)
+                    else:
+                        ram.write(position, [value] * length)
+            results.append((ram.read(0, 64), list(ram.is_used), ram.allocator.extents(), ram.memory_usage(), ram._dirty))
+        assert results[0] == results[1]
+
+
+# arrays and structs
+
+
+def to_signed(value, bits, signed):
+    value &= (1 << bits) - 1
+    return value - (1 << bits) if signed and value >> (bits - 1) else value
+
+
+@pytest.mark.parametrize("bits", [1, 5, 8, 16, 32, 64, 100])
+@pytest.mark.parametrize("signed", [True, False])
+def test_array_elements_and_slices_match_a_list(bits, signed):
+    rng = random.Random(bits)
+    ram = Ram(64 * 64)
+    initial = [rng.getrandbits(bits) for _ in range(30)]
+    ram.new_array("a", bits, 30, signed=signed, initial=initial)
+    array = ram.array("a")
+    model = [to_signed(value, bits, signed) for value in initial]
+    assert array[:] == model and len(array) == 30 and ram["a"] == model
+    for _ in range(40):
+        start, stop = sorted(rng.sample(range(31), 2))
+        step = rng.choice([1, 1, 2, 3])
+        values = [rng.getrandbits(bits) for _ in range(len(range(start, stop, step)))]
+        array[start:stop:step] = values
+        model[start:stop:step] = [to_signed(value, bits, signed) for value in values]
+        index = rng.randrange(-30, 30)
+        array[index] = -1
+        model[index] = to_signed(-1, bits, signed)
+        assert array[:] == model and array[start:stop:step] == model[start:stop:step] and array[index] == model[index]
+    array[:] = 7
+    assert list(array) == [to_signed(7, bits, signed)] * 30
+    with pytest.raises(IndexError):
+        array[30]
+
+
+def test_struct_fields_default_to_unsigned():
+    ram = Ram(512)
+    ram.new_struct("p", [("flag", 1), ("byte", 8), ("x", 16, True), ("raw", 24, False)], initial={"x": -3})
+    point = ram.struct("p")
+    point["flag"] = 1
+    point["byte"] = 200
+    assert point.read() == {"flag": 1, "byte": 200, "x": -3, "raw": 0}
+    point.write(raw=-1, x=40000)
+    assert point["raw"] == (1 << 24) - 1 and point["x"] == 40000 - (1 << 16)
+    ram["p"] = {"flag": 0, "byte": 1, "x": 2, "raw": 3}
+    assert ram["p"] == {"flag": 0, "byte": 1, "x": 2, "raw": 3}
+    with pytest.raises(Exception, match="struct 'p' has no field 'nope'."):
+        point["nope"]
+    with pytest.raises(Exception, match="duplicate field 'a'."):
+        ram.new_struct("q", [("a", 8), ("a", 8)])
+
+
+def test_views_follow_their_variable_and_keep_signedness_through_snapshots(tmp_path):
+    ram = Ram(1024)
+    ram.new_variable_left("pad", 100, 0)
+    ram.new_array("a", 12, 10, signed=False, initial=list(range(4000, 4010)))
+    ram.new_struct("s", [("b", 8), ("c", 8, True)], initial={"b": 255, "c": -1})
+    position, size = ram.variables["pad"]
+    ram.free(position, size)
+    del ram.variables["pad"]
+    ram.defragment()
+    ram.rotate_right(1000)
+    assert ram.array("a")[:] == list(range(4000, 4010)) and ram.struct("s").read() == {"b": 255, "c": -1}
+    ram.save(tmp_path / "views.snap")
+    loaded = Ram(8)
+    loaded.load(tmp_path / "views.snap")
+    assert loaded["a"] == list(range(4000, 4010)) and loaded["s"] == {"b": 255, "c": -1}
+
+
+# dumps and strings
+
+
+def legacy_dumps(bits):
+    # the list based hex_dump / dump_memory / to_string (a short last chunk is a byte too)
+    chunks = [bits[i:i + 8] for i in range(0, len(bits), 8)]
+    values = [int("".join(map(str, chunk)), 2) for chunk in chunks]
+    return (" ".join("{:02X}".format(value) for value in values), ["".join(map(str, chunk)) for chunk in chunks],
+            "".join(chr(value) for value in values))
+
+
+@pytest.mark.parametrize("size", [8, 300, 4099])
+def test_dumps_match_the_list_based_ones(monkeypatch, size):
+    monkeypatch.setattr(ramemu, "_DUMP_CHUNK", 64)
+    ram = Ram(size, seed=29)
+    ram.randomize_all()
+    hex_dump, dump, string = legacy_dumps(list(ram.memory))
+    assert ram.hex_dump() == hex_dump and ram.dump_memory() == dump and ram.to_string() == string
+    assert b"".join(ram.iter_bytes()) == bytes(int(byte, 2) for byte in dump)
+    lines = list(ram.iter_hex_dump(width=16))
+    assert len(lines) == -(-(-(-size // 8)) // 16)
+    assert lines[0].startswith("00000000  " + hex_dump[:47])
+
+
+def test_hex_dump_lines_and_ranges():
+    ram = Ram(64 * 8)
+    ram.write_bytes(8, b"Hi there\x00\x7f")
+    assert list(ram.iter_hex_dump(0, 96)) == [
+        "00000000  00 48 69 20 74 68 65 72 65 00 7F 00" + " " * 14 + "|.Hi there...|"]
+    assert list(ram.iter_bytes(8, 24)) == [b"Hi"]
+
+
+def test_string_variables_and_conversions_are_latin_1_bytes():
+    ram = Ram(512)
+    ram.new_variable_string("s", "héllo")
+    assert ram.get_variable_string("s") == "héllo" and ram.variables["s"][1] == 40
+    ram.set_variable_string("s", "hi")
+    assert ram.get_variable_string("s") == "hi\x00\x00\x00"
+    with pytest.raises(Exception, match="new string is larger than allocated space."):
+        ram.set_variable_string("s", "too long")
+    assert ram.convert_string_to_bin("é") == [1, 1, 1, 0, 1, 0, 0, 1]
+    assert ram.convert_bin_to_string([0, 1, 0, 0, 0, 0, 0, 1, 1, 0, 1]) == "A\x05"
+
+
+# stats and hooks
+
+
+def test_stats_are_opt_in_and_leave_the_plain_methods_behind():
+    ram = Ram(256)
+    plain = set(vars(ram))
+    assert ram.stats()["operations"] == {}
+    ram.enable_stats()
+    assert "write_int" in vars(ram) and "_claim" in vars(ram)
+    ram.write_int(0, 8, 5)
+    ram.disable_stats()
+    assert set(vars(ram)) == plain
+    ram.write_int(0, 8, 6)
+    assert ram.stats()["operations"]["write_int"]["calls"] == 1
+    ram.enable_stats()
+    ram.write_int(0, 8, 7)
+    assert ram.stats()["operations"]["write_int"]["calls"] == 2
+    ram.reset_stats()
+    assert ram.stats()["operations"] == {}
+
+
+def test_stats_count_calls_bits_and_errors():
+    ram = Ram(1024)
+    ram.enable_stats()
+    ram.new_variable("x", 32, 1)
+    ram["x"] += 2
+    assert ram["x"] == 3
+    ram.write_bytes(64, b"abc")
+    ram.read(64, 24)
+    ram.set_permissions(128, 8, write=False)
+    operations = ram.stats()["operations"]
+    assert operations["new_variable"]["bits"] == 32
+    assert operations["get_variable"] == dict(operations["get_variable"], calls=2, bits=64, errors=0)
+    assert operations["write_bytes"]["bits"] == 24 and operations["read"]["bits"] == 24
+    assert operations["set_permissions"]["bits"] == 8
+    ram.reset_stats()
+    with pytest.raises(Exception, match="write permission denied"):
+        ram.write_int(128, 8, 1)
+    assert ram.stats()["operations"]["write_int"] == dict(ram.stats()["operations"]["write_int"],
+                                                          calls=1, bits=0, errors=1)
+
+
+def test_stats_follow_allocations_and_repairs():
+    ram = Ram(256, redundancy="tmr")
+    ram.enable_stats()
+    for _ in range(4):
+        ram.allocate_left(32)
+    ram.free(32, 32)
+    ram.allocate_best(64)
+    with pytest.raises(Exception, match="not enough memory."):
+        ram.allocate(1000)
+    allocation = ram.stats()["allocation"]
+    assert allocation["attempts"] == 6 and allocation["failures"] == 1
+    assert allocation["failure_reasons"] == {"not enough memory.": 1}
+    assert allocation["requested_bits"] == 4 * 32 + 64 + 1000
+    assert allocation["max_scanned_extents"] >= 1
+    ram.memory[3] ^= 1
+    ram.memory[200] ^= 1
+    assert len(ram.compare_memory()) == 2 and ram.correct() == 2
+    report = ram.stats()
+    assert report["mismatched_bits"] == 2 and report["repaired_bits"] == 2
+
+
+def test_hooks_get_events_until_removed():
+    ram = Ram(512)
+    events, allocations = [], []
+    with pytest.raises(Exception, match="no hook for 'nope'."):
+        ram.add_hook("nope", events.append)
+    ram.add_hook("write_int", events.append)
+    ram.add_hook("allocation", allocations.append)
+    ram.write_int(8, 16, 300)
+    position = ram.allocate_left(24)
+    assert events == [dict(events[0], operation="write_int", result=None, error=None, bits=16)]
+    assert events[0]["arguments"] == {"position": 8, "length": 16, "value": 300}
+    assert allocations == [dict(allocations[0], size=24, position=position, error=None)]
+    ram.remove_hook("write_int", events.append)
+    ram.write_int(8, 16, 1)
+    assert len(events) == 1 and ram.stats()["operations"]["write_int"]["calls"] == 2
+
+
+def test_stats_count_scans_to_their_end_and_the_variable_permission_checks():
+    ram = Ram(1024)
+    ram.new_variable("x", 32, 1)
+    ram.enable_stats()
+    ram.scan_for_pattern("1", 0, 0)
+    ram.scan_for_pattern("1", 100)
+    ram.scan_for_patterns(["1", "01"], 10, 50)
+    operations = ram.stats()["operations"]
+    assert operations["scan_for_pattern"]["bits"] == 924 and operations["scan_for_patterns"]["bits"] == 40
+    # with stats on, int variables leave the fast path so their permission checks are counted
+    ram["x"] = ram["x"] + 1
+    assert ram["x"] == 2
+    operations = ram.stats()["operations"]
+    assert operations["check_permissions"] == dict(operations["check_permissions"], calls=3, bits=96)
+    ram.disable_stats()
+    ram["x"] = 5
+    assert ram["x"] == 5 and ram.stats()["operations"]["check_permissions"]["calls"] == 3